@@ -0,0 +1,188 @@
+"""
+Admission Queue
+Bounded priority queue for requests that arrive while every provider is
+rate limited. A waiting request is dispatched as soon as a provider can
+take it, or rejected once its deadline has passed (or right away when the
+router already knows the deadline can't be met, or that none of the
+providers it may use will ever take it). Each request waits for the
+providers it can use; capacity goes to the first queued request that
+can use it, so a request waiting for one provider doesn't hold up
+requests another provider can serve. Within a priority,
+requests are ordered by weighted fair queuing over their tenants: each
+gets a virtual finish time of its tenant's previous finish plus its
+tokens divided by the tenant's weight.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+
+import metrics
+
+queue_settings = {
+    'enabled': os.environ.get('AI_ROUTER_QUEUE', '1') == '1',
+    'max_depth': int(os.environ.get('AI_ROUTER_QUEUE_MAX_DEPTH', 1000)),
+    # How long a request without its own deadline may wait (seconds)
+    'max_wait': float(os.environ.get('AI_ROUTER_QUEUE_MAX_WAIT_SECONDS', 30)),
+    'poll_interval': 0.25  # how often time-based capacity (bucket refills, recoveries) is rechecked
+}
+
+queue_stats = {'depth': 0, 'queued': 0, 'dispatched': 0, 'expired': 0, 'rejected': 0}
+
+_heap = []  # (-priority, virtual finish time, sequence, waiter)
+_sequence = itertools.count()
+_fair = {'virtual_time': 0.0, 'finish': {}}  # tenant -> virtual finish time of its last queued request
+_lock = threading.Lock()
+_capacity = None  # callable(tokens, providers) -> True if one of the providers can take the call now
+_ticker = None
+
+def configure(capacity_check):
+    """Set the function that tells whether one of a request's providers has capacity for tokens"""
+    global _capacity
+    _capacity = capacity_check
+
+def waiting():
+    """True if requests are queued (new arrivals then queue behind them)"""
+    return queue_stats['depth'] > 0
+
+def rejection(deadline, estimated_wait):
+    """Why a request can't wait in the queue, or None if it can.
+    
+    estimated_wait is None when no provider the request may use will ever take it.
+    """
+    if estimated_wait is None:
+        return 'no_provider'
+    if not queue_settings['enabled']:
+        return 'queue_disabled'
+    if queue_stats['depth'] >= queue_settings['max_depth']:
+        return 'queue_full'
+    if estimated_wait is not None and time.time() + estimated_wait > deadline:
+        return 'deadline'
+    return None
+
+def reject(reason):
+    with _lock:
+        queue_stats['rejected'] += 1
+    metrics.inc('ai_router_queue_rejections_total', (('reason', reason),))
+
+def _enqueue(tokens, priority, deadline, wake, tenant, weight, providers):
+    waiter = {
+        'tokens': tokens, 'providers': providers, 'deadline': deadline, 'wake': wake,
+        'state': 'waiting', 'enqueued_at': time.time()
+    }
+    with _lock:
+        start = max(_fair['virtual_time'], _fair['finish'].get(tenant, 0.0))
+        waiter['finish'] = _fair['finish'][tenant] = start + max(tokens, 1) / weight
+        heapq.heappush(_heap, (-priority, waiter['finish'], next(_sequence), waiter))
+        queue_stats['depth'] += 1
+        queue_stats['queued'] += 1
+    _start_ticker()
+    return waiter
+
+def _finish(waiter, timed_out):
+    """Settle a waiter after it woke up or timed out; returns its outcome"""
+    with _lock:
+        if waiter['state'] == 'waiting':
+            waiter['state'] = 'expired' if timed_out else 'granted'
+            queue_stats['depth'] -= 1
+            queue_stats['expired' if timed_out else 'dispatched'] += 1
+        outcome = waiter['state']
+    metrics.observe('ai_router_queue_wait_seconds', time.time() - waiter['enqueued_at'], (('outcome', outcome),))
+    return outcome
+
+def wait(tokens, priority, deadline, tenant=None, weight=1.0, providers=None):
+    """Block until one of providers (None = any) can take the request; returns 'granted' or 'expired'"""
+    event = threading.Event()
+    waiter = _enqueue(tokens, priority, deadline, event.set, tenant, weight, providers)
+    dispatch()
+    woke = event.wait(max(deadline - time.time(), 0))
+    return _finish(waiter, not woke)
+
+async def wait_async(tokens, priority, deadline, tenant=None, weight=1.0, providers=None):
+    """Async variant of wait"""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def wake():
+        loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+    waiter = _enqueue(tokens, priority, deadline, wake, tenant, weight, providers)
+    dispatch()
+    try:
+        await asyncio.wait_for(future, max(deadline - time.time(), 0))
+        timed_out = False
+    except asyncio.TimeoutError:
+        timed_out = True
+    return _finish(waiter, timed_out)
+
+def _next_servable(waiters):
+    """First of waiters (in queue order) that one of its providers can take now"""
+    if _capacity is None:
+        return None
+    blocked = {}  # providers -> fewest tokens they couldn't take in this pass
+    for waiter in waiters:
+        providers = tuple(waiter['providers']) if waiter['providers'] is not None else None
+        if providers in blocked and waiter['tokens'] >= blocked[providers]:
+            continue
+        if _capacity(waiter['tokens'], waiter['providers']):
+            return waiter
+        blocked[providers] = min(blocked.get(providers, waiter['tokens']), waiter['tokens'])
+    return None
+
+def dispatch():
+    """Grant the first queued request that a provider can take now"""
+    with _lock:
+        while _heap and _heap[0][-1]['state'] != 'waiting':
+            heapq.heappop(_heap)
+        if not _heap:
+            # Queue drained: the next busy period starts from scratch
+            _fair['virtual_time'] = 0.0
+            _fair['finish'].clear()
+            return
+        waiters = [entry[-1] for entry in sorted(_heap) if entry[-1]['state'] == 'waiting']
+
+    waiter = _next_servable(waiters)
+    if waiter is None:
+        return
+
+    with _lock:
+        if waiter['state'] != 'waiting':
+            return
+        # Granted entries behind the head are dropped once they reach it
+        _fair['virtual_time'] = max(_fair['virtual_time'], waiter['finish'])
+        waiter['state'] = 'granted'
+        queue_stats['depth'] -= 1
+        queue_stats['dispatched'] += 1
+    waiter['wake']()
+
+def notify():
+    """Capacity may have changed; hand it to the next queued request"""
+    if queue_stats['depth']:
+        dispatch()
+
+def _tick():
+    while True:
+        time.sleep(queue_settings['poll_interval'])
+        if queue_stats['depth']:
+            try:
+                dispatch()
+            except Exception as e:
+                print(f"⚠️ Admission queue dispatch failed: {e}")
+
+def _start_ticker():
+    """Start the background thread that rechecks time-based capacity"""
+    global _ticker
+    if _ticker is not None and _ticker.is_alive():
+        return
+    with _lock:
+        if _ticker is None or not _ticker.is_alive():
+            _ticker = threading.Thread(target=_tick, name='admission-queue', daemon=True)
+            _ticker.start()
+
+def stats():
+    """Queue counters for /status"""
+    with _lock:
+        return dict(queue_stats, enabled=queue_settings['enabled'], max_depth=queue_settings['max_depth'])
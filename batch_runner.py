@@ -0,0 +1,227 @@
+"""
+Batch Runner
+Streams JSONL requests through the router with bounded concurrency and
+writes JSONL results in completion order. Lines are numbered from 1, as
+in an editor. File-backed batches keep a checkpoint next to the output so
+an interrupted run can be resumed.
+"""
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+batch_settings = {
+    'concurrency': int(os.environ.get('AI_ROUTER_BATCH_CONCURRENCY', 8)),
+    'max_concurrency': int(os.environ.get('AI_ROUTER_BATCH_MAX_CONCURRENCY', 64)),
+    'checkpoint_every': 100,  # results between checkpoint writes
+    'batch_dir': os.environ.get('AI_ROUTER_BATCH_DIR', 'batches')
+}
+
+def parse_line(line_number, line):
+    """Decode one JSONL line; returns (record, error_result)"""
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', errors='replace')
+    line = line.strip()
+    if not line:
+        return None, None
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return None, {'line': line_number, 'success': False, 'error': f'Invalid JSON: {e}'}
+    if not isinstance(record, dict):
+        return None, {'line': line_number, 'success': False, 'error': 'Each line must be a JSON object'}
+    return record, None
+
+def batch_result(line_number, record, body, status_code):
+    """Result line for one processed record"""
+    result = dict(body, line=line_number, status_code=status_code)
+    if 'id' in record:
+        result['id'] = record['id']
+    return result
+
+def run_batch(lines, process, concurrency, skip=None):
+    """Process JSONL lines with at most concurrency requests in flight.
+
+    process(record) returns (body, status_code). Yields (line_number, result)
+    in completion order; result is None for blank or skipped lines.
+    """
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    futures = {}
+
+    def drain(return_when):
+        done, _ = wait(list(futures), return_when=return_when)
+        for future in done:
+            line_number, record = futures.pop(future)
+            try:
+                body, status_code = future.result()
+            except Exception as e:
+                body, status_code = {'success': False, 'error': str(e)}, 500
+            yield line_number, batch_result(line_number, record, body, status_code)
+
+    try:
+        for line_number, line in enumerate(lines, 1):
+            if skip and skip(line_number):
+                yield line_number, None
+                continue
+            record, error = parse_line(line_number, line)
+            if record is None:
+                yield line_number, error
+                continue
+
+            futures[executor.submit(process, record)] = (line_number, record)
+            if len(futures) >= concurrency:
+                yield from drain(FIRST_COMPLETED)
+
+        while futures:
+            yield from drain(FIRST_COMPLETED)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+async def run_batch_async(lines, process, concurrency, skip=None):
+    """Async variant of run_batch; lines is an async iterator, process a coroutine"""
+    tasks = {}
+
+    async def drain():
+        done, _ = await asyncio.wait(list(tasks), return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            line_number, record = tasks.pop(task)
+            try:
+                body, status_code = task.result()
+            except Exception as e:
+                body, status_code = {'success': False, 'error': str(e)}, 500
+            yield line_number, batch_result(line_number, record, body, status_code)
+
+    try:
+        line_number = 0
+        async for line in lines:
+            line_number += 1
+            if skip and skip(line_number):
+                yield line_number, None
+                continue
+            record, error = parse_line(line_number, line)
+            if record is None:
+                yield line_number, error
+                continue
+
+            tasks[asyncio.ensure_future(process(record))] = (line_number, record)
+            if len(tasks) >= concurrency:
+                async for item in drain():
+                    yield item
+
+        while tasks:
+            async for item in drain():
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+# ---------------------------------------------------------------------------
+# Checkpoints: the output file is the source of truth; the checkpoint file
+# records the low-water mark below which every line is already settled.
+# ---------------------------------------------------------------------------
+
+def checkpoint_path(output_path):
+    return output_path + '.checkpoint'
+
+def _read_checkpoint(output_path):
+    try:
+        with open(checkpoint_path(output_path)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _repair_output(output_path):
+    """Drop a partially written last line left by a crash"""
+    try:
+        with open(output_path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+    except FileNotFoundError:
+        pass
+
+def start_checkpoint(output_path, retry_failed=False):
+    """Open a file-backed batch, resuming from a previous run if there was one"""
+    _repair_output(output_path)
+    checkpoint = _read_checkpoint(output_path)
+    low_water = 1 if retry_failed else checkpoint.get('next_line', 1)
+
+    done = set()
+    counts = {'succeeded': 0, 'failed': 0}
+    try:
+        with open(output_path) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                counts['succeeded' if result.get('success') else 'failed'] += 1
+                if result.get('line', 0) >= low_water and (result.get('success') or not retry_failed):
+                    done.add(result['line'])
+    except FileNotFoundError:
+        pass
+
+    if retry_failed:
+        counts['failed'] = 0
+
+    state = {
+        'output_path': output_path,
+        'file': open(output_path, 'a'),
+        'low_water': low_water,
+        'done': done,
+        'next_line': 1,
+        'settled': set(),
+        'succeeded': counts['succeeded'],
+        'failed': counts['failed'],
+        'resumed': len(done) + low_water - 1,
+        'written': 0,
+        'started_at': time.time()
+    }
+    state['skip'] = lambda line_number: line_number < state['low_water'] or line_number in state['done']
+    return state
+
+def _write_checkpoint(state, finished=False):
+    checkpoint = {
+        'output': state['output_path'],
+        'next_line': state['next_line'],
+        'succeeded': state['succeeded'],
+        'failed': state['failed'],
+        'finished': finished,
+        'updated_at': time.time()
+    }
+    temp_path = checkpoint_path(state['output_path']) + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, checkpoint_path(state['output_path']))
+
+def checkpoint_result(state, line_number, result):
+    """Append a result to the output and advance the checkpoint"""
+    if result is not None:
+        state['file'].write(json.dumps(result, ensure_ascii=False) + '\n')
+        state['file'].flush()
+        state['written'] += 1
+        state['succeeded' if result.get('success') else 'failed'] += 1
+
+    # Advance the low-water mark over every settled line
+    state['settled'].add(line_number)
+    while state['next_line'] in state['settled']:
+        state['settled'].discard(state['next_line'])
+        state['next_line'] += 1
+
+    if result is not None and state['written'] % batch_settings['checkpoint_every'] == 0:
+        _write_checkpoint(state)
+
+def finish_checkpoint(state):
+    """Close a file-backed batch and return its summary"""
+    state['file'].close()
+    _write_checkpoint(state, finished=not state['settled'])
+    return {
+        'output': state['output_path'],
+        'written': state['written'],
+        'resumed': state['resumed'],
+        'succeeded': state['succeeded'],
+        'failed': state['failed'],
+        'elapsed_seconds': round(time.time() - state['started_at'], 2)
+    }
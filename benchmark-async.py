@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Async vs Flask Benchmark
+Runs the router in Flask mode and in async mode against a local mock
+provider and compares throughput and latency at the same concurrency.
+
+Usage:
+    python benchmark-async.py --requests 2000 --concurrency 500 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROUTER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'simple-ai-router.py')
+
+def mock_upstream_app(latency):
+    """ASGI app that answers like the providers after a fixed delay"""
+    async def app(scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        more_body = True
+        while more_body:
+            message = await receive()
+            more_body = message.get('more_body', False)
+
+        await asyncio.sleep(latency)
+
+        if 'generateContent' in scope['path']:
+            body = {
+                'candidates': [{'content': {'parts': [{'text': 'mock response'}]}}],
+                'usageMetadata': {'totalTokenCount': 12}
+            }
+        else:
+            body = {
+                'choices': [{'message': {'content': 'mock response'}}],
+                'model': 'mock-model',
+                'usage': {'total_tokens': 12}
+            }
+        payload = json.dumps(body).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'application/json')]
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+    return app
+
+def run_mock_upstream(port, latency):
+    """Serve the mock provider (runs in its own process)"""
+    import uvicorn
+    uvicorn.run(mock_upstream_app(latency), host='127.0.0.1', port=port, log_level='warning', backlog=4096)
+
+def wait_for(url, timeout=15):
+    """Wait until a server answers on url"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return True
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    return False
+
+async def run_load(url, total, concurrency):
+    """Send total requests with at most concurrency in flight"""
+    latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def one(i):
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, json={'prompt': f'benchmark {i}', 'max_tokens': 50})
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                if not ok:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    return {
+        'requests': total,
+        'failures': failures,
+        'elapsed_seconds': round(elapsed, 2),
+        'throughput_rps': round(total / elapsed, 1),
+        'p50_ms': round(percentile(0.50) * 1000, 1),
+        'p99_ms': round(percentile(0.99) * 1000, 1)
+    }
+
+def benchmark_mode(mode, router_port, upstream_url, args):
+    """Start the router in one mode, load it and stop it"""
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(router_port),
+        'GITHUB_TOKEN': env.get('GITHUB_TOKEN', 'benchmark'),
+        'OPENROUTER_API_KEY': env.get('OPENROUTER_API_KEY', 'benchmark'),
+        'GOOGLE_API_KEY': env.get('GOOGLE_API_KEY', 'benchmark'),
+        'GITHUB_MODELS_BASE_URL': upstream_url,
+        'OPENROUTER_BASE_URL': upstream_url,
+        'GOOGLE_GEMINI_BASE_URL': upstream_url,
+        # Measure the serving engine, not the free-tier limits, the cache or state left by an earlier run
+        'AI_ROUTER_RATE_LIMITS': env.get('AI_ROUTER_RATE_LIMITS', 'off'),
+        'AI_ROUTER_CACHE': env.get('AI_ROUTER_CACHE', '0'),
+        'AI_ROUTER_SNAPSHOT_PATH': env.get('AI_ROUTER_SNAPSHOT_PATH', ''),
+        'AI_ROUTER_PROBE': env.get('AI_ROUTER_PROBE', '0')
+    })
+    command = [sys.executable, ROUTER_SCRIPT]
+    if mode == 'async':
+        command.append('--async')
+
+    router = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for(f'http://127.0.0.1:{router_port}/status'):
+            raise RuntimeError(f'{mode} router did not start')
+        url = f'http://127.0.0.1:{router_port}/ai-request'
+        return asyncio.run(run_load(url, args.requests, args.concurrency))
+    finally:
+        router.terminate()
+        router.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare Flask and async serving modes')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.5, help='mock provider latency in seconds')
+    parser.add_argument('--upstream-port', type=int, default=9911)
+    parser.add_argument('--router-port', type=int, default=5911)
+    parser.add_argument('--modes', default='flask,async')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--mock-upstream', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mock_upstream:
+        run_mock_upstream(args.upstream_port, args.latency)
+        return
+
+    print("🏁 Router Benchmark: Flask vs Async")
+    print("=" * 50)
+    print(f"Requests: {args.requests}, concurrency: {args.concurrency}, provider latency: {args.latency}s")
+
+    upstream = subprocess.Popen([
+        sys.executable, os.path.abspath(__file__), '--mock-upstream',
+        '--upstream-port', str(args.upstream_port), '--latency', str(args.latency)
+    ])
+    upstream_url = f'http://127.0.0.1:{args.upstream_port}'
+    results = {}
+    try:
+        if not wait_for(upstream_url):
+            print("❌ Mock provider did not start")
+            return
+        for mode in args.modes.split(','):
+            print(f"\n⏱️  Benchmarking {mode} mode...")
+            results[mode] = benchmark_mode(mode, args.router_port, upstream_url, args)
+            print(f"   {results[mode]}")
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+    print("\n" + "=" * 50)
+    print("📊 SUMMARY:")
+    print(f"  {'mode':<8}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}{'failed':>8}")
+    for mode, result in results.items():
+        print(f"  {mode:<8}{result['throughput_rps']:>10}{result['p50_ms']:>10}{result['p99_ms']:>10}{result['failures']:>8}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Router Load Test
+Starts local stand-ins for GitHub Models, OpenRouter and Gemini (with
+latency distributions, 429 rates and outages), drives open-loop load at a
+target rate against the router and reports throughput, latency
+percentiles, failovers and wasted upstream calls.
+
+Usage:
+    python benchmark-load.py --scenario steady --rps 50 --duration 30
+    python benchmark-load.py --scenario outage --output results.json
+    python benchmark-load.py --scenario outage --compare results.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import httpx
+
+ROUTER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'simple-ai-router.py')
+
+PROVIDERS = ('github_models', 'openrouter', 'google_gemini')
+
+BASE_URL_VARS = {
+    'github_models': 'GITHUB_MODELS_BASE_URL',
+    'openrouter': 'OPENROUTER_BASE_URL',
+    'google_gemini': 'GOOGLE_GEMINI_BASE_URL'
+}
+
+# Per provider: lognormal latency (median and p99 in seconds), share of calls
+# answered with 429, and outages as [start, end] seconds after the mocks start
+# during which every call gets a 503.
+HEALTHY = {'latency': {'median': 0.3, 'p99': 1.0}, 'rate_429': 0.0, 'outages': []}
+
+SCENARIOS = {
+    'steady': {provider: HEALTHY for provider in PROVIDERS},
+    'rate_limited': {
+        'github_models': dict(HEALTHY, rate_429=0.3),
+        'openrouter': dict(HEALTHY, rate_429=0.1),
+        'google_gemini': HEALTHY
+    },
+    'outage': {
+        'github_models': dict(HEALTHY, outages=[[5, 15]]),
+        'openrouter': HEALTHY,
+        'google_gemini': HEALTHY
+    },
+    'slow_primary': {
+        'github_models': dict(HEALTHY, latency={'median': 1.5, 'p99': 6.0}),
+        'openrouter': HEALTHY,
+        'google_gemini': HEALTHY
+    }
+}
+
+def load_scenario(name):
+    """A built-in scenario by name, or a JSON file with the same shape"""
+    if name in SCENARIOS:
+        scenario = SCENARIOS[name]
+    else:
+        with open(name) as f:
+            scenario = json.load(f)
+    return {provider: dict(HEALTHY, **scenario.get(provider, {})) for provider in PROVIDERS}
+
+# ---------------------------------------------------------------------------
+# Mock providers
+# ---------------------------------------------------------------------------
+
+def sample_latency(latency):
+    """Draw a latency from a lognormal distribution given its median and p99"""
+    mu = math.log(latency['median'])
+    sigma = max(math.log(latency['p99']) - mu, 0.0) / 2.326
+    return random.lognormvariate(mu, sigma)
+
+def mock_provider_app(provider, config, started_at):
+    """ASGI app that answers like one provider, following its scenario config"""
+    stats = {'calls': 0, 'ok': 0, 'rate_limited': 0, 'outage': 0}
+
+    async def app(scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        more_body = True
+        while more_body:
+            message = await receive()
+            more_body = message.get('more_body', False)
+
+        if scope['method'] == 'GET' and scope['path'] == '/stats':
+            return await respond(send, 200, stats)
+        if scope['method'] != 'POST':
+            # Only completions count as upstream calls (not health probes)
+            return await respond(send, 404, {'error': 'not found'})
+
+        stats['calls'] += 1
+        elapsed = time.time() - started_at
+        if any(start <= elapsed < end for start, end in config['outages']):
+            stats['outage'] += 1
+            return await respond(send, 503, {'error': 'service unavailable'})
+
+        await asyncio.sleep(sample_latency(config['latency']))
+
+        if random.random() < config['rate_429']:
+            stats['rate_limited'] += 1
+            return await respond(send, 429, {'error': 'rate limit exceeded'})
+
+        stats['ok'] += 1
+        if provider == 'google_gemini':
+            body = {
+                'candidates': [{'content': {'parts': [{'text': 'mock response'}]}}],
+                'usageMetadata': {'totalTokenCount': 12}
+            }
+        else:
+            body = {
+                'choices': [{'message': {'content': 'mock response'}}],
+                'model': f'mock-{provider}',
+                'usage': {'total_tokens': 12}
+            }
+        await respond(send, 200, body)
+
+    return app
+
+async def respond(send, status, body):
+    payload = json.dumps(body).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json')]
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+def run_mock_providers(base_port, scenario):
+    """Serve one mock per provider on consecutive ports (runs in its own process)"""
+    import uvicorn
+
+    started_at = time.time()
+    servers = [
+        uvicorn.Server(uvicorn.Config(
+            mock_provider_app(provider, scenario[provider], started_at),
+            host='127.0.0.1', port=base_port + i, log_level='warning', backlog=4096
+        ))
+        for i, provider in enumerate(PROVIDERS)
+    ]
+
+    async def serve():
+        await asyncio.gather(*(server.serve() for server in servers))
+
+    asyncio.run(serve())
+
+# ---------------------------------------------------------------------------
+# Load generation
+# ---------------------------------------------------------------------------
+
+def wait_for(url, timeout=15):
+    """Wait until a server answers on url"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return True
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    return False
+
+async def open_loop_load(url, rps, duration, arrivals, timeout):
+    """Send requests on a fixed schedule, whether or not earlier ones finished.
+
+    Latency is measured from each request's scheduled start, so a backed-up
+    router shows up in the percentiles instead of slowing the load down.
+    """
+    results = []
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=1000)
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        async def one(i, scheduled):
+            try:
+                response = await client.post(url, json={'prompt': f'load test {i}', 'max_tokens': 50})
+                status = response.status_code
+                provider = response.json().get('provider') if status == 200 else None
+            except httpx.HTTPError as e:
+                status, provider = type(e).__name__, None
+            results.append({'status': status, 'provider': provider, 'latency': time.perf_counter() - scheduled})
+
+        tasks = []
+        started = time.perf_counter()
+        next_at = started
+        i = 0
+        while next_at < started + duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(one(i, next_at)))
+            i += 1
+            next_at += random.expovariate(rps) if arrivals == 'poisson' else 1.0 / rps
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    return results, elapsed
+
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def metric_total(metrics_text, name):
+    """Sum every sample of one metric in Prometheus text"""
+    total = 0.0
+    for line in metrics_text.splitlines():
+        if line.startswith(name + ' ') or line.startswith(name + '{'):
+            total += float(line.rsplit(' ', 1)[1])
+    return total
+
+def summarize(results, elapsed, router_url, mock_urls):
+    """Client-side results plus router and mock counters"""
+    succeeded = sorted(r['latency'] for r in results if r['status'] == 200)
+    statuses = {}
+    providers = {}
+    for r in results:
+        statuses[str(r['status'])] = statuses.get(str(r['status']), 0) + 1
+        if r['provider']:
+            providers[r['provider']] = providers.get(r['provider'], 0) + 1
+
+    metrics_text = httpx.get(f'{router_url}/metrics', timeout=10).text
+    status = httpx.get(f'{router_url}/status', timeout=10).json()
+    upstream = {provider: httpx.get(f'{url}/stats', timeout=10).json() for provider, url in mock_urls.items()}
+    upstream_calls = sum(stats['calls'] for stats in upstream.values())
+    answered_upstream = sum(count for provider, count in providers.items() if provider != 'cache')
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        'requests': len(results),
+        'succeeded': len(succeeded),
+        'success_rate': round(len(succeeded) / len(results), 4) if results else 0.0,
+        'statuses': statuses,
+        'answered_by': providers,
+        'elapsed_seconds': round(elapsed, 2),
+        'throughput_rps': round(len(results) / elapsed, 1),
+        'success_rps': round(len(succeeded) / elapsed, 1),
+        'p50_ms': ms(percentile(succeeded, 0.50)),
+        'p90_ms': ms(percentile(succeeded, 0.90)),
+        'p99_ms': ms(percentile(succeeded, 0.99)),
+        'p999_ms': ms(percentile(succeeded, 0.999)),
+        'max_ms': ms(succeeded[-1] if succeeded else None),
+        'retries': int(metric_total(metrics_text, 'ai_router_retries_total')),
+        'failovers': int(metric_total(metrics_text, 'ai_router_failovers_total')),
+        'hedged_requests': status['hedging']['hedged_requests'],
+        'upstream_calls': upstream_calls,
+        # Upstream calls that did not produce an answer a client received
+        'wasted_upstream_calls': upstream_calls - answered_upstream,
+        'upstream': upstream
+    }
+
+# ---------------------------------------------------------------------------
+# Regression comparison
+# ---------------------------------------------------------------------------
+
+# metric -> True if higher is better
+COMPARED = {
+    'success_rate': True,
+    'success_rps': True,
+    'p50_ms': False,
+    'p99_ms': False,
+    'failovers': False,
+    'wasted_upstream_calls': False
+}
+
+def compare(baseline, current, tolerance):
+    """Print the change of each compared metric; returns the regressed ones"""
+    regressions = []
+    print(f"\n🔍 Compared with baseline (tolerance {tolerance:.0%}):")
+    for name, higher_is_better in COMPARED.items():
+        old, new = baseline.get(name), current.get(name)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else (0.0 if new == old else float('inf'))
+        worse = -change if higher_is_better else change
+        regressed = worse > tolerance
+        if regressed:
+            regressions.append(name)
+        marker = '❌' if regressed else '✅'
+        print(f"  {marker} {name:<24}{old:>12} → {new:<12}({change:+.1%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Open-loop load test of the router against mock providers')
+    parser.add_argument('--scenario', default='steady', help=f"one of {', '.join(SCENARIOS)} or a JSON file")
+    parser.add_argument('--rps', type=float, default=20, help='target requests per second')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load')
+    parser.add_argument('--arrivals', choices=('uniform', 'poisson'), default='poisson')
+    parser.add_argument('--timeout', type=float, default=60, help='client timeout per request')
+    parser.add_argument('--router-args', default='', help="extra router arguments, e.g. '--async' or '--workers 4'")
+    parser.add_argument('--router-port', type=int, default=5921)
+    parser.add_argument('--mock-port', type=int, default=9921, help='first of three consecutive mock ports')
+    parser.add_argument('--seed', type=int, help='random seed for arrivals and mock behaviour')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare with the results JSON of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative regression for --compare')
+    parser.add_argument('--mock-providers', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    scenario = load_scenario(args.scenario)
+    if args.mock_providers:
+        run_mock_providers(args.mock_port, scenario)
+        return
+
+    print("🏋️ Router Load Test")
+    print("=" * 50)
+    print(f"Scenario: {args.scenario}, target: {args.rps} rps for {args.duration}s ({args.arrivals} arrivals)")
+
+    mock_command = [sys.executable, os.path.abspath(__file__), '--mock-providers',
+                    '--mock-port', str(args.mock_port), '--scenario', args.scenario]
+    if args.seed is not None:
+        mock_command += ['--seed', str(args.seed)]
+    mocks = subprocess.Popen(mock_command)
+    mock_urls = {provider: f'http://127.0.0.1:{args.mock_port + i}' for i, provider in enumerate(PROVIDERS)}
+
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(args.router_port),
+        'GITHUB_TOKEN': env.get('GITHUB_TOKEN', 'load-test'),
+        'OPENROUTER_API_KEY': env.get('OPENROUTER_API_KEY', 'load-test'),
+        'GOOGLE_API_KEY': env.get('GOOGLE_API_KEY', 'load-test'),
+        # Measure the router's routing, not the free-tier limits or the cache
+        'AI_ROUTER_RATE_LIMITS': env.get('AI_ROUTER_RATE_LIMITS', 'off'),
+        'AI_ROUTER_CACHE': env.get('AI_ROUTER_CACHE', '0'),
+        # Don't restore (or leave behind) drained buckets from another run
+        'AI_ROUTER_SNAPSHOT_PATH': env.get('AI_ROUTER_SNAPSHOT_PATH', ''),
+        # Background health probes would add upstream calls no request asked for
+        'AI_ROUTER_PROBE': env.get('AI_ROUTER_PROBE', '0')
+    })
+    for provider, url in mock_urls.items():
+        env[BASE_URL_VARS[provider]] = url
+    router = None
+
+    try:
+        if not all(wait_for(f'{url}/stats') for url in mock_urls.values()):
+            print("❌ Mock providers did not start")
+            sys.exit(1)
+
+        router = subprocess.Popen(
+            [sys.executable, ROUTER_SCRIPT] + args.router_args.split(),
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        router_url = f'http://127.0.0.1:{args.router_port}'
+        if not wait_for(f'{router_url}/status'):
+            print("❌ Router did not start")
+            sys.exit(1)
+
+        print("\n⏱️  Running load...")
+        results, elapsed = asyncio.run(open_loop_load(
+            f'{router_url}/ai-request', args.rps, args.duration, args.arrivals, args.timeout
+        ))
+        summary = summarize(results, elapsed, router_url, mock_urls)
+    finally:
+        for process in (router, mocks):
+            if process:
+                process.terminate()
+                process.wait()
+
+    print("\n" + "=" * 50)
+    print("📊 RESULTS:")
+    print(f"  Requests:        {summary['requests']} ({summary['success_rate']:.1%} succeeded) {summary['statuses']}")
+    print(f"  Throughput:      {summary['throughput_rps']} rps sent, {summary['success_rps']} rps succeeded")
+    print(f"  Latency (ms):    p50 {summary['p50_ms']}  p90 {summary['p90_ms']}  p99 {summary['p99_ms']}  max {summary['max_ms']}")
+    print(f"  Answered by:     {summary['answered_by']}")
+    print(f"  Retries:         {summary['retries']} ({summary['failovers']} failovers)")
+    print(f"  Upstream calls:  {summary['upstream_calls']} ({summary['wasted_upstream_calls']} wasted)")
+
+    report = {
+        'settings': {key: value for key, value in vars(args).items() if key != 'mock_providers'},
+        'scenario': scenario,
+        'results': summary,
+        'timestamp': datetime.now().isoformat()
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline['results'], summary, args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
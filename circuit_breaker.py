@@ -0,0 +1,115 @@
+"""
+Circuit Breaker
+Closed / open / half-open state per provider key. A failure opens the
+circuit until the time the provider asked for (Retry-After or
+x-ratelimit-reset headers) or, without headers, an exponential backoff
+with jitter. When that time has passed the circuit is half-open and a
+single probe decides whether it closes again.
+"""
+
+import os
+import random
+import re
+import time
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+breaker_settings = {
+    'base_delay': float(os.environ.get('AI_ROUTER_BREAKER_BASE_SECONDS', 2.0)),
+    'max_header_delay': 24 * 3600,  # never trust a header beyond a day
+    'probe_timeout': 30.0           # re-probe if a probe hasn't finished by then
+}
+
+RESET_HEADERS = ('x-ratelimit-reset', 'x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens')
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+def _parse_reset(value, now):
+    """Seconds until a reset given as epoch seconds/milliseconds, seconds or '6m0s'"""
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        parts = _DURATION_PART.findall(value)
+        if not parts or ''.join(amount + unit for amount, unit in parts) != value:
+            return None
+        return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+    if number > 1e12:
+        return number / 1000 - now  # epoch milliseconds (OpenRouter)
+    if number > 1e9:
+        return number - now         # epoch seconds (GitHub)
+    return number
+
+def _parse_retry_after(value, now):
+    """Retry-After as delta seconds or an HTTP date"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp() - now
+    except (TypeError, ValueError):
+        return None
+
+def retry_after_from_headers(headers):
+    """Seconds the provider asked us to wait, or None if it didn't say"""
+    if not headers:
+        return None
+    now = time.time()
+    delays = []
+    value = headers.get('retry-after')
+    if value:
+        delays.append(_parse_retry_after(value, now))
+    for name in RESET_HEADERS:
+        value = headers.get(name)
+        if value:
+            delays.append(_parse_reset(value, now))
+    delays = [delay for delay in delays if delay is not None]
+    if not delays:
+        return None
+    return min(max(max(delays), 0.0), breaker_settings['max_header_delay'])
+
+def backoff_delay(consecutive_failures, cap):
+    """Exponential backoff with jitter, capped at cap seconds"""
+    delay = min(cap, breaker_settings['base_delay'] * 2 ** max(consecutive_failures - 1, 0))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def new_entry():
+    """Breaker state of a key that has not failed yet"""
+    return {
+        'state': CLOSED,
+        'available': True,
+        'recovery_time': None,
+        'consecutive_failures': 0,
+        'requests': 0,
+        'failures': 0
+    }
+
+def trip(entry, delay):
+    """Open the circuit for delay seconds"""
+    entry['state'] = OPEN
+    entry['available'] = False
+    entry['consecutive_failures'] += 1
+    entry['failures'] += 1
+    entry['recovery_time'] = datetime.now() + timedelta(seconds=delay)
+
+def close(entry):
+    """Close the circuit after a successful probe"""
+    entry['state'] = CLOSED
+    entry['available'] = True
+    entry['recovery_time'] = None
+    entry['consecutive_failures'] = 0
+
+def ready_to_probe(entry, now):
+    """True when an open circuit (or a stalled probe) is due for a probe; now is a datetime"""
+    return entry['state'] != CLOSED and entry['recovery_time'] is not None and now >= entry['recovery_time']
+
+def start_probe(entry, now):
+    """Move to half-open; the key stays out of rotation until the probe is back"""
+    entry['state'] = HALF_OPEN
+    entry['recovery_time'] = now + timedelta(seconds=breaker_settings['probe_timeout'])
@@ -0,0 +1,108 @@
+"""
+Deadlines
+End-to-end request deadlines. A client can say how long it will wait (an
+X-Request-Timeout-Ms header or a "timeout_ms" field); the router splits
+the time that is left across the remaining attempts, derives each call's
+connect and read timeouts from it, and skips attempts (and providers)
+that can't finish in time instead of working on answers nobody will read.
+The same deadline bounds the request's wait in the admission queue.
+"""
+
+import os
+import time
+
+DEADLINE_HEADER = 'X-Request-Timeout-Ms'
+
+deadline_settings = {
+    # Budget of a request that doesn't set its own (3 attempts of 30s before deadlines existed)
+    'default_timeout': float(os.environ.get('AI_ROUTER_REQUEST_TIMEOUT_SECONDS', 90)),
+    'max_timeout': float(os.environ.get('AI_ROUTER_MAX_REQUEST_TIMEOUT_SECONDS', 600)),
+    # Longest single provider call, and longest wait for its connection
+    'attempt_timeout': float(os.environ.get('AI_ROUTER_ATTEMPT_TIMEOUT_SECONDS', 30)),
+    'connect_timeout': float(os.environ.get('AI_ROUTER_CONNECT_TIMEOUT_SECONDS', 5))
+}
+
+deadline_stats = {'expired': 0, 'skipped_providers': 0, 'cancelled': 0}
+
+def timeout_field(data):
+    """The "timeout_ms" of a request body ("deadline_ms" is its older name), or None"""
+    if not isinstance(data, dict):
+        return None
+    return data['timeout_ms'] if 'timeout_ms' in data else data.get('deadline_ms')
+
+def request_deadline(header_value, data, start_time):
+    """Absolute deadline of a request from the header or "timeout_ms"; raises ValueError"""
+    timeout_ms = timeout_field(data)
+    if header_value is not None:
+        try:
+            timeout_ms = float(header_value)
+        except ValueError:
+            raise ValueError(f'{DEADLINE_HEADER} must be a number of milliseconds')
+    if timeout_ms is None:
+        return start_time + deadline_settings['default_timeout']
+    if isinstance(timeout_ms, bool) or not isinstance(timeout_ms, (int, float)) or timeout_ms <= 0:
+        raise ValueError('timeout_ms must be a positive number')
+    return start_time + min(timeout_ms / 1000, deadline_settings['max_timeout'])
+
+def remaining(deadline, now=None):
+    """Seconds left before the deadline"""
+    return deadline - (time.time() if now is None else now)
+
+def attempt_timeouts(deadline, attempts_left, expected_latency=None, now=None, first=False):
+    """(connect, read) timeouts of the next attempt, or None when it can't finish in time.
+
+    The time left is split evenly across the attempts still allowed, but an
+    attempt may use up to twice the provider's expected latency (if the
+    deadline allows) so a slow provider isn't set up to fail. A retry is not
+    started with less time left than the provider's expected latency; the
+    first attempt always is, while any time is left.
+    """
+    left = remaining(deadline, now)
+    if left <= 0 or (not first and expected_latency and left < expected_latency):
+        return None
+    budget = left / max(attempts_left, 1)
+    if expected_latency:
+        budget = max(budget, min(expected_latency * 2, left))
+    read = min(budget, deadline_settings['attempt_timeout'])
+    return min(deadline_settings['connect_timeout'], read), read
+
+def default_timeouts():
+    """(connect, read) timeouts of a call made without a request deadline"""
+    return deadline_settings['connect_timeout'], deadline_settings['attempt_timeout']
+
+def too_slow(expected_latencies, deadline, now=None, counted=None):
+    """Providers whose expected latency is longer than the time left.
+    
+    counted is the set of providers already counted as skipped for this
+    request (updated here), so each is counted once however often it is checked.
+    """
+    left = remaining(deadline, now)
+    slow = tuple(provider for provider, latency in expected_latencies.items() if latency and latency > left)
+    new = [provider for provider in slow if counted is None or provider not in counted]
+    deadline_stats['skipped_providers'] += len(new)
+    if counted is not None:
+        counted.update(new)
+    return slow
+
+def shortened(timeouts):
+    """True if a call's read timeout was cut below the normal attempt timeout by the deadline"""
+    return timeouts is not None and timeouts[1] < deadline_settings['attempt_timeout']
+
+def expired():
+    deadline_stats['expired'] += 1
+
+def cancelled():
+    deadline_stats['cancelled'] += 1
+
+def deadline_exceeded():
+    """Error body for a request whose deadline passed before an answer"""
+    return {
+        'success': False,
+        'error': 'Request deadline exceeded',
+        'message': 'No provider could answer within the request timeout',
+        'reason': 'deadline'
+    }
+
+def stats():
+    """Deadline counters and settings for /status"""
+    return dict(deadline_stats, **{key: value for key, value in deadline_settings.items()})
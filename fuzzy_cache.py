@@ -0,0 +1,186 @@
+"""
+Fuzzy Cache
+Near-duplicate prompt index in front of the upstream call. Prompts are
+normalized (IDs, timestamps and whitespace masked), shingled and
+MinHashed; LSH bands find candidates whose estimated similarity is then
+compared with the request's threshold. A sample of fuzzy hits is still
+sent upstream to measure how often a fuzzy answer differs from the real
+one (the false-positive rate).
+"""
+
+import hashlib
+import os
+import random
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+fuzzy_settings = {
+    'enabled': os.environ.get('AI_ROUTER_FUZZY_CACHE', '0') == '1',  # per-request "fuzzy_threshold" overrides
+    'threshold': float(os.environ.get('AI_ROUTER_FUZZY_THRESHOLD', 0.9)),
+    'max_entries': int(os.environ.get('AI_ROUTER_FUZZY_MAX_ENTRIES', 5000)),
+    'ttl_seconds': float(os.environ.get('AI_ROUTER_FUZZY_TTL_SECONDS', 3600)),
+    # Share of fuzzy hits that still go upstream to check the answer
+    'verify_rate': float(os.environ.get('AI_ROUTER_FUZZY_VERIFY_RATE', 0.05)),
+    'bands': 16,
+    'rows': 4,            # bands * rows = signature length
+    'shingle_size': 3,    # words per shingle
+    'max_shingles': 2000  # longer prompts are indexed by their beginning
+}
+
+_MERSENNE = (1 << 61) - 1
+_random = random.Random(42)  # fixed so every worker computes the same signatures
+_PERMUTATIONS = [
+    (_random.randrange(1, _MERSENNE), _random.randrange(0, _MERSENNE))
+    for _ in range(fuzzy_settings['bands'] * fuzzy_settings['rows'])
+]
+
+# Variable parts of templated prompts, most specific first. Other numbers
+# are kept: "What is 2+2" and "What is 3+5" must not share an answer.
+_MASKS = [
+    (re.compile(r'\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b'), ' <id> '),
+    (re.compile(r'\b\d{4}-\d{2}-\d{2}(?:[t ]\d{2}:\d{2}(?::\d{2})?(?:\.\d+)?(?:z|[+-]\d{2}:?\d{2})?)?\b'), ' <time> '),
+    (re.compile(r'\b\d{1,2}:\d{2}(?::\d{2})?\b'), ' <time> '),
+    (re.compile(r'\b1\d{9}(?:\d{3})?\b'), ' <time> '),  # epoch seconds or milliseconds
+    (re.compile(r'\b(?=[0-9a-f]*\d)[0-9a-f]{12,}\b'), ' <id> ')
+]
+_TOKEN = re.compile(r'<\w+>|\w+')
+
+_entries = OrderedDict()  # entry id -> {'scope', 'signature', 'value', 'expires_at'}
+_buckets = {}             # (scope, band, band hash) -> set of entry ids
+_ids = {}                 # (scope, signature) -> entry id, so a prompt is indexed once
+_lock = threading.Lock()
+_next_id = 0
+
+fuzzy_counters = {
+    'lookups': 0,
+    'hits': 0,
+    'candidates': 0,           # entries LSH proposed
+    'candidate_rejections': 0, # proposed entries below the similarity threshold
+    'stores': 0,
+    'evictions': 0,
+    'verified': 0,
+    'mismatches': 0
+}
+
+def normalize(prompt):
+    """Lowercase the prompt and mask the parts that vary between templated copies"""
+    text = prompt.lower()
+    for pattern, placeholder in _MASKS:
+        text = pattern.sub(placeholder, text)
+    return _TOKEN.findall(text)
+
+def _shingles(tokens):
+    size = fuzzy_settings['shingle_size']
+    if len(tokens) < size:
+        return {' '.join(tokens)}
+    count = min(len(tokens) - size + 1, fuzzy_settings['max_shingles'])
+    return {' '.join(tokens[i:i + size]) for i in range(count)}
+
+def signature(prompt):
+    """MinHash signature of a prompt"""
+    hashes = [
+        struct.unpack('<Q', hashlib.blake2b(shingle.encode(), digest_size=8).digest())[0]
+        for shingle in _shingles(normalize(prompt))
+    ]
+    return tuple(min((a * h + b) % _MERSENNE for h in hashes) for a, b in _PERMUTATIONS)
+
+def similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / len(signature_a)
+
+def _bands(scope, sig):
+    rows = fuzzy_settings['rows']
+    return [(scope, band, hash(sig[band * rows:(band + 1) * rows])) for band in range(fuzzy_settings['bands'])]
+
+def _remove_locked(entry_id):
+    entry = _entries.pop(entry_id)
+    _ids.pop((entry['scope'], entry['signature']), None)
+    for band_key in _bands(entry['scope'], entry['signature']):
+        members = _buckets.get(band_key)
+        if members is not None:
+            members.discard(entry_id)
+            if not members:
+                del _buckets[band_key]
+
+def lookup(prompt, scope, threshold):
+    """Best stored value for a similar prompt in the same scope: (value, similarity) or (None, 0.0)"""
+    sig = signature(prompt)
+    now = time.time()
+    best_id, best_similarity = None, 0.0
+    with _lock:
+        fuzzy_counters['lookups'] += 1
+        candidates = set()
+        for band_key in _bands(scope, sig):
+            candidates |= _buckets.get(band_key, set())
+        for entry_id in candidates:
+            entry = _entries[entry_id]
+            fuzzy_counters['candidates'] += 1
+            if entry['expires_at'] <= now:
+                continue
+            estimate = similarity(sig, entry['signature'])
+            if estimate < threshold:
+                fuzzy_counters['candidate_rejections'] += 1
+            elif estimate > best_similarity:
+                best_id, best_similarity = entry_id, estimate
+        if best_id is None:
+            return None, 0.0
+        _entries.move_to_end(best_id)
+        fuzzy_counters['hits'] += 1
+        return _entries[best_id]['value'], best_similarity
+
+def put(prompt, scope, value):
+    """Index a prompt's answer, evicting the least recently used entries beyond the limit.
+    
+    A prompt that is already indexed (after normalization) has its entry replaced.
+    """
+    global _next_id
+    sig = signature(prompt)
+    with _lock:
+        entry_id = _ids.get((scope, sig))
+        if entry_id is not None:
+            _entries[entry_id].update(value=value, expires_at=time.time() + fuzzy_settings['ttl_seconds'])
+            _entries.move_to_end(entry_id)
+            fuzzy_counters['stores'] += 1
+            return
+        entry_id = _ids[(scope, sig)] = _next_id
+        _next_id += 1
+        _entries[entry_id] = {
+            'scope': scope,
+            'signature': sig,
+            'value': value,
+            'expires_at': time.time() + fuzzy_settings['ttl_seconds']
+        }
+        for band_key in _bands(scope, sig):
+            _buckets.setdefault(band_key, set()).add(entry_id)
+        fuzzy_counters['stores'] += 1
+        while len(_entries) > fuzzy_settings['max_entries']:
+            _remove_locked(next(iter(_entries)))
+            fuzzy_counters['evictions'] += 1
+
+def should_verify():
+    """Pick the fuzzy hits that still go upstream to measure false positives"""
+    return random.random() < fuzzy_settings['verify_rate']
+
+def record_verification(fuzzy_response, upstream_response):
+    """Compare a fuzzy answer with the real one; a clear difference is a false positive"""
+    fuzzy_words = set(normalize(fuzzy_response))
+    upstream_words = set(normalize(upstream_response))
+    union = fuzzy_words | upstream_words
+    overlap = len(fuzzy_words & upstream_words) / len(union) if union else 1.0
+    with _lock:
+        fuzzy_counters['verified'] += 1
+        if overlap < 0.5:
+            fuzzy_counters['mismatches'] += 1
+
+def fuzzy_stats():
+    """Index counters for /status"""
+    with _lock:
+        stats = dict(fuzzy_counters, entries=len(_entries))
+    stats['hit_rate'] = round(stats['hits'] / stats['lookups'], 3) if stats['lookups'] else 0.0
+    stats['false_positive_rate'] = round(stats['mismatches'] / stats['verified'], 3) if stats['verified'] else None
+    stats['enabled'] = fuzzy_settings['enabled']
+    stats['threshold'] = fuzzy_settings['threshold']
+    return stats
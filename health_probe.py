@@ -0,0 +1,155 @@
+"""
+Health Probe
+Background health checks of every provider key. Probes call each
+provider's model-list or key-info endpoint, which checks the key and the
+API front end without spending generation quota. Each probe goes through
+the pooled session, so the first round opens (and TLS-handshakes) the
+connections before user traffic arrives, and later rounds keep them warm.
+Shared by simple-ai-router.py and test-ai-providers.py.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import circuit_breaker
+import provider_pool
+
+# Cheap endpoint of each provider and how it takes the key
+PROBE_ENDPOINTS = {
+    'github_models': {'path': '/models', 'auth': 'bearer'},
+    'openrouter': {'path': '/api/v1/auth/key', 'auth': 'bearer'},
+    'google_gemini': {'path': '/v1beta/models?pageSize=1', 'auth': 'query'}
+}
+
+probe_settings = {
+    'enabled': os.environ.get('AI_ROUTER_PROBE', '1') == '1',
+    # Below the connection pool's keep-alive expiry, so pooled connections stay open
+    'interval': float(os.environ.get('AI_ROUTER_PROBE_SECONDS', 60)),
+    'timeout': float(os.environ.get('AI_ROUTER_PROBE_TIMEOUT_SECONDS', 10))
+}
+
+probe_stats = {'rounds': 0, 'probes': 0, 'failures': 0, 'last_round_at': None}
+
+_thread = {'thread': None, 'pid': None}
+
+def probe_request(provider, key):
+    """(url, headers) of a provider's probe"""
+    endpoint = PROBE_ENDPOINTS[provider]
+    url = provider_pool.PROVIDER_BASE_URLS[provider] + endpoint['path']
+    if endpoint['auth'] == 'query':
+        separator = '&' if '?' in url else '?'
+        return f'{url}{separator}key={key}', {}
+    return url, {'Authorization': f'Bearer {key}'}
+
+def _result(provider, kid, started, response=None, error=None):
+    """Probe outcome: ok, unhealthy, status_code, latency, error, rate_limited, retry_after.
+
+    unhealthy means the key can't serve calls (rejected, rate limited, server
+    error or unreachable); other statuses, like a 404 from a moved endpoint,
+    say nothing about the key.
+    """
+    latency = time.perf_counter() - started
+    if response is None:
+        return {
+            'provider': provider, 'key': kid, 'ok': False, 'unhealthy': True, 'status_code': None,
+            'latency': latency, 'error': str(error), 'rate_limited': False, 'retry_after': None
+        }
+    status_code = response.status_code
+    ok = status_code == 200
+    return {
+        'provider': provider,
+        'key': kid,
+        'ok': ok,
+        'unhealthy': status_code in (401, 403, 429) or (status_code >= 500 and status_code != 501),
+        'status_code': status_code,
+        'latency': latency,
+        'error': None if ok else response.text[:200],
+        'rate_limited': status_code == 429,
+        'retry_after': None if ok else circuit_breaker.retry_after_from_headers(response.headers)
+    }
+
+def probe(provider, kid, key, timeout=None):
+    """Probe one provider key with a blocking call"""
+    url, headers = probe_request(provider, key)
+    started = time.perf_counter()
+    try:
+        response = provider_pool.get(provider, url, headers=headers, timeout=timeout or probe_settings['timeout'])
+    except Exception as e:
+        return _result(provider, kid, started, error=e)
+    return _result(provider, kid, started, response)
+
+async def probe_async(provider, kid, key, timeout=None):
+    """Probe one provider key through the async client"""
+    url, headers = probe_request(provider, key)
+    started = time.perf_counter()
+    try:
+        response = await provider_pool.async_get(provider, url, headers=headers, timeout=timeout or probe_settings['timeout'])
+    except Exception as e:
+        return _result(provider, kid, started, error=e)
+    return _result(provider, kid, started, response)
+
+def probe_all(targets, timeout=None):
+    """Probe (provider, key id, key) targets concurrently; returns their results in order"""
+    if not targets:
+        return []
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        return list(executor.map(lambda target: probe(*target, timeout=timeout), targets))
+
+def _count(results):
+    probe_stats['rounds'] += 1
+    probe_stats['probes'] += len(results)
+    probe_stats['failures'] += sum(1 for result in results if not result['ok'])
+    probe_stats['last_round_at'] = time.time()
+
+def _pause():
+    # Jitter keeps the workers of a pre-forked server from probing in lockstep
+    return probe_settings['interval'] * random.uniform(0.8, 1.0)
+
+def _probe_loop(targets, on_result):
+    while True:
+        try:
+            results = probe_all(targets())
+            _count(results)
+            for result in results:
+                on_result(result)
+        except Exception as e:
+            print(f"⚠️ Health probe round failed: {e}")
+        time.sleep(_pause())
+
+def start(targets, on_result):
+    """Probe targets() now and every interval on a thread (call again in each forked worker).
+
+    targets() returns the (provider, key id, key) tuples due for a probe;
+    on_result(result) is called with every probe result.
+    """
+    if not probe_settings['enabled'] or _thread['pid'] == os.getpid():
+        return
+    _thread['pid'] = os.getpid()
+    _thread['thread'] = threading.Thread(target=_probe_loop, args=(targets, on_result), name='health-probe', daemon=True)
+    _thread['thread'].start()
+
+async def run_async(targets, on_result):
+    """Async variant of the probe loop, for the async server's event loop (warms the async clients)"""
+    while True:
+        try:
+            results = await asyncio.gather(*(probe_async(*target) for target in targets()))
+            _count(results)
+            for result in results:
+                on_result(result)
+        except Exception as e:
+            print(f"⚠️ Health probe round failed: {e}")
+        await asyncio.sleep(_pause())
+
+def start_async(targets, on_result):
+    """Start run_async as a task of the running loop; returns the task, or None when disabled"""
+    if not probe_settings['enabled']:
+        return None
+    return asyncio.ensure_future(run_async(targets, on_result))
+
+def stats():
+    """Probe counters for /status"""
+    return dict(probe_stats, **probe_settings)
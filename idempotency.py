@@ -0,0 +1,247 @@
+"""
+Idempotency
+Idempotency-Key support for /ai-request. The first request with a key runs.
+A retry with the same key attaches to it while it is still in flight, or
+replays its stored result afterwards, instead of paying for a second
+upstream call. Keys live in a bounded in-memory store with a TTL, and in
+the shared state database when several worker processes serve requests.
+Only successful (2xx) results are stored. A retry after an error, such as
+a spent tenant budget or a cache-only miss, runs again. Keys are scoped to
+the tenant, so one tenant can never replay another's result, and a request
+stops waiting for a run with its key when its own deadline passes.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import deadlines
+import shared_state
+
+idempotency_settings = {
+    'ttl_seconds': float(os.environ.get('AI_ROUTER_IDEMPOTENCY_TTL_SECONDS', 24 * 3600)),
+    'max_keys': int(os.environ.get('AI_ROUTER_IDEMPOTENCY_MAX_KEYS', 10000)),
+    # A request still in progress after this long is assumed lost and may run again
+    'in_progress_timeout': 300.0,
+    'poll_interval': 0.1,  # how often a request running in another worker is checked
+    'max_key_length': 255
+}
+
+idempotency_stats = {'started': 0, 'attached': 0, 'replayed': 0, 'conflicts': 0, 'evictions': 0}
+
+_entries = OrderedDict()  # key -> {'fingerprint', 'state', 'result', 'done', 'expires_at'}
+_lock = threading.Lock()
+
+def fingerprint(data):
+    """Hash of a request body; a key may only be reused with the same body"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+def scoped_key(tenant, key):
+    """Store key of a tenant's Idempotency-Key (valid tenant ids have no spaces)"""
+    return f'{tenant} {key}'
+
+def _time_left(deadline):
+    """Seconds a request may still wait for a result, or None without a deadline"""
+    return None if deadline is None else max(deadlines.remaining(deadline), 0)
+
+def _expired_locked(now):
+    for key in [key for key, entry in _entries.items() if entry['state'] == 'done' and entry['expires_at'] <= now]:
+        del _entries[key]
+
+def _evict_locked(now):
+    """Keep the store bounded: drop expired results, then the oldest finished ones"""
+    if len(_entries) <= idempotency_settings['max_keys']:
+        return
+    _expired_locked(now)
+    for key in [key for key, entry in _entries.items() if entry['state'] == 'done']:
+        if len(_entries) <= idempotency_settings['max_keys']:
+            break
+        del _entries[key]
+        idempotency_stats['evictions'] += 1
+
+def _begin(key, request_fingerprint, make_done):
+    """('lead' | 'attach' | 'replay' | 'conflict', entry)"""
+    now = time.time()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry['state'] == 'done' and entry['expires_at'] <= now:
+            del _entries[key]
+            entry = None
+        if entry is not None:
+            if entry['fingerprint'] != request_fingerprint:
+                idempotency_stats['conflicts'] += 1
+                return 'conflict', None
+            if entry['state'] == 'done':
+                idempotency_stats['replayed'] += 1
+                return 'replay', entry
+            idempotency_stats['attached'] += 1
+            return 'attach', entry
+        entry = {
+            'fingerprint': request_fingerprint,
+            'state': 'in_progress',
+            'result': None,
+            'done': make_done(),
+            'expires_at': None
+        }
+        _entries[key] = entry
+        idempotency_stats['started'] += 1
+        _evict_locked(now)
+        return 'lead', entry
+
+def _claim(key, request_fingerprint):
+    """Check the key across workers: ('run', None), ('wait', None) or ('result', (body, status_code))"""
+    now = time.time()
+    row = shared_state.claim_idempotency(key, request_fingerprint, now + idempotency_settings['in_progress_timeout'], now)
+    if row is None:
+        return 'run', None
+    other_fingerprint, state, result = row
+    if other_fingerprint != request_fingerprint:
+        return 'result', None
+    if state == 'done':
+        body, status_code = json.loads(result)
+        return 'result', (body, status_code)
+    return 'wait', None
+
+def _finish(key, entry, result, owner):
+    """Publish the result to attached requests and keep it for later retries (only if it succeeded)"""
+    now = time.time()
+    # No result: run() raised, or another worker used the key for a different body
+    failed = result is None or not 200 <= result[1] < 300
+    with _lock:
+        entry['result'] = result or ({'success': False, 'error': 'Request failed'}, 500)
+        if failed:
+            if _entries.get(key) is entry:
+                del _entries[key]
+        else:
+            entry['state'] = 'done'
+            entry['expires_at'] = now + idempotency_settings['ttl_seconds']
+    if owner and shared_state.enabled():
+        if failed:
+            shared_state.release_idempotency(key)
+        else:
+            shared_state.finish_idempotency(key, json.dumps(result, default=str), entry['expires_at'])
+
+def _invalid(key, request_id):
+    if 0 < len(key) <= idempotency_settings['max_key_length']:
+        return None
+    return {
+        'success': False,
+        'error': f"Idempotency-Key must be 1 to {idempotency_settings['max_key_length']} characters",
+        'request_id': request_id
+    }, 400
+
+def _conflict(request_id):
+    return {
+        'success': False,
+        'error': 'Idempotency-Key was already used with a different request body',
+        'request_id': request_id
+    }, 422
+
+def _replay(result):
+    body, status_code = result
+    return dict(body, idempotent_replay=True), status_code, True
+
+def _timed_out(request_id):
+    deadlines.expired()
+    return dict(deadlines.deadline_exceeded(), request_id=request_id), 504, False
+
+def call(key, data, request_id, run, tenant=None, deadline=None):
+    """Run (or attach to, or replay) the request for an Idempotency-Key.
+
+    run() returns (body, status_code); returns (body, status_code, replayed).
+    tenant scopes the key; deadline (absolute) bounds waiting for a run with
+    the same key, after which the request gets a 504.
+    """
+    invalid = _invalid(key, request_id)
+    if invalid:
+        return invalid + (False,)
+    key = scoped_key(tenant, key)
+    request_fingerprint = fingerprint(data)
+    role, entry = _begin(key, request_fingerprint, threading.Event)
+    if role == 'conflict':
+        return _conflict(request_id) + (False,)
+    if role == 'attach' and not entry['done'].wait(_time_left(deadline)):
+        return _timed_out(request_id)
+    if role != 'lead':
+        return _replay(entry['result'])
+
+    result = None
+    owner, gave_up = True, False
+    try:
+        while shared_state.enabled():
+            claim, other = _claim(key, request_fingerprint)
+            if claim == 'run':
+                break
+            if claim == 'result':
+                owner = False
+                result = other
+                break
+            if _time_left(deadline) == 0:
+                # Another worker is still running it, and this request can't wait any longer
+                owner, gave_up = False, True
+                break
+            time.sleep(idempotency_settings['poll_interval'])
+        if owner:
+            result = run()
+    finally:
+        _finish(key, entry, result, owner)
+        entry['done'].set()
+    if owner:
+        return result + (False,)
+    if gave_up:
+        return _timed_out(request_id)
+    return _replay(result) if result else _conflict(request_id) + (False,)
+
+async def call_async(key, data, request_id, run, tenant=None, deadline=None):
+    """Async variant of call; run is a coroutine function"""
+    invalid = _invalid(key, request_id)
+    if invalid:
+        return invalid + (False,)
+    key = scoped_key(tenant, key)
+    request_fingerprint = fingerprint(data)
+    role, entry = _begin(key, request_fingerprint, asyncio.Event)
+    if role == 'conflict':
+        return _conflict(request_id) + (False,)
+    if role == 'attach':
+        try:
+            await asyncio.wait_for(entry['done'].wait(), _time_left(deadline))
+        except asyncio.TimeoutError:
+            return _timed_out(request_id)
+    if role != 'lead':
+        return _replay(entry['result'])
+
+    result = None
+    owner, gave_up = True, False
+    try:
+        while shared_state.enabled():
+            claim, other = _claim(key, request_fingerprint)
+            if claim == 'run':
+                break
+            if claim == 'result':
+                owner = False
+                result = other
+                break
+            if _time_left(deadline) == 0:
+                owner, gave_up = False, True
+                break
+            await asyncio.sleep(idempotency_settings['poll_interval'])
+        if owner:
+            result = await run()
+    finally:
+        _finish(key, entry, result, owner)
+        entry['done'].set()
+    if owner:
+        return result + (False,)
+    if gave_up:
+        return _timed_out(request_id)
+    return _replay(result) if result else _conflict(request_id) + (False,)
+
+def stats():
+    """Store counters for /status"""
+    with _lock:
+        in_progress = sum(1 for entry in _entries.values() if entry['state'] == 'in_progress')
+        return dict(idempotency_stats, keys=len(_entries), in_progress=in_progress, ttl_seconds=idempotency_settings['ttl_seconds'])
@@ -0,0 +1,141 @@
+"""
+Metrics
+Counters, gauges and histograms rendered in the Prometheus text format for
+/metrics. Every thread records into its own shard, so the request path
+never takes a lock; shards are summed when /metrics is scraped.
+"""
+
+import bisect
+import threading
+import weakref
+
+# Upper bounds (seconds) shared by every histogram
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRICS = {
+    'ai_router_requests_total': ('counter', 'Requests handled, by endpoint and HTTP status'),
+    'ai_router_request_duration_seconds': ('histogram', 'Time to answer a request, by endpoint'),
+    'ai_router_in_flight_requests': ('gauge', 'Requests being handled, by endpoint'),
+    'ai_router_provider_calls_in_flight': ('gauge', 'Upstream calls in flight, by provider'),
+    'ai_router_provider_call_duration_seconds': ('histogram', 'Upstream call latency, by provider and outcome'),
+    'ai_router_retries_total': ('counter', 'Attempts after the first one of a request'),
+    'ai_router_failovers_total': ('counter', 'Retries that moved to another provider'),
+    'ai_router_stage_duration_seconds': ('histogram', 'Time spent in each request stage'),
+    'ai_router_overhead_seconds': ('histogram', 'Request time not spent waiting for a provider'),
+    'ai_router_queue_wait_seconds': ('histogram', 'Time spent in the admission queue, by outcome'),
+    'ai_router_queue_rejections_total': ('counter', 'Requests turned away by the admission queue, by reason'),
+    'ai_router_cancelled_requests_total': ('counter', 'Requests abandoned because the client disconnected, by endpoint'),
+    'ai_router_probe_duration_seconds': ('histogram', 'Background health probe latency, by provider and outcome')
+}
+
+_local = threading.local()
+_shards = []       # (thread weakref, shard) of every thread that recorded something
+_retired = {'values': {}, 'histograms': {}}  # shards of finished threads, folded together
+_registry_lock = threading.Lock()  # only taken when a thread records for the first time
+
+def _new_shard():
+    return {'values': {}, 'histograms': {}}
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = _new_shard()
+        with _registry_lock:
+            _shards.append((weakref.ref(threading.current_thread()), shard))
+            if len(_shards) % 64 == 0:
+                _fold_finished_locked()
+    return shard
+
+def _merge(target, shard):
+    for key, value in list(shard['values'].items()):
+        target['values'][key] = target['values'].get(key, 0) + value
+    for key, counts in list(shard['histograms'].items()):
+        merged = target['histograms'].setdefault(key, [0] * (len(BUCKETS) + 2))
+        for i, count in enumerate(list(counts)):
+            merged[i] += count
+
+def _fold_finished_locked():
+    """Fold the shards of threads that have finished into _retired"""
+    alive = []
+    for thread_ref, shard in _shards:
+        thread = thread_ref()
+        if thread is None or not thread.is_alive():
+            _merge(_retired, shard)
+        else:
+            alive.append((thread_ref, shard))
+    _shards[:] = alive
+
+def inc(name, labels=(), amount=1):
+    """Add to a counter (or gauge); labels is a tuple of (name, value) pairs"""
+    values = _shard()['values']
+    key = (name, labels)
+    values[key] = values.get(key, 0) + amount
+
+def observe(name, seconds, labels=()):
+    """Record one histogram observation"""
+    histograms = _shard()['histograms']
+    key = (name, labels)
+    counts = histograms.get(key)
+    if counts is None:
+        # One slot per bucket, then +Inf, then the sum
+        counts = histograms[key] = [0] * (len(BUCKETS) + 2)
+    counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+    counts[-1] += seconds
+
+def stage(name, seconds):
+    """Record the time spent in one request stage"""
+    observe('ai_router_stage_duration_seconds', seconds, (('stage', name),))
+
+def snapshot():
+    """Sum of every shard: {'values': {...}, 'histograms': {...}}"""
+    total = _new_shard()
+    with _registry_lock:
+        _fold_finished_locked()
+        _merge(total, _retired)
+        shards = [shard for _, shard in _shards]
+    for shard in shards:
+        _merge(total, shard)
+    return total
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def render(extra_gauges=None):
+    """All metrics in the Prometheus text exposition format.
+
+    extra_gauges maps a metric name to (help, {labels: value}) for values
+    that are read at scrape time instead of recorded on the request path.
+    """
+    total = snapshot()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'histogram':
+            for (metric, labels), counts in sorted(total['histograms'].items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS, counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels, (("le", bound),))} {cumulative}')
+                cumulative += counts[len(BUCKETS)]
+                lines.append(f'{name}_bucket{_format_labels(labels, (("le", "+Inf"),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {counts[-1]:.6f}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        else:
+            for (metric, labels), value in sorted(total['values'].items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+
+    for name, (help_text, values) in (extra_gauges or {}).items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in values.items():
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,118 @@
+"""
+Model Capabilities
+What each provider's model can take (context window, per-request input and
+output limits, tokens-per-minute budget, relative speed) and a fast local
+token estimator, so the router skips providers a request can't fit instead
+of finding out from an upstream error.
+"""
+
+import json
+import os
+import re
+
+# Limits of the model each provider is called with (None = no separate limit).
+# Override with AI_ROUTER_MODEL_CAPABILITIES='{"openrouter": {"context_window": 8192}}'.
+DEFAULT_CAPABILITIES = {
+    'github_models': {
+        'model': 'gpt-4o',
+        'context_window': 128000,
+        'max_input_tokens': 8000,   # free-tier per-request limits
+        'max_output_tokens': 4000,
+        'tpm': None,
+        'relative_speed': 1.0
+    },
+    'openrouter': {
+        'model': 'meta-llama/llama-3.1-8b-instruct:free',
+        'context_window': 131072,
+        'max_input_tokens': None,
+        'max_output_tokens': 4096,
+        'tpm': None,
+        'relative_speed': 0.8
+    },
+    'google_gemini': {
+        'model': 'gemini-1.5-flash-latest',
+        'context_window': 1048576,
+        'max_input_tokens': None,
+        'max_output_tokens': 8192,
+        'tpm': 1000000,
+        'relative_speed': 1.5
+    }
+}
+
+# Tokens a chat message adds on top of its text (role, separators)
+MESSAGE_OVERHEAD = 4
+
+def load_capabilities():
+    """Capability table from the defaults and AI_ROUTER_MODEL_CAPABILITIES"""
+    table = {provider: dict(values) for provider, values in DEFAULT_CAPABILITIES.items()}
+    override = os.environ.get('AI_ROUTER_MODEL_CAPABILITIES', '')
+    if override:
+        try:
+            for provider, values in json.loads(override).items():
+                table.setdefault(provider, {}).update(values)
+        except (ValueError, AttributeError):
+            print("⚠️ AI_ROUTER_MODEL_CAPABILITIES is not valid JSON, using default capabilities")
+    return table
+
+capabilities = load_capabilities()
+
+# Runs of letters, of digits, of other word characters, and single symbols
+_PIECE = re.compile(r'[A-Za-z]+|[0-9]+|[^\W\dA-Za-z_]+|\S')
+
+def count_tokens(text):
+    """Estimated BPE token count of text.
+
+    Close to the GPT and Gemini tokenizers for English and code without
+    loading a vocabulary: short words are one token and longer ones are
+    split every ~6 letters, numbers every 3 digits, other scripts (CJK,
+    Cyrillic, ...) take about one token per character, symbols one each.
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _PIECE.findall(text):
+        first = piece[0]
+        if first.isascii() and first.isalpha():
+            tokens += 1 + (len(piece) - 1) // 6
+        elif first.isdigit():
+            tokens += (len(piece) + 2) // 3
+        else:
+            tokens += len(piece)
+    return tokens
+
+def input_tokens(prompt, system_prompt=''):
+    """Estimated prompt tokens of a request"""
+    tokens = count_tokens(prompt) + MESSAGE_OVERHEAD
+    if system_prompt:
+        tokens += count_tokens(system_prompt) + MESSAGE_OVERHEAD
+    return tokens
+
+def fits(provider, prompt_tokens, max_tokens, overrides=None):
+    """True if the provider's model can take the prompt and the requested output.
+
+    overrides are the limits of a model other than the provider's default one.
+    """
+    limits = dict(capabilities.get(provider) or {}, **(overrides or {}))
+    if not limits:
+        return True
+    if limits.get('max_input_tokens') and prompt_tokens > limits['max_input_tokens']:
+        return False
+    if limits.get('max_output_tokens') and max_tokens > limits['max_output_tokens']:
+        return False
+    return not limits.get('context_window') or prompt_tokens + max_tokens <= limits['context_window']
+
+def unfit_providers(providers, prompt_tokens, max_tokens, overrides=None):
+    """Providers that can't take a request of this size; overrides maps providers to model limits"""
+    overrides = overrides or {}
+    return tuple(
+        provider for provider in providers
+        if not fits(provider, prompt_tokens, max_tokens, overrides.get(provider))
+    )
+
+def relative_speed(provider):
+    """Expected speed relative to the other providers (higher is faster)"""
+    return capabilities.get(provider, {}).get('relative_speed') or 1.0
+
+def tpm_budgets():
+    """Tokens-per-minute budget of every provider that has one"""
+    return {provider: limits['tpm'] for provider, limits in capabilities.items() if limits.get('tpm')}
@@ -0,0 +1,84 @@
+"""
+Model Routes
+Maps each model_type to an ordered list of (provider, model) candidates,
+so lightweight chat traffic goes to cheap, fast models first and the big
+models' quota is kept for requests that need them. model_types without a
+route use the "default" route. Latency and error statistics are kept per
+provider, not per model, so the routing policies and deadlines judge a
+provider by all of its calls.
+"""
+
+import json
+import os
+
+# Candidates may set context_window, max_input_tokens or max_output_tokens
+# when the model's limits differ from model_capabilities.
+DEFAULT_ROUTES = {
+    'chat': [
+        {'provider': 'google_gemini', 'model': 'gemini-1.5-flash-latest'},
+        {'provider': 'openrouter', 'model': 'meta-llama/llama-3.1-8b-instruct:free'},
+        {'provider': 'github_models', 'model': 'gpt-4o-mini'}
+    ],
+    'code': [
+        {'provider': 'github_models', 'model': 'gpt-4o'},
+        {'provider': 'google_gemini', 'model': 'gemini-1.5-flash-latest'},
+        {'provider': 'openrouter', 'model': 'meta-llama/llama-3.1-8b-instruct:free'}
+    ],
+    'creative': [
+        {'provider': 'github_models', 'model': 'gpt-4o'},
+        {'provider': 'openrouter', 'model': 'meta-llama/llama-3.1-8b-instruct:free'},
+        {'provider': 'google_gemini', 'model': 'gemini-1.5-flash-latest'}
+    ],
+    # Unknown model_types keep the original fixed order and models
+    'default': [
+        {'provider': 'github_models', 'model': 'gpt-4o'},
+        {'provider': 'openrouter', 'model': 'meta-llama/llama-3.1-8b-instruct:free'},
+        {'provider': 'google_gemini', 'model': 'gemini-1.5-flash-latest'}
+    ]
+}
+
+def load_routes():
+    """Routes from the defaults and AI_ROUTER_MODEL_ROUTES (whole model_types are replaced)"""
+    routes = {model_type: [dict(candidate) for candidate in candidates] for model_type, candidates in DEFAULT_ROUTES.items()}
+    override = os.environ.get('AI_ROUTER_MODEL_ROUTES', '')
+    if override:
+        try:
+            for model_type, candidates in json.loads(override).items():
+                if not all(isinstance(candidate, dict) and candidate.get('provider') for candidate in candidates):
+                    raise ValueError(f'every candidate of {model_type} needs a provider')
+                routes[model_type] = [dict(candidate) for candidate in candidates]
+        except (ValueError, AttributeError, TypeError) as e:
+            print(f"⚠️ AI_ROUTER_MODEL_ROUTES is not valid ({e}), using default routes")
+            routes = {model_type: [dict(candidate) for candidate in candidates] for model_type, candidates in DEFAULT_ROUTES.items()}
+    # A provider is tried once per request, with its first model in the route
+    for model_type, candidates in routes.items():
+        seen = set()
+        routes[model_type] = [
+            candidate for candidate in candidates
+            if candidate['provider'] not in seen and not seen.add(candidate['provider'])
+        ]
+    return routes
+
+routes = load_routes()
+
+def route(model_type):
+    """Ordered candidates for a model_type"""
+    return routes.get(model_type) or routes['default']
+
+def providers(model_type, known=None):
+    """Providers of a model_type's route in order (only those in known, if given)"""
+    return tuple(
+        candidate['provider'] for candidate in route(model_type)
+        if known is None or candidate['provider'] in known
+    )
+
+def models(model_type):
+    """{provider: model} of a model_type's route"""
+    return {candidate['provider']: candidate.get('model') for candidate in route(model_type)}
+
+def limits(model_type, provider):
+    """Model limits a route sets for one provider's candidate (may be empty)"""
+    for candidate in route(model_type):
+        if candidate['provider'] == provider:
+            return {key: candidate[key] for key in ('context_window', 'max_input_tokens', 'max_output_tokens') if key in candidate}
+    return {}
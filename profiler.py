@@ -0,0 +1,92 @@
+"""
+Profiler
+On-demand sampling profiler for the running router. The thread that asks
+for a profile samples the Python stack of every other thread at a fixed
+interval for a few seconds and returns the stacks in the collapsed format
+("frame;frame;frame count" per line) that flamegraph.pl, speedscope and
+inferno read. Sampling costs nothing while no profile is being taken.
+"""
+
+import hmac
+import os
+import sys
+import threading
+import time
+
+profile_settings = {
+    # The /admin/profile endpoint is disabled unless a token is set
+    'admin_token': os.environ.get('AI_ROUTER_ADMIN_TOKEN', ''),
+    'max_seconds': float(os.environ.get('AI_ROUTER_PROFILE_MAX_SECONDS', 60)),
+    'interval': float(os.environ.get('AI_ROUTER_PROFILE_INTERVAL_MS', 5)) / 1000
+}
+
+# Leaf functions of threads that are waiting rather than working
+IDLE_FUNCTIONS = {
+    'wait', 'select', 'poll', 'accept', 'sleep', 'get', 'readline', 'serve_forever',
+    '_wait_for_tstate_lock', '_worker', 'run_forever', '_run_once'
+}
+
+_running = threading.Lock()  # one profile at a time
+
+def authorized(token):
+    """True if token matches the admin token (always False when none is configured)"""
+    expected = profile_settings['admin_token']
+    return bool(expected) and token is not None and hmac.compare_digest(token.encode(), expected.encode())
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _stack(frame):
+    """Frame labels from the outermost call to frame"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+def collect(seconds, interval=None, include_idle=False):
+    """Sample every thread for seconds; returns ({collapsed stack: samples}, summary).
+
+    Sampling runs in the calling thread, which is blocked for the whole
+    profile: a threaded server loses that worker thread until it returns,
+    so the async server calls this from an executor. Raises RuntimeError
+    when another profile is already running.
+    """
+    seconds = max(0.1, min(float(seconds), profile_settings['max_seconds']))
+    interval = max(0.001, interval or profile_settings['interval'])
+    if not _running.acquire(blocking=False):
+        raise RuntimeError('A profile is already running')
+    try:
+        own_thread = threading.get_ident()
+        stacks = {}
+        samples = 0
+        idle = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                if not include_idle and frame.f_code.co_name in IDLE_FUNCTIONS:
+                    idle += 1
+                    continue
+                key = ';'.join([names.get(thread_id, str(thread_id))] + _stack(frame))
+                stacks[key] = stacks.get(key, 0) + 1
+                samples += 1
+            time.sleep(interval)
+        summary = {
+            'seconds': round(time.perf_counter() - started, 3),
+            'interval_ms': interval * 1000,
+            'samples': samples,
+            'idle_samples': idle
+        }
+        return stacks, summary
+    finally:
+        _running.release()
+
+def collapsed(stacks):
+    """Collapsed-stack text, heaviest stacks first"""
+    lines = [f'{stack} {count}' for stack, count in sorted(stacks.items(), key=lambda item: -item[1])]
+    return '\n'.join(lines) + '\n' if lines else ''
@@ -0,0 +1,319 @@
+"""
+Provider Connection Pool
+Keeps one pooled keep-alive HTTP session per AI provider so requests reuse
+TCP/TLS connections instead of opening a new one for every call.
+Shared by simple-ai-router.py and test-ai-providers.py.
+"""
+
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import request_timing
+
+try:
+    import httpx
+    import h2  # noqa: F401 - httpx needs it for HTTP/2
+except ImportError:
+    httpx = None
+
+# Base URLs of each provider (one pool per host; overridable for local testing)
+PROVIDER_BASE_URLS = {
+    'github_models': os.environ.get('GITHUB_MODELS_BASE_URL', 'https://models.inference.ai.azure.com'),
+    'openrouter': os.environ.get('OPENROUTER_BASE_URL', 'https://openrouter.ai'),
+    'google_gemini': os.environ.get('GOOGLE_GEMINI_BASE_URL', 'https://generativelanguage.googleapis.com')
+}
+
+# Pool configuration (override through environment variables)
+pool_settings = {
+    'pool_size': int(os.environ.get('AI_ROUTER_POOL_SIZE', 20)),
+    'keepalive_expiry': float(os.environ.get('AI_ROUTER_KEEPALIVE_SECONDS', 120)),
+    'http2': os.environ.get('AI_ROUTER_HTTP2', '1') == '1' and httpx is not None,
+    # Async mode holds many more requests in flight than there are threads
+    'async_max_connections': int(os.environ.get('AI_ROUTER_ASYNC_MAX_CONNECTIONS', 1000))
+}
+
+_sessions = {}
+_async_clients = {}
+_sessions_lock = threading.Lock()
+_stats_lock = threading.Lock()
+
+pool_counters = {
+    provider: {'requests': 0, 'errors': 0, 'connections_opened': 0, 'http_versions': {}}
+    for provider in PROVIDER_BASE_URLS
+}
+
+def _create_session():
+    """Create a pooled session (HTTP/2 capable when httpx and h2 are installed)"""
+    size = pool_settings['pool_size']
+    if pool_settings['http2']:
+        limits = httpx.Limits(
+            max_connections=size,
+            max_keepalive_connections=size,
+            keepalive_expiry=pool_settings['keepalive_expiry']
+        )
+        return httpx.Client(http2=True, limits=limits)
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_session(provider):
+    """Get (or lazily create) the pooled session for a provider"""
+    session = _sessions.get(provider)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(provider)
+            if session is None:
+                session = _create_session()
+                _sessions[provider] = session
+    return session
+
+def _count(provider, key, amount=1):
+    with _stats_lock:
+        counters = pool_counters.setdefault(
+            provider, {'requests': 0, 'errors': 0, 'connections_opened': 0, 'http_versions': {}}
+        )
+        counters[key] += amount
+
+# httpcore trace events timed as request phases (connect includes DNS resolution)
+TRACE_PHASES = {
+    'connection.connect_tcp': 'connect',
+    'connection.start_tls': 'tls',
+    'http11.receive_response_headers': 'ttfb',
+    'http2.receive_response_headers': 'ttfb'
+}
+
+def _time_phase(provider, started, event_name):
+    """Add connection setup and time to first byte to the timings of the request being served"""
+    event, _, stage = event_name.rpartition('.')
+    phase = TRACE_PHASES.get(event)
+    if phase is None:
+        return
+    if stage == 'started':
+        started[event] = time.perf_counter()
+    elif stage == 'complete' and event in started:
+        request_timing.add(f'{provider}-{phase}', time.perf_counter() - started.pop(event))
+
+def _trace_for(provider):
+    """httpcore trace hook that counts newly opened connections and times the call's phases"""
+    started = {}
+    def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            _count(provider, 'connections_opened')
+        _time_phase(provider, started, event_name)
+    return trace
+
+def _record_version(provider, version):
+    with _stats_lock:
+        versions = pool_counters[provider]['http_versions']
+        versions[version] = versions.get(version, 0) + 1
+
+def is_timeout(error):
+    """True if an exception is a connect or read timeout of either HTTP library"""
+    if isinstance(error, requests.exceptions.Timeout):
+        return True
+    return httpx is not None and isinstance(error, httpx.TimeoutException)
+
+def _httpx_kwargs(kwargs):
+    """httpx reads a (connect, read) timeout pair as no write or pool timeout; bound those too"""
+    timeout = kwargs.get('timeout')
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        kwargs = dict(kwargs, timeout=httpx.Timeout(read, connect=connect))
+    return kwargs
+
+def request(provider, method, url, **kwargs):
+    """Send a request through the provider's pooled session.
+
+    timeout may be a number or a (connect, read) pair, as with requests.
+    """
+    session = get_session(provider)
+    _count(provider, 'requests')
+
+    try:
+        if httpx is not None and isinstance(session, httpx.Client):
+            response = session.request(method, url, extensions={'trace': _trace_for(provider)}, **_httpx_kwargs(kwargs))
+            _record_version(provider, response.http_version)
+        else:
+            response = session.request(method, url, **kwargs)
+            _record_version(provider, 'HTTP/1.1')
+            # requests has no connection hooks; elapsed runs from sending to the response headers
+            request_timing.add(f'{provider}-ttfb', response.elapsed.total_seconds())
+    except Exception:
+        _count(provider, 'errors')
+        raise
+
+    return response
+
+def post(provider, url, **kwargs):
+    """POST through the provider's pooled session"""
+    return request(provider, 'POST', url, **kwargs)
+
+def get(provider, url, **kwargs):
+    """GET through the provider's pooled session"""
+    return request(provider, 'GET', url, **kwargs)
+
+@contextmanager
+def stream_post(provider, url, **kwargs):
+    """Streaming POST through the provider's pooled session.
+
+    Yields (status_code, error_text, headers, lines); error_text is the
+    response body when the status is not 200, and lines iterates over the
+    decoded body.
+    """
+    session = get_session(provider)
+    _count(provider, 'requests')
+
+    if httpx is not None and isinstance(session, httpx.Client):
+        try:
+            context = session.stream('POST', url, extensions={'trace': _trace_for(provider)}, **_httpx_kwargs(kwargs))
+            response = context.__enter__()
+        except Exception:
+            _count(provider, 'errors')
+            raise
+        try:
+            _record_version(provider, response.http_version)
+            error_text = None
+            if response.status_code != 200:
+                response.read()
+                error_text = response.text
+            yield response.status_code, error_text, response.headers, response.iter_lines()
+        finally:
+            context.__exit__(None, None, None)
+        return
+
+    try:
+        response = session.post(url, stream=True, **kwargs)
+    except Exception:
+        _count(provider, 'errors')
+        raise
+    try:
+        _record_version(provider, 'HTTP/1.1')
+        response.encoding = response.encoding or 'utf-8'
+        error_text = response.text if response.status_code != 200 else None
+        yield response.status_code, error_text, response.headers, response.iter_lines(decode_unicode=True)
+    finally:
+        response.close()
+
+def get_async_client(provider):
+    """Get (or lazily create) the pooled async client for a provider"""
+    if httpx is None:
+        raise RuntimeError("Async mode requires httpx: pip install 'httpx[http2]'")
+
+    client = _async_clients.get(provider)
+    if client is None:
+        limits = httpx.Limits(
+            max_connections=pool_settings['async_max_connections'],
+            max_keepalive_connections=pool_settings['pool_size'],
+            keepalive_expiry=pool_settings['keepalive_expiry']
+        )
+        client = httpx.AsyncClient(http2=pool_settings['http2'], limits=limits)
+        _async_clients[provider] = client
+    return client
+
+def _async_trace_for(provider):
+    """Async variant of the connection counting trace hook"""
+    started = {}
+    async def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            _count(provider, 'connections_opened')
+        _time_phase(provider, started, event_name)
+    return trace
+
+async def async_request(provider, method, url, **kwargs):
+    """Send a request through the provider's pooled async client"""
+    client = get_async_client(provider)
+    _count(provider, 'requests')
+
+    try:
+        response = await client.request(method, url, extensions={'trace': _async_trace_for(provider)}, **_httpx_kwargs(kwargs))
+    except Exception:
+        _count(provider, 'errors')
+        raise
+
+    _record_version(provider, response.http_version)
+    return response
+
+async def async_post(provider, url, **kwargs):
+    """POST through the provider's pooled async client"""
+    return await async_request(provider, 'POST', url, **kwargs)
+
+async def async_get(provider, url, **kwargs):
+    """GET through the provider's pooled async client"""
+    return await async_request(provider, 'GET', url, **kwargs)
+
+@asynccontextmanager
+async def async_stream_post(provider, url, **kwargs):
+    """Streaming POST through the provider's pooled async client (see stream_post)"""
+    client = get_async_client(provider)
+    _count(provider, 'requests')
+
+    try:
+        context = client.stream('POST', url, extensions={'trace': _async_trace_for(provider)}, **_httpx_kwargs(kwargs))
+        response = await context.__aenter__()
+    except Exception:
+        _count(provider, 'errors')
+        raise
+    try:
+        _record_version(provider, response.http_version)
+        error_text = None
+        if response.status_code != 200:
+            await response.aread()
+            error_text = response.text
+        yield response.status_code, error_text, response.headers, response.aiter_lines()
+    finally:
+        await context.__aexit__(None, None, None)
+
+def _requests_connections(session):
+    """Count connections urllib3 has opened for a requests session"""
+    opened = 0
+    for adapter in session.adapters.values():
+        for key in list(adapter.poolmanager.pools.keys()):
+            pool = adapter.poolmanager.pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+    return opened
+
+def pool_stats():
+    """Per-provider connection pool statistics for /status"""
+    stats = {}
+    with _stats_lock:
+        snapshot = {p: dict(c, http_versions=dict(c['http_versions'])) for p, c in pool_counters.items()}
+
+    for provider, counters in snapshot.items():
+        session = _sessions.get(provider)
+        if session is not None and not (httpx is not None and isinstance(session, httpx.Client)):
+            counters['connections_opened'] += _requests_connections(session)
+        counters['backend'] = 'httpx' if pool_settings['http2'] else 'requests'
+        counters['pool_size'] = pool_settings['pool_size']
+        counters['reused_requests'] = max(0, counters['requests'] - counters['errors'] - counters['connections_opened'])
+        stats[provider] = counters
+
+    return stats
+
+def close_all():
+    """Close every pooled session (used on shutdown and after forking)"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            try:
+                session.close()
+            except Exception:
+                pass
+        _sessions.clear()
+
+async def aclose_all():
+    """Close every pooled async client"""
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception:
+            pass
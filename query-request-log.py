@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Request Log Query
+Reads the router's compressed JSONL request logs and aggregates them:
+counts, error rate, latency percentiles and tokens, grouped by any field.
+
+Usage:
+    python query-request-log.py                                  # attempts per provider
+    python query-request-log.py --event request --group-by status_code
+    python query-request-log.py --since 1h --group-by provider error_class
+    python query-request-log.py --request-id k3x9a2bq --raw
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+import sys
+import time
+import zlib
+
+LOG_PATTERN = 'requests-*.jsonl.gz'
+_SINCE = re.compile(r'^(\d+(?:\.\d+)?)([smhd])$')
+_SINCE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def read_records(log_dir):
+    """Every record of every log file, oldest file first"""
+    paths = sorted(glob.glob(os.path.join(log_dir, LOG_PATTERN)), key=os.path.getmtime)
+    for path in paths:
+        try:
+            with gzip.open(path, 'rt') as log_file:
+                for line in log_file:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        pass  # partly written last line
+        except (EOFError, OSError, zlib.error):
+            continue  # the file being written has no gzip trailer yet
+
+def parse_since(value):
+    """Unix time for '--since 15m' style durations"""
+    match = _SINCE.match(value)
+    if not match:
+        raise argparse.ArgumentTypeError('use a number with s, m, h or d, e.g. 15m')
+    return time.time() - float(match.group(1)) * _SINCE_UNITS[match.group(2)]
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+def aggregate(records, group_by):
+    """Summary rows per group; sampled records count with their sample_weight"""
+    groups = {}
+    for entry in records:
+        key = tuple(str(entry.get(field)) for field in group_by)
+        group = groups.setdefault(key, {'count': 0.0, 'errors': 0.0, 'tokens': 0.0, 'latencies': []})
+        weight = entry.get('sample_weight', 1)
+        group['count'] += weight
+        if entry.get('error_class'):
+            group['errors'] += weight
+        group['tokens'] += (entry.get('tokens') or 0) * weight
+        if entry.get('latency') is not None:
+            group['latencies'].append(entry['latency'])
+
+    rows = []
+    for key, group in sorted(groups.items(), key=lambda item: -item[1]['count']):
+        p50, p95, p99 = (percentile(group['latencies'], fraction) for fraction in (0.5, 0.95, 0.99))
+        rows.append(dict(zip(group_by, key), **{
+            'count': round(group['count']),
+            'error_rate': round(group['errors'] / group['count'], 3) if group['count'] else 0.0,
+            'p50': round(p50, 3) if p50 is not None else None,
+            'p95': round(p95, 3) if p95 is not None else None,
+            'p99': round(p99, 3) if p99 is not None else None,
+            'tokens': round(group['tokens'])
+        }))
+    return rows
+
+def print_table(rows):
+    if not rows:
+        print('No matching records')
+        return
+    columns = list(rows[0])
+    widths = {column: max(len(column), *(len(str(row[column])) for row in rows)) for column in columns}
+    print('  '.join(column.ljust(widths[column]) for column in columns))
+    for row in rows:
+        print('  '.join(str(row[column]).ljust(widths[column]) for column in columns))
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate the router request logs')
+    parser.add_argument('--dir', default=os.environ.get('AI_ROUTER_LOG_DIR', 'logs'), help='log directory')
+    parser.add_argument('--event', default='attempt', help="record type: attempt, request, circuit_open, ... or 'all'")
+    parser.add_argument('--since', type=parse_since, help='only records newer than this, e.g. 15m, 2h, 1d')
+    parser.add_argument('--provider', help='only this provider')
+    parser.add_argument('--request-id', help='only this request')
+    parser.add_argument('--errors', action='store_true', help='only failed records')
+    parser.add_argument('--group-by', nargs='+', default=['provider'], help='fields to group by')
+    parser.add_argument('--raw', action='store_true', help='print matching records instead of aggregating')
+    parser.add_argument('--json', action='store_true', help='print the aggregate as JSON')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dir):
+        print(f"❌ Log directory not found: {args.dir}")
+        sys.exit(1)
+
+    def matches(entry):
+        return (
+            (args.event == 'all' or entry.get('event') == args.event) and
+            (args.since is None or entry.get('ts', 0) >= args.since) and
+            (args.provider is None or entry.get('provider') == args.provider) and
+            (args.request_id is None or entry.get('request_id') == args.request_id) and
+            (not args.errors or entry.get('error_class'))
+        )
+
+    records = (entry for entry in read_records(args.dir) if matches(entry))
+    if args.raw:
+        for entry in records:
+            print(json.dumps(entry))
+        return
+
+    rows = aggregate(records, args.group_by)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_table(rows)
+
+if __name__ == '__main__':
+    main()
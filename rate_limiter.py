@@ -0,0 +1,195 @@
+"""
+Rate Limiter
+Token buckets per provider for requests per minute, tokens per minute and
+requests per day, so the router spreads calls to stay under each provider's
+limits instead of waiting for a 429. With several API keys each key gets
+its own buckets ('provider#key'), sized from the provider's limits.
+"""
+
+import json
+import os
+import threading
+import time
+
+import model_capabilities
+
+# Free-tier limits per provider (None = unlimited); tokens per minute come
+# from the model capability table. Override with
+# AI_ROUTER_RATE_LIMITS='{"google_gemini": {"rpm": 15, "rpd": 1500}}'
+# or disable entirely with AI_ROUTER_RATE_LIMITS=off.
+DEFAULT_LIMITS = {
+    'github_models': {'rpm': 10, 'rpd': 50},
+    'openrouter': {'rpm': 20, 'rpd': 50},
+    'google_gemini': {'rpm': 15, 'rpd': 1500}
+}
+
+# Seconds each bucket takes to refill completely
+BUCKET_PERIODS = {'rpm': 60, 'tpm': 60, 'rpd': 86400}
+
+def load_limits(workers=1):
+    """Provider limits from the defaults and AI_ROUTER_RATE_LIMITS.
+
+    With several worker processes each one gets an equal share of the limits.
+    """
+    override = os.environ.get('AI_ROUTER_RATE_LIMITS', '')
+    if override.lower() == 'off':
+        return {}
+
+    limits = {provider: dict(values) for provider, values in DEFAULT_LIMITS.items()}
+    for provider, tpm in model_capabilities.tpm_budgets().items():
+        limits.setdefault(provider, {})['tpm'] = tpm
+    if override:
+        try:
+            for provider, values in json.loads(override).items():
+                limits.setdefault(provider, {}).update(values)
+        except (ValueError, AttributeError):
+            print("⚠️ AI_ROUTER_RATE_LIMITS is not valid JSON, using default limits")
+    if workers > 1:
+        for values in limits.values():
+            for kind, limit in values.items():
+                if limit:
+                    values[kind] = max(limit / workers, 1)
+    return limits
+
+_lock = threading.Lock()
+buckets = {}  # provider (or 'provider#key') -> {kind: {'capacity', 'rate', 'level', 'updated'}}
+provider_limits = {}
+
+def _new_buckets(values, now):
+    return {
+        kind: {
+            'capacity': float(limit),
+            'rate': float(limit) / BUCKET_PERIODS[kind],
+            'level': float(limit),
+            'updated': now
+        }
+        for kind, limit in values.items() if limit
+    }
+
+def configure(limits):
+    """(Re)build every bucket from a limits table; buckets start full"""
+    now = time.time()
+    with _lock:
+        buckets.clear()
+        provider_limits.clear()
+        provider_limits.update(limits)
+        for provider, values in limits.items():
+            buckets[provider] = _new_buckets(values, now)
+
+def ensure(name, values):
+    """Create buckets for a name outside the provider table (e.g. a tenant budget) unless they exist"""
+    with _lock:
+        if name not in buckets:
+            buckets[name] = _new_buckets(values, time.time())
+
+def _buckets_locked(name):
+    """Buckets of a provider, or of one key ('provider#key') created on first use"""
+    found = buckets.get(name)
+    if found is None and '#' in name:
+        values = provider_limits.get(name.split('#', 1)[0])
+        if values:
+            found = buckets[name] = _new_buckets(values, time.time())
+    return found or {}
+
+def _refill_locked(bucket, now):
+    elapsed = now - bucket['updated']
+    if elapsed > 0:
+        bucket['level'] = min(bucket['capacity'], bucket['level'] + elapsed * bucket['rate'])
+        bucket['updated'] = now
+
+def _needs(kind, tokens):
+    return tokens if kind == 'tpm' else 1
+
+def has_capacity(provider, tokens=0):
+    """True if a call of about `tokens` tokens fits in every bucket"""
+    now = time.time()
+    with _lock:
+        for kind, bucket in _buckets_locked(provider).items():
+            _refill_locked(bucket, now)
+            # A request bigger than the whole bucket can never fit; let it
+            # through once the bucket is full instead of blocking forever
+            need = min(_needs(kind, tokens), bucket['capacity'])
+            if bucket['level'] < need:
+                return False
+    return True
+
+def acquire(provider, tokens=0):
+    """Charge a call against the provider's buckets"""
+    now = time.time()
+    with _lock:
+        for kind, bucket in _buckets_locked(provider).items():
+            _refill_locked(bucket, now)
+            bucket['level'] -= _needs(kind, tokens)
+
+def release(provider, tokens=0):
+    """Give back the charge of a call that was reserved but never sent"""
+    with _lock:
+        for kind, bucket in _buckets_locked(provider).items():
+            bucket['level'] = min(bucket['capacity'], bucket['level'] + _needs(kind, tokens))
+
+def settle(provider, estimated_tokens, actual_tokens):
+    """Correct the tokens-per-minute bucket once the real usage is known"""
+    with _lock:
+        bucket = _buckets_locked(provider).get('tpm')
+        if bucket is not None and actual_tokens:
+            bucket['level'] = min(bucket['capacity'], bucket['level'] + estimated_tokens - actual_tokens)
+
+def wait_time(provider, tokens=0):
+    """Seconds until a call of about `tokens` tokens fits"""
+    now = time.time()
+    wait = 0.0
+    with _lock:
+        for kind, bucket in _buckets_locked(provider).items():
+            _refill_locked(bucket, now)
+            need = min(_needs(kind, tokens), bucket['capacity'])
+            if bucket['level'] < need and bucket['rate'] > 0:
+                wait = max(wait, (need - bucket['level']) / bucket['rate'])
+    return wait
+
+def headroom(provider):
+    """Fraction (0-1) of the provider's tightest bucket that is still available"""
+    now = time.time()
+    fill = 1.0
+    with _lock:
+        for bucket in _buckets_locked(provider).values():
+            _refill_locked(bucket, now)
+            fill = min(fill, max(bucket['level'], 0) / bucket['capacity'])
+    return fill
+
+def export_buckets():
+    """Bucket levels for a state snapshot: {name: {kind: (level, updated)}}"""
+    with _lock:
+        return {
+            name: {kind: (bucket['level'], bucket['updated']) for kind, bucket in provider_buckets.items()}
+            for name, provider_buckets in buckets.items()
+        }
+
+def restore_buckets(saved):
+    """Restore bucket levels from a snapshot; they refill for the time since it was taken"""
+    now = time.time()
+    with _lock:
+        for name, kinds in saved.items():
+            for kind, (level, updated) in kinds.items():
+                bucket = _buckets_locked(name).get(kind)
+                if bucket is not None and updated <= now:
+                    bucket['level'] = min(level, bucket['capacity'])
+                    bucket['updated'] = updated
+                    _refill_locked(bucket, now)
+
+def bucket_levels():
+    """Fill level of every bucket for /status"""
+    now = time.time()
+    levels = {}
+    with _lock:
+        for provider, provider_buckets in buckets.items():
+            levels[provider] = {}
+            for kind, bucket in provider_buckets.items():
+                _refill_locked(bucket, now)
+                levels[provider][kind] = {
+                    'limit': int(bucket['capacity']),
+                    'available': round(max(bucket['level'], 0), 2),
+                    'fill': round(max(bucket['level'], 0) / bucket['capacity'], 3)
+                }
+    return levels
+
+configure(load_limits())
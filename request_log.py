@@ -0,0 +1,170 @@
+"""
+Request Log
+Structured records of requests, provider attempts and circuit changes.
+Recording only appends to a bounded in-memory ring; a background thread
+writes the records in batches to rotating gzip-compressed JSONL files (and
+echoes their messages to stdout). When the ring fills up, successful
+records are sampled and then dropped, so the request path never blocks.
+"""
+
+import atexit
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+log_settings = {
+    'enabled': os.environ.get('AI_ROUTER_REQUEST_LOG', '1') == '1',
+    'dir': os.environ.get('AI_ROUTER_LOG_DIR', 'logs'),
+    'ring_size': int(os.environ.get('AI_ROUTER_LOG_RING_SIZE', 10000)),
+    # Share of successful records kept once the ring is more than 3/4 full
+    'sample_rate': float(os.environ.get('AI_ROUTER_LOG_SAMPLE_RATE', 0.1)),
+    'max_file_bytes': int(os.environ.get('AI_ROUTER_LOG_MAX_FILE_BYTES', 64 * 1024 * 1024)),
+    'rotate_seconds': float(os.environ.get('AI_ROUTER_LOG_ROTATE_SECONDS', 3600)),
+    'keep_files': int(os.environ.get('AI_ROUTER_LOG_KEEP_FILES', 24)),
+    # Echo record messages to stdout (from the writer thread)
+    'console': os.environ.get('AI_ROUTER_LOG_CONSOLE', '1') == '1',
+    'batch_size': 500,
+    'flush_interval': 1.0
+}
+
+FILE_PREFIX = 'requests-'
+FILE_SUFFIX = '.jsonl.gz'
+
+log_stats = {'recorded': 0, 'written': 0, 'sampled_out': 0, 'dropped': 0, 'files': 0, 'write_errors': 0}
+
+_ring = deque()
+_lock = threading.Lock()
+_wake = threading.Event()
+_writer = {'thread': None, 'pid': None, 'file': None, 'path': None, 'bytes': 0, 'opened_at': 0.0}
+_writer_lock = threading.Lock()  # serializes draining between the writer thread and flush()
+
+def _important(entry):
+    """Errors and state changes are never sampled away"""
+    return entry.get('error_class') is not None or entry['event'] not in ('attempt', 'request')
+
+def record(event, message=None, **fields):
+    """Queue one record; message is the human-readable line for the console"""
+    if not log_settings['enabled']:
+        return
+    entry = {'ts': round(time.time(), 6), 'event': event}
+    entry.update(fields)
+    size = log_settings['ring_size']
+    with _lock:
+        log_stats['recorded'] += 1
+        if len(_ring) >= size * 3 // 4 and not _important(entry):
+            if len(_ring) >= size or random.random() >= log_settings['sample_rate']:
+                log_stats['sampled_out'] += 1
+                return
+            entry['sample_weight'] = round(1 / log_settings['sample_rate'], 3)
+        if len(_ring) >= size:
+            _ring.popleft()  # make room for the error by losing the oldest record
+            log_stats['dropped'] += 1
+        _ring.append((entry, message))
+        wake = len(_ring) >= log_settings['batch_size']
+    _start_writer()
+    if wake:
+        _wake.set()
+
+def _log_path():
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(log_settings['dir'], f"{FILE_PREFIX}{stamp}-{os.getpid()}{FILE_SUFFIX}")
+
+def _prune():
+    """Remove the oldest log files beyond keep_files"""
+    try:
+        names = [name for name in os.listdir(log_settings['dir']) if name.startswith(FILE_PREFIX) and name.endswith(FILE_SUFFIX)]
+    except OSError:
+        return
+    paths = sorted((os.path.join(log_settings['dir'], name) for name in names), key=os.path.getmtime)
+    for path in paths[:max(len(paths) - log_settings['keep_files'], 0)]:
+        if path != _writer['path']:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def _close_file():
+    if _writer['file'] is not None:
+        _writer['file'].close()
+        _writer['file'] = None
+        _writer['path'] = None
+
+def _file_for_write():
+    """Current log file, rotated by size and age"""
+    now = time.time()
+    if _writer['file'] is not None and (
+        _writer['bytes'] >= log_settings['max_file_bytes'] or now - _writer['opened_at'] >= log_settings['rotate_seconds']
+    ):
+        _close_file()
+    if _writer['file'] is None:
+        os.makedirs(log_settings['dir'], exist_ok=True)
+        _writer['path'] = _log_path()
+        _writer['file'] = gzip.open(_writer['path'], 'ab')
+        _writer['bytes'] = 0
+        _writer['opened_at'] = now
+        log_stats['files'] += 1
+        _prune()
+    return _writer['file']
+
+def _drain():
+    """Write every queued record; runs in the writer thread (or at exit)"""
+    with _writer_lock:
+        with _lock:
+            batch = list(_ring)
+            _ring.clear()
+        if not batch:
+            return
+        if log_settings['console']:
+            for _, message in batch:
+                if message:
+                    print(message)
+        data = ''.join(json.dumps(entry, separators=(',', ':'), default=str) + '\n' for entry, _ in batch).encode()
+        try:
+            log_file = _file_for_write()
+            log_file.write(data)
+            log_file.flush()  # sync flush, so a crash loses at most the current batch
+            _writer['bytes'] += len(data)
+            log_stats['written'] += len(batch)
+        except OSError as e:
+            log_stats['write_errors'] += 1
+            print(f"⚠️ Request log write failed: {e}")
+            _close_file()
+
+def _write_loop():
+    while True:
+        _wake.wait(log_settings['flush_interval'])
+        _wake.clear()
+        try:
+            _drain()
+        except Exception as e:
+            print(f"⚠️ Request log writer failed: {e}")
+
+def _start_writer():
+    """Start the writer thread (again in a forked worker process)"""
+    if _writer['pid'] == os.getpid():
+        return
+    with _writer_lock:
+        if _writer['pid'] != os.getpid():
+            # A forked worker must not share the parent's open file
+            _writer['file'] = None
+            _writer['path'] = None
+            _writer['thread'] = threading.Thread(target=_write_loop, name='request-log', daemon=True)
+            _writer['thread'].start()
+            _writer['pid'] = os.getpid()
+
+def flush():
+    """Write what is queued and close the current file"""
+    _drain()
+    with _writer_lock:
+        _close_file()
+
+atexit.register(flush)
+
+def stats():
+    """Pipeline counters for /status"""
+    with _lock:
+        return dict(log_stats, queued=len(_ring), enabled=log_settings['enabled'], dir=log_settings['dir'])
@@ -0,0 +1,59 @@
+"""
+Request Timing
+Per-request phase timings: validation, cache lookups, load_env, admission
+queue wait, every upstream attempt with its connection setup and time to
+first byte, response parsing and serialization. They are returned in a
+Server-Timing response header and, when a request sets "debug": true, in a
+"debug" block of the response body. Phases are collected through a context
+variable, so code deep in the call path can add to the request it serves.
+"""
+
+import contextvars
+import os
+import time
+
+timing_settings = {
+    # Set to 0 to stop sending the Server-Timing header
+    'server_timing': os.environ.get('AI_ROUTER_SERVER_TIMING', '1') == '1'
+}
+
+_current = contextvars.ContextVar('request_timing', default=None)
+
+def start():
+    """Start collecting phases for the current request; returns (timings, token for finish())"""
+    timings = {'started': time.perf_counter(), 'phases': []}
+    return timings, _current.set(timings)
+
+def finish(token):
+    """Stop collecting phases for the current request"""
+    _current.reset(token)
+
+def add(name, seconds, description=None):
+    """Add one phase to the current request (does nothing outside a timed request)"""
+    timings = _current.get()
+    if timings is not None:
+        timings['phases'].append((name, seconds, description))
+
+def _total(timings):
+    return time.perf_counter() - timings['started']
+
+def header(timings):
+    """Server-Timing header value (durations in milliseconds)"""
+    entries = []
+    for name, seconds, description in timings['phases']:
+        entry = f'{name};dur={seconds * 1000:.1f}'
+        if description:
+            entry += ';desc="{}"'.format(str(description).replace('\\', '').replace('"', "'"))
+        entries.append(entry)
+    entries.append(f'total;dur={_total(timings) * 1000:.1f}')
+    return ', '.join(entries)
+
+def debug_block(timings):
+    """The "debug" block of a response body"""
+    return {
+        'timings': [
+            {'phase': name, 'ms': round(seconds * 1000, 2), 'detail': description}
+            for name, seconds, description in timings['phases']
+        ],
+        'total_ms': round(_total(timings) * 1000, 2)
+    }
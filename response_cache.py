@@ -0,0 +1,182 @@
+"""
+Response Cache
+In-memory LRU cache with TTL and size-based eviction for /ai-request
+responses, with an optional SQLite tier that survives restarts.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Cache configuration (override through environment variables)
+cache_settings = {
+    'enabled': os.environ.get('AI_ROUTER_CACHE', '1') == '1',
+    'ttl_seconds': float(os.environ.get('AI_ROUTER_CACHE_TTL_SECONDS', 3600)),
+    'max_entries': int(os.environ.get('AI_ROUTER_CACHE_MAX_ENTRIES', 10000)),
+    'max_bytes': int(os.environ.get('AI_ROUTER_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    # Path of the SQLite file for the persistent tier (disabled when empty)
+    'disk_path': os.environ.get('AI_ROUTER_CACHE_DB', ''),
+    'disk_max_entries': int(os.environ.get('AI_ROUTER_CACHE_DISK_MAX_ENTRIES', 100000))
+}
+
+CACHE_MODES = ('default', 'bypass', 'only')
+
+_entries = OrderedDict()  # key -> (expires_at, size, value)
+_lock = threading.Lock()
+_disk = None
+_disk_lock = threading.Lock()
+
+cache_counters = {
+    'hits': 0,
+    'memory_hits': 0,
+    'disk_hits': 0,
+    'misses': 0,
+    'stores': 0,
+    'evictions': 0,
+    'expirations': 0,
+    'bytes': 0
+}
+
+def cache_key(prompt, system_prompt, model_type, max_tokens, temperature):
+    """Build the cache key for a normalized request"""
+    normalized = {
+        'prompt': prompt.strip(),
+        'system_prompt': (system_prompt or '').strip(),
+        'model_type': model_type,
+        'max_tokens': int(max_tokens),
+        'temperature': round(float(temperature), 3)
+    }
+    encoded = json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+def _get_disk():
+    """Open the SQLite tier on first use"""
+    global _disk
+    if _disk is not None or not cache_settings['disk_path']:
+        return _disk
+
+    with _disk_lock:
+        if _disk is not None:
+            return _disk
+        connection = sqlite3.connect(cache_settings['disk_path'], check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS response_cache '
+            '(key TEXT PRIMARY KEY, expires_at REAL, value TEXT)'
+        )
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS response_cache_expires ON response_cache (expires_at)'
+        )
+        connection.commit()
+        _disk = connection
+        return _disk
+
+def _evict_locked():
+    """Drop least recently used entries until within the limits (lock held)"""
+    while _entries and (
+        len(_entries) > cache_settings['max_entries'] or
+        cache_counters['bytes'] > cache_settings['max_bytes']
+    ):
+        _, (_, size, _) = _entries.popitem(last=False)
+        cache_counters['bytes'] -= size
+        cache_counters['evictions'] += 1
+
+def _store_memory(key, expires_at, value, size):
+    with _lock:
+        old = _entries.pop(key, None)
+        if old is not None:
+            cache_counters['bytes'] -= old[1]
+        _entries[key] = (expires_at, size, value)
+        cache_counters['bytes'] += size
+        _evict_locked()
+
+def get(key):
+    """Return the cached value for key, or None"""
+    now = time.time()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            expires_at, size, value = entry
+            if expires_at > now:
+                _entries.move_to_end(key)
+                cache_counters['hits'] += 1
+                cache_counters['memory_hits'] += 1
+                return value
+            del _entries[key]
+            cache_counters['bytes'] -= size
+            cache_counters['expirations'] += 1
+
+    disk = _get_disk()
+    if disk is not None:
+        with _disk_lock:
+            row = disk.execute(
+                'SELECT expires_at, value FROM response_cache WHERE key = ?', (key,)
+            ).fetchone()
+        if row is not None and row[0] > now:
+            value = json.loads(row[1])
+            _store_memory(key, row[0], value, len(row[1]))
+            with _lock:
+                cache_counters['hits'] += 1
+                cache_counters['disk_hits'] += 1
+            return value
+
+    with _lock:
+        cache_counters['misses'] += 1
+    return None
+
+def put(key, value):
+    """Store a value in the memory tier and, when enabled, on disk"""
+    expires_at = time.time() + cache_settings['ttl_seconds']
+    encoded = json.dumps(value, ensure_ascii=False)
+    _store_memory(key, expires_at, value, len(encoded))
+    with _lock:
+        cache_counters['stores'] += 1
+        prune = cache_counters['stores'] % 100 == 0
+
+    disk = _get_disk()
+    if disk is not None:
+        with _disk_lock:
+            disk.execute(
+                'INSERT OR REPLACE INTO response_cache (key, expires_at, value) VALUES (?, ?, ?)',
+                (key, expires_at, encoded)
+            )
+            if prune:
+                _prune_disk_locked(disk)
+            disk.commit()
+
+def _prune_disk_locked(disk):
+    """Drop expired rows and the soonest-to-expire rows beyond the disk limit"""
+    disk.execute('DELETE FROM response_cache WHERE expires_at <= ?', (time.time(),))
+    disk.execute(
+        'DELETE FROM response_cache WHERE key IN ('
+        'SELECT key FROM response_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)',
+        (cache_settings['disk_max_entries'],)
+    )
+
+def cache_stats():
+    """Cache counters for /status"""
+    with _lock:
+        stats = dict(cache_counters)
+        stats['entries'] = len(_entries)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+    stats['enabled'] = cache_settings['enabled']
+    stats['disk_tier'] = bool(cache_settings['disk_path'])
+    stats['ttl_seconds'] = cache_settings['ttl_seconds']
+    return stats
+
+def clear():
+    """Empty both cache tiers"""
+    with _lock:
+        _entries.clear()
+        cache_counters['bytes'] = 0
+    disk = _get_disk()
+    if disk is not None:
+        with _disk_lock:
+            disk.execute('DELETE FROM response_cache')
+            disk.commit()
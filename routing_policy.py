@@ -0,0 +1,148 @@
+"""
+Routing Policy
+Rolling per-provider statistics (EWMA latency, error rate, calls in flight)
+and the policies that pick a provider from the available candidates.
+"""
+
+import json
+import os
+import threading
+
+import model_capabilities
+
+policy_settings = {
+    'default': os.environ.get('AI_ROUTER_POLICY', 'priority'),
+    'ewma_alpha': float(os.environ.get('AI_ROUTER_EWMA_ALPHA', 0.2)),
+    # Relative weights for weighted_round_robin, e.g. '{"google_gemini": 3}'
+    'weights': {}
+}
+
+try:
+    policy_settings['weights'] = json.loads(os.environ.get('AI_ROUTER_WEIGHTS', '') or '{}')
+except ValueError:
+    print("⚠️ AI_ROUTER_WEIGHTS is not valid JSON, using equal weights")
+
+_lock = threading.Lock()
+provider_stats = {}  # provider -> rolling statistics
+
+def _stats_for(provider):
+    """Rolling statistics of a provider (lock held)"""
+    stats = provider_stats.get(provider)
+    if stats is None:
+        stats = {
+            'ewma_latency': None,
+            'error_rate': 0.0,
+            'outstanding': 0,
+            'calls': 0,
+            'wrr_current': 0.0
+        }
+        provider_stats[provider] = stats
+    return stats
+
+def track_outstanding(provider, delta):
+    """Adjust the number of calls in flight to a provider"""
+    with _lock:
+        _stats_for(provider)['outstanding'] += delta
+
+def record_outcome(provider, latency, success):
+    """Fold one finished call into the provider's rolling statistics"""
+    alpha = policy_settings['ewma_alpha']
+    with _lock:
+        stats = _stats_for(provider)
+        stats['calls'] += 1
+        stats['error_rate'] = (1 - alpha) * stats['error_rate'] + alpha * (0.0 if success else 1.0)
+        if success and latency is not None:
+            if stats['ewma_latency'] is None:
+                stats['ewma_latency'] = latency
+            else:
+                stats['ewma_latency'] = (1 - alpha) * stats['ewma_latency'] + alpha * latency
+
+def export_stats():
+    """Rolling statistics for a state snapshot"""
+    with _lock:
+        return {
+            provider: {'ewma_latency': stats['ewma_latency'], 'error_rate': stats['error_rate'], 'calls': stats['calls']}
+            for provider, stats in provider_stats.items()
+        }
+
+def restore_stats(saved):
+    """Restore rolling statistics from a snapshot (calls in flight start at zero)"""
+    with _lock:
+        for provider, values in saved.items():
+            _stats_for(provider).update(values)
+
+def _priority(candidates, headroom):
+    return candidates[0]
+
+def _least_outstanding(candidates, headroom):
+    # min() keeps the priority order on ties
+    return min(candidates, key=lambda provider: provider_stats[provider]['outstanding'])
+
+def _expected_latency(provider):
+    stats = provider_stats[provider]
+    if stats['ewma_latency'] is None:
+        # Untried providers go first so they get measured, the fastest model first
+        return -model_capabilities.relative_speed(provider)
+    # Each failure costs roughly another attempt
+    return stats['ewma_latency'] / max(1.0 - stats['error_rate'], 0.05)
+
+def typical_latency(provider):
+    """EWMA latency of a provider's successful calls (None until measured)"""
+    with _lock:
+        stats = provider_stats.get(provider)
+        return stats['ewma_latency'] if stats else None
+
+def _lowest_latency(candidates, headroom):
+    return min(candidates, key=_expected_latency)
+
+def _weighted_round_robin(candidates, headroom):
+    """Smooth weighted round-robin; weights shrink with errors and lost headroom"""
+    total = 0.0
+    best = None
+    for provider in candidates:
+        stats = provider_stats[provider]
+        weight = float(policy_settings['weights'].get(provider, 1.0))
+        weight *= max(1.0 - stats['error_rate'], 0.05) * max(headroom.get(provider, 1.0), 0.05)
+        stats['wrr_current'] += weight
+        total += weight
+        if best is None or stats['wrr_current'] > provider_stats[best]['wrr_current']:
+            best = provider
+    provider_stats[best]['wrr_current'] -= total
+    return best
+
+POLICIES = {
+    'priority': _priority,
+    'weighted_round_robin': _weighted_round_robin,
+    'least_outstanding': _least_outstanding,
+    'lowest_latency': _lowest_latency
+}
+
+def choose(candidates, policy=None, headroom=None):
+    """Pick a provider from candidates (given in priority order)"""
+    if not candidates:
+        return None
+    select = POLICIES.get(policy or policy_settings['default'], _priority)
+    with _lock:
+        for provider in candidates:
+            _stats_for(provider)
+        return select(candidates, headroom or {})
+
+def routing_stats(headroom=None):
+    """Rolling statistics per provider for /status"""
+    headroom = headroom or {}
+    with _lock:
+        providers = {
+            provider: {
+                'ewma_latency': round(stats['ewma_latency'], 3) if stats['ewma_latency'] is not None else None,
+                'error_rate': round(stats['error_rate'], 3),
+                'outstanding': stats['outstanding'],
+                'headroom': round(headroom.get(provider, 1.0), 3),
+                'calls': stats['calls']
+            }
+            for provider, stats in provider_stats.items()
+        }
+    return {
+        'default_policy': policy_settings['default'],
+        'policies': list(POLICIES),
+        'providers': providers
+    }
@@ -0,0 +1,141 @@
+"""
+Shared State
+Provider key status (circuit state, availability, recovery time, counters)
+and idempotency keys kept in a SQLite database in WAL mode, so every worker
+process of a multi-worker server sees a rate limit as soon as one worker
+hits it, and a retried request as soon as one worker has started it.
+"""
+
+import os
+import sqlite3
+import threading
+
+state_settings = {
+    # Path of the SQLite file; empty keeps the state inside this process
+    'db_path': os.environ.get('AI_ROUTER_STATE_DB', '')
+}
+
+_local = threading.local()  # one connection per thread and process
+
+def enabled():
+    return bool(state_settings['db_path'])
+
+def _connection():
+    """Open (or reuse) this thread's connection; reopened after a fork"""
+    connection = getattr(_local, 'connection', None)
+    if connection is not None and _local.pid == os.getpid():
+        return connection
+
+    connection = sqlite3.connect(state_settings['db_path'], timeout=5, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS key_status ('
+        'provider TEXT, key_id TEXT, available INTEGER DEFAULT 1, recovery_time REAL, '
+        'requests INTEGER DEFAULT 0, failures INTEGER DEFAULT 0, '
+        "state TEXT DEFAULT 'closed', consecutive_failures INTEGER DEFAULT 0, "
+        'PRIMARY KEY (provider, key_id))'
+    )
+    # Databases written before the circuit breaker lack its columns
+    columns = {row[1] for row in connection.execute('PRAGMA table_info(key_status)')}
+    if 'state' not in columns:
+        connection.execute("ALTER TABLE key_status ADD COLUMN state TEXT DEFAULT 'closed'")
+    if 'consecutive_failures' not in columns:
+        connection.execute('ALTER TABLE key_status ADD COLUMN consecutive_failures INTEGER DEFAULT 0')
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS idempotency ('
+        'key TEXT PRIMARY KEY, fingerprint TEXT, state TEXT, result TEXT, expires_at REAL)'
+    )
+    _local.connection = connection
+    _local.pid = os.getpid()
+    return connection
+
+def register(provider, key_id):
+    """Add a key row unless another worker already did"""
+    _connection().execute(
+        'INSERT OR IGNORE INTO key_status (provider, key_id) VALUES (?, ?)', (provider, key_id)
+    )
+
+def add_request(provider, key_id):
+    _connection().execute(
+        'UPDATE key_status SET requests = requests + 1 WHERE provider = ? AND key_id = ?',
+        (provider, key_id)
+    )
+
+def mark_failed(provider, key_id, recovery_time, consecutive_failures):
+    """Open a key's circuit until recovery_time (a Unix timestamp)"""
+    _connection().execute(
+        "UPDATE key_status SET state = 'open', available = 0, recovery_time = ?, "
+        'consecutive_failures = ?, failures = failures + 1 WHERE provider = ? AND key_id = ?',
+        (recovery_time, consecutive_failures, provider, key_id)
+    )
+
+def claim_probe(provider, key_id, now, probe_deadline):
+    """Move a due key to half-open; True for the one worker that gets to probe it"""
+    cursor = _connection().execute(
+        "UPDATE key_status SET state = 'half_open', recovery_time = ? "
+        "WHERE provider = ? AND key_id = ? AND state != 'closed' AND recovery_time <= ?",
+        (probe_deadline, provider, key_id, now)
+    )
+    return cursor.rowcount == 1
+
+def mark_recovered(provider, key_id):
+    """Close a key's circuit after a successful probe"""
+    _connection().execute(
+        "UPDATE key_status SET state = 'closed', available = 1, recovery_time = NULL, "
+        'consecutive_failures = 0 WHERE provider = ? AND key_id = ?',
+        (provider, key_id)
+    )
+
+def restore_open(provider, key_id, recovery_time, consecutive_failures):
+    """Re-open a key from a state snapshot unless a running worker already changed it"""
+    _connection().execute(
+        "UPDATE key_status SET state = 'open', available = 0, recovery_time = ?, consecutive_failures = ? "
+        "WHERE provider = ? AND key_id = ? AND state = 'closed' AND consecutive_failures = 0",
+        (recovery_time, consecutive_failures, provider, key_id)
+    )
+
+def load():
+    """Every key row as {(provider, key_id): {...}}"""
+    rows = _connection().execute(
+        'SELECT provider, key_id, state, available, recovery_time, consecutive_failures, '
+        'requests, failures FROM key_status'
+    ).fetchall()
+    return {
+        (provider, key_id): {
+            'state': state,
+            'available': bool(available),
+            'recovery_time': recovery_time,
+            'consecutive_failures': consecutive_failures,
+            'requests': requests,
+            'failures': failures
+        }
+        for provider, key_id, state, available, recovery_time, consecutive_failures, requests, failures in rows
+    }
+
+def claim_idempotency(key, fingerprint, expires_at, now):
+    """Start an idempotent request; returns None for the claiming worker, else (fingerprint, state, result)"""
+    connection = _connection()
+    connection.execute('DELETE FROM idempotency WHERE key = ? AND expires_at <= ?', (key, now))
+    cursor = connection.execute(
+        "INSERT OR IGNORE INTO idempotency (key, fingerprint, state, expires_at) VALUES (?, ?, 'in_progress', ?)",
+        (key, fingerprint, expires_at)
+    )
+    if cursor.rowcount == 1:
+        return None
+    row = connection.execute('SELECT fingerprint, state, result FROM idempotency WHERE key = ?', (key,)).fetchone()
+    return row or (fingerprint, 'in_progress', None)
+
+def finish_idempotency(key, result, expires_at):
+    """Store the result of an idempotent request (result is JSON text)"""
+    _connection().execute(
+        "UPDATE idempotency SET state = 'done', result = ?, expires_at = ? WHERE key = ?",
+        (result, expires_at, key)
+    )
+
+def release_idempotency(key):
+    """Forget an idempotent request so a retry runs it again"""
+    _connection().execute('DELETE FROM idempotency WHERE key = ?', (key,))
+
+def prune_idempotency(now):
+    _connection().execute('DELETE FROM idempotency WHERE expires_at <= ?', (now,))
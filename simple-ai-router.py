@@ -6,12 +6,41 @@ A lightweight version of the n8n AI rotation system that you can use right now.
 
 import os
 import json
-import requests
 import time
+import hashlib
+import asyncio
+import contextvars
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+from urllib.parse import parse_qs
+from flask import Flask, Response, request, jsonify, stream_with_context
 import random
 import string
+import sys
+import tempfile
+
+import admission_queue
+import batch_runner
+import circuit_breaker
+import deadlines
+import metrics
+import model_capabilities
+import model_routes
+import provider_pool
+import profiler
+import rate_limiter
+import request_log
+import request_timing
+import fuzzy_cache
+import health_probe
+import idempotency
+import response_cache
+import routing_policy
+import shared_state
+import state_snapshot
+import tenants
 
 app = Flask(__name__)
 
@@ -21,16 +50,66 @@ provider_status = {
     'openrouter': {'available': True, 'recovery_time': None, 'requests': 0, 'failures': 0},
     'google_gemini': {'available': True, 'recovery_time': None, 'requests': 0, 'failures': 0}
 }
+# Guards provider_status; with AI_ROUTER_STATE_DB set, key status is also
+# mirrored in shared_state so every worker process sees it
+status_lock = threading.RLock()
 
-# Recovery times for each provider (in minutes)
+# Longest circuit-breaker backoff for each provider (in minutes); responses
+# with Retry-After or x-ratelimit-reset headers set their own recovery time
 recovery_times = {
     'github_models': 60,  # 1 hour
     'openrouter': 15,     # 15 minutes  
     'google_gemini': 1    # 1 minute
 }
 
+# Credential variable of each provider. Several keys can be configured as a
+# comma-separated list or as numbered variables (GITHUB_TOKEN_2, ...).
+PROVIDER_KEY_VARS = {
+    'github_models': 'GITHUB_TOKEN',
+    'openrouter': 'OPENROUTER_API_KEY',
+    'google_gemini': 'GOOGLE_API_KEY'
+}
+MAX_NUMBERED_KEYS = 20
+
+key_settings = {'rotation': os.environ.get('AI_ROUTER_KEY_ROTATION', 'least_used')}  # or round_robin
+key_cursors = {provider: 0 for provider in provider_status}
+key_secrets = {}  # (provider, key id) -> key, for health probes
+key_last_used = {}  # (provider, key id) -> time of the key's last call
+for status in provider_status.values():
+    status['state'] = circuit_breaker.CLOSED
+    status['keys'] = {}  # key id -> circuit breaker entry (see circuit_breaker.new_entry)
+
+# Hedged requests: race a backup provider when the primary is slower than usual
+hedge_settings = {
+    'enabled': os.environ.get('AI_ROUTER_HEDGE') == '1',  # per-request "hedge" overrides this
+    'percentile': float(os.environ.get('AI_ROUTER_HEDGE_PERCENTILE', 0.95)),
+    'min_samples': 10,        # below this, use default_delay
+    'default_delay': float(os.environ.get('AI_ROUTER_HEDGE_DEFAULT_DELAY', 5.0)),
+    'min_delay': 0.25         # never hedge sooner than this (seconds)
+}
+
+hedge_stats = {'hedged_requests': 0, 'hedge_wins': 0, 'primary_wins': 0, 'wasted_calls': 0}
+
+# Single-flight coalescing of identical in-flight requests
+coalesce_settings = {'enabled': os.environ.get('AI_ROUTER_COALESCE', '1') == '1'}
+coalesce_stats = {'leaders': 0, 'followers': 0}
+inflight_requests = {}  # request key -> {'done': Event or Future, 'result': (body, status_code)}
+inflight_lock = threading.Lock()
+
+# Recent successful latencies per provider (seconds)
+provider_latency = {provider: deque(maxlen=200) for provider in provider_status}
+latency_lock = threading.Lock()
+
+# Worker threads for hedged calls in the Flask server
+hedge_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('AI_ROUTER_HEDGE_WORKERS', 64)))
+
+# Environment loaded by load_env(); the .env file and the variables don't change while the router runs
+_env_cache = {}
+
 def load_env():
-    """Load environment variables from .env file or OS environment"""
+    """Load environment variables from .env file or OS environment (once per process)"""
+    if 'env_vars' in _env_cache:
+        return _env_cache['env_vars']
     env_vars = {}
     
     # Try to load from .env file first (for local development)
@@ -42,61 +121,511 @@ def load_env():
                     key, value = line.split('=', 1)
                     env_vars[key] = value
     except FileNotFoundError:
-        print("ℹ️ .env file not found, using environment variables")
+        request_log.record('config', "ℹ️ .env file not found, using environment variables")
     
     # Override with actual environment variables (for Railway deployment)
-    env_vars['GITHUB_TOKEN'] = os.environ.get('GITHUB_TOKEN', env_vars.get('GITHUB_TOKEN'))
-    env_vars['OPENROUTER_API_KEY'] = os.environ.get('OPENROUTER_API_KEY', env_vars.get('OPENROUTER_API_KEY'))
-    env_vars['GOOGLE_API_KEY'] = os.environ.get('GOOGLE_API_KEY', env_vars.get('GOOGLE_API_KEY'))
+    key_pools = {}
+    for provider, var in PROVIDER_KEY_VARS.items():
+        names = [var] + [f'{var}_{n}' for n in range(2, MAX_NUMBERED_KEYS + 1)]
+        keys = []
+        for name in names:
+            value = os.environ.get(name, env_vars.get(name))
+            for key in (value or '').split(','):
+                key = key.strip()
+                if key and key not in keys:
+                    keys.append(key)
+        key_pools[provider] = keys
+        env_vars[var] = keys[0] if keys else None
+    env_vars['key_pools'] = key_pools
     
     # Check if we have all required keys
     if not all([env_vars.get('GITHUB_TOKEN'), env_vars.get('OPENROUTER_API_KEY'), env_vars.get('GOOGLE_API_KEY')]):
-        print("❌ Missing required environment variables!")
-        return None
-    
+        request_log.record('config', "❌ Missing required environment variables!", error_class='config')
+        env_vars = None
+    else:
+        register_keys(key_pools)
+    _env_cache['env_vars'] = env_vars
     return env_vars
 
+def key_id(key):
+    """Short fingerprint that identifies a key without revealing it"""
+    return hashlib.sha256(key.encode()).hexdigest()[:8]
+
+def register_keys(key_pools):
+    """Make sure every configured key has its own status entry"""
+    with status_lock:
+        for provider, keys in key_pools.items():
+            entries = provider_status[provider]['keys']
+            for key in keys:
+                kid = key_id(key)
+                key_secrets[(provider, kid)] = key
+                if kid not in entries:
+                    entries[kid] = circuit_breaker.new_entry()
+                    if shared_state.enabled():
+                        shared_state.register(provider, kid)
+
+def sync_shared_status():
+    """Pull key status written by other worker processes into provider_status"""
+    if not shared_state.enabled():
+        return
+    rows = shared_state.load()
+    with status_lock:
+        for provider, status in provider_status.items():
+            for kid, entry in status['keys'].items():
+                row = rows.get((provider, kid))
+                if row is None:
+                    continue
+                entry.update(row)
+                entry['recovery_time'] = datetime.fromtimestamp(row['recovery_time']) if row['recovery_time'] else None
+            if status['keys']:
+                status['requests'] = sum(entry['requests'] for entry in status['keys'].values())
+                status['failures'] = sum(entry['failures'] for entry in status['keys'].values())
+                update_provider_availability(provider)
+
+def key_bucket(provider, kid):
+    """Rate-limiter bucket name of one provider key"""
+    return f'{provider}#{kid}' if kid else provider
+
+def env_with_keys(env_vars, keys, model_type=None):
+    """Copy of env_vars using the chosen key of each provider (and the models of model_type's route)"""
+    env = dict(env_vars)
+    for provider, (kid, key) in keys.items():
+        if key:
+            env[PROVIDER_KEY_VARS[provider]] = key
+    if model_type is not None:
+        env['models'] = model_routes.models(model_type)
+    return env
+
+def request_model(env_vars, provider):
+    """Model to call a provider with: the route's model, or the provider's default one"""
+    return (env_vars.get('models') or {}).get(provider) or model_capabilities.capabilities[provider]['model']
+
+def usable_keys(provider, key_pool, tokens=0):
+    """(key id, key) pairs of a provider that are available and have rate-limit room"""
+    entries = provider_status[provider]['keys']
+    usable = []
+    for key in key_pool:
+        kid = key_id(key)
+        entry = entries.get(kid)
+        if entry and entry['available'] and rate_limiter.has_capacity(key_bucket(provider, kid), tokens):
+            usable.append((kid, key))
+    return usable
+
+def provider_has_capacity(provider, tokens=0):
+    """True if any key of the provider is available with rate-limit room"""
+    entries = provider_status[provider]['keys']
+    if not entries:
+        return rate_limiter.has_capacity(provider, tokens)
+    return any(
+        entry['available'] and rate_limiter.has_capacity(key_bucket(provider, kid), tokens)
+        for kid, entry in entries.items()
+    )
+
+def choose_key(provider, env_vars, tokens=0):
+    """Pick the key for a call (least used or round robin); returns (key id, key)"""
+    usable = usable_keys(provider, env_vars['key_pools'][provider], tokens)
+    if not usable:
+        return None, None
+    if key_settings['rotation'] == 'round_robin':
+        with status_lock:
+            key_cursors[provider] = (key_cursors[provider] + 1) % len(usable)
+            return usable[key_cursors[provider]]
+    entries = provider_status[provider]['keys']
+    return min(usable, key=lambda pair: entries[pair[0]]['requests'])
+
+def update_provider_availability(provider):
+    """A provider is available (closed) while any of its keys is"""
+    status = provider_status[provider]
+    if not status['keys']:
+        return
+    states = {entry['state'] for entry in status['keys'].values()}
+    waiting = [entry for entry in status['keys'].values() if not entry['available']]
+    status['available'] = len(waiting) < len(status['keys'])
+    recovery_times_left = [entry['recovery_time'] for entry in waiting if entry['recovery_time']]
+    status['recovery_time'] = None if status['available'] or not recovery_times_left else min(recovery_times_left)
+    for state in (circuit_breaker.CLOSED, circuit_breaker.HALF_OPEN, circuit_breaker.OPEN):
+        if state in states:
+            status['state'] = state
+            break
+
 def generate_request_id():
     """Generate a random request ID"""
     return ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
 
 def check_recovery():
-    """Check if any providers should be recovered from rate limiting"""
+    """Move keys whose circuit is due to half-open and send each one probe"""
+    sync_shared_status()
     current_time = datetime.now()
-    for provider, status in provider_status.items():
-        if not status['available'] and status['recovery_time']:
-            if current_time >= status['recovery_time']:
-                status['available'] = True
-                status['recovery_time'] = None
-                print(f"✅ {provider} recovered and available again")
+    probes = []
+    with status_lock:
+        for provider, status in provider_status.items():
+            for kid, entry in status['keys'].items():
+                if not circuit_breaker.ready_to_probe(entry, current_time):
+                    continue
+                if shared_state.enabled():
+                    probe_deadline = current_time + timedelta(seconds=circuit_breaker.breaker_settings['probe_timeout'])
+                    if not shared_state.claim_probe(provider, kid, current_time.timestamp(), probe_deadline.timestamp()):
+                        continue  # another worker is probing this key
+                circuit_breaker.start_probe(entry, current_time)
+                probes.append((provider, kid))
+            
+            was_available = status['available']
+            update_provider_availability(provider)
+            if not status['keys'] and not status['available'] and status['recovery_time']:
+                if current_time >= status['recovery_time']:
+                    status['available'] = True
+                    status['recovery_time'] = None
+            if status['available'] and not was_available:
+                request_log.record('recovered', f"✅ {provider} recovered and available again", provider=provider)
+    
+    for provider, kid in probes:
+        request_log.record('probe', f"🔎 {provider} key {kid} half-open, probing", provider=provider, key=kid)
+        hedge_executor.submit(probe_key, provider, kid)
+
+def probe_key(provider, kid):
+    """Send one minimal request with a half-open key and close or re-open its circuit"""
+    env = {PROVIDER_KEY_VARS[provider]: key_secrets[(provider, kid)]}
+    start_provider_call(provider, 1, kid)
+    try:
+        result = call_provider(provider, env, 'ping', '', 1, 0)
+    except Exception as e:
+        result = {'success': False, 'error': str(e), 'status_code': None}
+    
+    if not result['success']:
+        mark_provider_failed(
+            provider, is_rate_limit_error(result['status_code'], result['error']), kid, result.get('retry_after')
+        )
+        return
+    with status_lock:
+        entry = provider_status[provider]['keys'][kid]
+        circuit_breaker.close(entry)
+        if shared_state.enabled():
+            shared_state.mark_recovered(provider, kid)
+        update_provider_availability(provider)
+    request_log.record('recovered', f"✅ {provider} key {kid} recovered and available again", provider=provider, key=kid)
+    admission_queue.notify()
 
-def mark_provider_failed(provider, is_rate_limit=True):
-    """Mark a provider as failed/rate limited"""
-    provider_status[provider]['available'] = False
-    provider_status[provider]['failures'] += 1
+def probe_targets():
+    """Keys due for a background health probe: (provider, key id, key) tuples.
     
+    Keys with an open circuit are left to their half-open probe, keys that
+    served traffic within the probe interval are already known to be healthy
+    (and keep the connection warm), and keys short on rate-limit headroom
+    are left alone so probes never compete with user requests for quota.
+    """
+    if not key_secrets:
+        load_env()
+    now = time.time()
+    targets = []
+    with status_lock:
+        for (provider, kid), key in key_secrets.items():
+            entry = provider_status[provider]['keys'].get(kid)
+            if entry is None or not entry['available']:
+                continue
+            if now - key_last_used.get((provider, kid), 0) < health_probe.probe_settings['interval']:
+                continue
+            if rate_limiter.headroom(key_bucket(provider, kid)) < 0.5:
+                continue
+            targets.append((provider, kid, key))
+    return targets
+
+def record_probe(result):
+    """Feed a health probe result into provider_status"""
+    provider, kid = result['provider'], result['key']
+    alpha = routing_policy.policy_settings['ewma_alpha']
+    with status_lock:
+        probe = provider_status[provider].setdefault('probe', {'latency': None})
+        if result['ok']:
+            previous = probe['latency']
+            probe['latency'] = result['latency'] if previous is None else (1 - alpha) * previous + alpha * result['latency']
+        probe.update(
+            ok=result['ok'],
+            status_code=result['status_code'],
+            last_latency=round(result['latency'], 4),
+            checked_at=datetime.now().isoformat()
+        )
+    outcome = 'ok' if result['ok'] else 'rate_limited' if result['rate_limited'] else 'error'
+    metrics.observe('ai_router_probe_duration_seconds', result['latency'], (('provider', provider), ('outcome', outcome)))
+    if result['unhealthy']:
+        request_log.record(
+            'health_probe',
+            f"🩺 {provider} key {kid} failed its health probe ({result['status_code'] or result['error']})",
+            provider=provider, key=kid, status_code=result['status_code'], latency=round(result['latency'], 6)
+        )
+        mark_provider_failed(provider, result['rate_limited'], kid, result['retry_after'])
+
+def start_worker_tasks(async_mode):
+    """Background work of a serving process: state snapshots and, on the threaded server, health probes.
+    
+    The async server runs its probes on its event loop (see asgi_app), so they warm the async clients.
+    """
+    state_snapshot.start(collect_state)
+    if not async_mode:
+        health_probe.start(probe_targets, record_probe)
+
+def mark_provider_failed(provider, is_rate_limit=True, kid=None, retry_after=None):
+    """Open the circuit of a provider key (or, without kid, of every key of the provider).
+    
+    The circuit stays open for retry_after seconds when the provider said how
+    long to wait, otherwise for an exponential backoff capped at recovery_times.
+    """
+    cap = recovery_times.get(provider, 15) * 60
+    
+    with status_lock:
+        provider_status[provider]['failures'] += 1
+        entries = provider_status[provider]['keys']
+        targets = [kid] if kid in entries else list(entries)
+        
+        for target in targets:
+            entry = entries[target]
+            if retry_after is not None:
+                delay = retry_after
+            else:
+                delay = circuit_breaker.backoff_delay(entry['consecutive_failures'] + 1, cap)
+            circuit_breaker.trip(entry, delay)
+            if shared_state.enabled():
+                shared_state.mark_failed(provider, target, entry['recovery_time'].timestamp(), entry['consecutive_failures'])
+        
+        if targets:
+            update_provider_availability(provider)
+        else:
+            delay = retry_after if retry_after is not None else circuit_breaker.backoff_delay(1, cap)
+            provider_status[provider]['available'] = False
+            provider_status[provider]['recovery_time'] = datetime.now() + timedelta(seconds=delay)
+    
+    label = f"{provider} key {kid}" if kid in entries else provider
+    source = 'as requested by the provider' if retry_after is not None else 'backoff'
     if is_rate_limit:
-        recovery_minutes = recovery_times.get(provider, 15)
-        provider_status[provider]['recovery_time'] = datetime.now() + timedelta(minutes=recovery_minutes)
-        print(f"⏰ {provider} rate limited, will recover in {recovery_minutes} minutes")
+        message = f"⏰ {label} rate limited, circuit open for {delay:.1f}s ({source})"
     else:
-        print(f"❌ {provider} failed with error")
+        message = f"❌ {label} failed with error, circuit open for {delay:.1f}s ({source})"
+    request_log.record(
+        'circuit_open', message, provider=provider, key=kid, delay=round(delay, 3),
+        from_header=retry_after is not None, error_class='rate_limit' if is_rate_limit else 'error'
+    )
+
+def is_rate_limit_error(status_code, error):
+    """Check if a failed provider response is a rate limit error"""
+    return (
+        status_code == 429 or
+        'rate limit' in error.lower() or
+        'quota' in error.lower()
+    )
 
-def get_available_provider():
-    """Get the next available provider based on priority"""
+def get_available_provider(exclude=(), policy=None, tokens=0, order=None):
+    """Get the next available provider using a routing policy.
+    
+    Providers whose rate-limit buckets can't take a call of about `tokens`
+    tokens are skipped. The default "priority" policy keeps the order of
+    the request's model route; see routing_policy.POLICIES for the others.
+    """
+    available = available_providers(exclude, tokens, order)
+    return routing_policy.choose(available, policy, provider_headroom())
+
+def available_providers(exclude=(), tokens=0, order=None):
+    """Providers, in priority order, that can take a call of about `tokens` tokens"""
     check_recovery()
     
-    # Priority order
-    priority = ['github_models', 'openrouter', 'google_gemini']
+    # Priority order (the default route's when no model route is given)
+    priority = order if order is not None else model_routes.providers('default', provider_status)
     
-    for provider in priority:
-        if provider_status[provider]['available']:
-            return provider
+    return [
+        provider for provider in priority
+        if provider not in exclude and provider_status[provider]['available']
+        and provider_has_capacity(provider, tokens)
+    ]
+
+admission_queue.configure(lambda tokens, providers: bool(available_providers(tokens=tokens, order=providers)))
+
+def eligible_providers(order, exclude):
+    """Providers of a request's route it may use at all (not unfit, off-route or too slow)"""
+    return [provider for provider in order if provider not in exclude]
+
+def queue_rejection(deadline, tokens, eligible):
+    """Why a request that no provider can take now can't wait for one, or None if it can"""
+    return admission_queue.rejection(deadline, retry_after_seconds(tokens, eligible))
+
+def provider_headroom():
+    """Remaining rate-limit headroom (0-1) of every provider's best key"""
+    headroom = {}
+    for provider, status in provider_status.items():
+        buckets = [key_bucket(provider, kid) for kid in status['keys']] or [provider]
+        headroom[provider] = max(rate_limiter.headroom(bucket) for bucket in buckets)
+    return headroom
+
+def request_size(prompt, system_prompt, max_tokens, model_type='default'):
+    """Estimated token cost of a request, its route and the providers it doesn't fit: (tokens, order, unfit).
     
-    return None
+    tokens (prompt plus max_tokens) is charged against the rate-limit
+    buckets before the call is sent and corrected once usage is known.
+    order is the model_type's provider order; providers off the route count as unfit.
+    """
+    prompt_tokens = model_capabilities.input_tokens(prompt, system_prompt)
+    order = model_routes.providers(model_type, provider_status)
+    overrides = {provider: model_routes.limits(model_type, provider) for provider in order}
+    unfit = tuple(provider for provider in provider_status if provider not in order)
+    unfit += model_capabilities.unfit_providers(order, prompt_tokens, max_tokens, overrides)
+    return prompt_tokens + max_tokens, order, unfit
 
-def call_github_models(env_vars, prompt, system_prompt, max_tokens, temperature):
-    """Call GitHub Models API"""
+def budget_exceeded(tenant, retry_after):
+    """Error body for a tenant that has spent its request or token budget"""
+    return {
+        'success': False,
+        'error': f'Budget of tenant {tenant} is spent',
+        'message': 'Please try again later',
+        'reason': 'tenant_budget',
+        'retry_after': retry_after
+    }
+
+def too_large(tokens):
+    """Error body for a request that no provider's model can take"""
+    return {
+        'success': False,
+        'error': 'Request is too large for every provider',
+        'estimated_tokens': tokens
+    }
+
+def start_provider_call(provider, tokens, kid=None, reserved=False):
+    """Count a call against a provider key and its rate-limit buckets (unless already reserved there)"""
+    with status_lock:
+        provider_status[provider]['requests'] += 1
+        key_last_used[(provider, kid)] = time.time()
+        entry = provider_status[provider]['keys'].get(kid)
+        if entry:
+            entry['requests'] += 1
+            if shared_state.enabled():
+                shared_state.add_request(provider, kid)
+    if reserved:
+        return
+    rate_limiter.acquire(key_bucket(provider, kid), tokens)
+    # Whatever capacity is left may fit the next queued request
+    admission_queue.notify()
+
+def retry_after_seconds(tokens=0, providers=None):
+    """Seconds until one of providers (None = any) should be able to take a request, or None if none ever will"""
+    now = datetime.now()
+    waits = []
+    for provider, status in provider_status.items():
+        if providers is not None and provider not in providers:
+            continue
+        if not status['available'] and status['recovery_time']:
+            waits.append(max((status['recovery_time'] - now).total_seconds(), 0))
+        elif status['available']:
+            buckets = [key_bucket(provider, kid) for kid, entry in status['keys'].items() if entry['available']]
+            waits.append(min(rate_limiter.wait_time(bucket, tokens) for bucket in buckets or [provider]))
+    return round(min(waits), 1) if waits else None
+
+def record_latency(provider, seconds):
+    """Record the latency of a successful provider call"""
+    with latency_lock:
+        provider_latency[provider].append(seconds)
+
+def latency_percentile(provider, percentile):
+    """Latency percentile for a provider, or None without enough samples"""
+    with latency_lock:
+        samples = sorted(provider_latency[provider])
+    if len(samples) < hedge_settings['min_samples']:
+        return None
+    index = min(len(samples) - 1, int(len(samples) * percentile))
+    return samples[index]
+
+def hedge_delay(provider):
+    """How long to wait on a provider before firing a hedged request"""
+    delay = latency_percentile(provider, hedge_settings['percentile'])
+    if delay is None:
+        delay = hedge_settings['default_delay']
+    return max(delay, hedge_settings['min_delay'])
+
+def latency_summary():
+    """Per-provider latency percentiles for /status"""
+    summary = {}
+    for provider in provider_latency:
+        p50 = latency_percentile(provider, 0.5)
+        p95 = latency_percentile(provider, 0.95)
+        summary[provider] = {
+            'samples': len(provider_latency[provider]),
+            'p50': round(p50, 3) if p50 is not None else None,
+            'p95': round(p95, 3) if p95 is not None else None
+        }
+    return summary
+
+def collect_state():
+    """Router state for a snapshot (see state_snapshot)"""
+    def timestamp(value):
+        return value.timestamp() if value else None
+    
+    with status_lock:
+        providers = {
+            provider: {
+                'available': status['available'],
+                'recovery_time': timestamp(status['recovery_time']),
+                'requests': status['requests'],
+                'failures': status['failures'],
+                'keys': {
+                    kid: dict(entry, recovery_time=timestamp(entry['recovery_time']))
+                    for kid, entry in status['keys'].items()
+                }
+            }
+            for provider, status in provider_status.items()
+        }
+    with latency_lock:
+        latency = {provider: list(samples) for provider, samples in provider_latency.items()}
+    return {
+        'providers': providers,
+        'rate_limits': rate_limiter.export_buckets(),
+        'latency': latency,
+        'routing': routing_policy.export_stats()
+    }
+
+def restore_state():
+    """Bring back the state of the last snapshot, so a restarted router knows which keys are still cooling down"""
+    state, age = state_snapshot.load()
+    if state is None:
+        return
+    load_env()  # registers the configured keys; keys that are gone are not restored
+    now = time.time()
+    cooling = 0
+    with status_lock:
+        for provider, saved in state['providers'].items():
+            status = provider_status.get(provider)
+            if status is None:
+                continue
+            status['requests'] = saved['requests']
+            status['failures'] = saved['failures']
+            for kid, saved_entry in saved['keys'].items():
+                entry = status['keys'].get(kid)
+                if entry is None:
+                    continue
+                entry['requests'] = saved_entry['requests']
+                entry['failures'] = saved_entry['failures']
+                entry['consecutive_failures'] = saved_entry['consecutive_failures']
+                if saved_entry['state'] == circuit_breaker.CLOSED:
+                    continue
+                # A probe that was in flight when the router stopped is sent again right away
+                recovery = saved_entry['recovery_time'] if saved_entry['state'] == circuit_breaker.OPEN else None
+                recovery = recovery or now
+                entry['state'] = circuit_breaker.OPEN
+                entry['available'] = False
+                entry['recovery_time'] = datetime.fromtimestamp(recovery)
+                if shared_state.enabled():
+                    shared_state.restore_open(provider, kid, recovery, entry['consecutive_failures'])
+                cooling += recovery > now
+            if status['keys']:
+                update_provider_availability(provider)
+            elif not saved['available'] and saved['recovery_time'] and saved['recovery_time'] > now:
+                status['available'] = False
+                status['recovery_time'] = datetime.fromtimestamp(saved['recovery_time'])
+    rate_limiter.restore_buckets(state['rate_limits'])
+    if age <= state_snapshot.snapshot_settings['stats_max_age']:
+        with latency_lock:
+            for provider, samples in state['latency'].items():
+                if provider in provider_latency:
+                    provider_latency[provider].extend(samples)
+        routing_policy.restore_stats(state['routing'])
+    print(f"♻️ Restored router state from {age:.0f}s ago ({cooling} keys still cooling down)")
+
+def build_github_models_request(env_vars, prompt, system_prompt, max_tokens, temperature):
+    """Build the GitHub Models API request"""
     headers = {
         "Authorization": f"Bearer {env_vars['GITHUB_TOKEN']}",
         "Content-Type": "application/json"
@@ -109,31 +638,28 @@ def call_github_models(env_vars, prompt, system_prompt, max_tokens, temperature)
     
     data = {
         "messages": messages,
-        "model": "gpt-4o",
+        "model": request_model(env_vars, 'github_models'),
         "max_tokens": max_tokens,
         "temperature": temperature
     }
     
-    response = requests.post(
-        "https://models.inference.ai.azure.com/chat/completions",
-        headers=headers,
-        json=data,
-        timeout=30
-    )
-    
-    if response.status_code == 200:
-        result = response.json()
-        return {
-            'success': True,
-            'response': result['choices'][0]['message']['content'],
-            'model': result.get('model', 'gpt-4o'),
-            'tokens_used': result.get('usage', {}).get('total_tokens', 0)
-        }
-    else:
-        return {'success': False, 'error': response.text, 'status_code': response.status_code}
+    return {
+        'url': f"{provider_pool.PROVIDER_BASE_URLS['github_models']}/chat/completions",
+        'headers': headers,
+        'json': data
+    }
 
-def call_openrouter(env_vars, prompt, system_prompt, max_tokens, temperature):
-    """Call OpenRouter API"""
+def parse_github_models_response(result):
+    """Parse a GitHub Models API response"""
+    return {
+        'success': True,
+        'response': result['choices'][0]['message']['content'],
+        'model': result.get('model', 'gpt-4o'),
+        'tokens_used': result.get('usage', {}).get('total_tokens', 0)
+    }
+
+def build_openrouter_request(env_vars, prompt, system_prompt, max_tokens, temperature):
+    """Build the OpenRouter API request"""
     headers = {
         "Authorization": f"Bearer {env_vars['OPENROUTER_API_KEY']}",
         "HTTP-Referer": "https://n8n-ai-router.local",
@@ -147,32 +673,29 @@ def call_openrouter(env_vars, prompt, system_prompt, max_tokens, temperature):
     messages.append({"role": "user", "content": prompt})
     
     data = {
-        "model": "meta-llama/llama-3.1-8b-instruct:free",
+        "model": request_model(env_vars, 'openrouter'),
         "messages": messages,
         "max_tokens": max_tokens,
         "temperature": temperature
     }
     
-    response = requests.post(
-        "https://openrouter.ai/api/v1/chat/completions",
-        headers=headers,
-        json=data,
-        timeout=30
-    )
-    
-    if response.status_code == 200:
-        result = response.json()
-        return {
-            'success': True,
-            'response': result['choices'][0]['message']['content'],
-            'model': result.get('model', 'llama-3.1-8b'),
-            'tokens_used': result.get('usage', {}).get('total_tokens', 0)
-        }
-    else:
-        return {'success': False, 'error': response.text, 'status_code': response.status_code}
+    return {
+        'url': f"{provider_pool.PROVIDER_BASE_URLS['openrouter']}/api/v1/chat/completions",
+        'headers': headers,
+        'json': data
+    }
 
-def call_google_gemini(env_vars, prompt, system_prompt, max_tokens, temperature):
-    """Call Google Gemini API"""
+def parse_openrouter_response(result):
+    """Parse an OpenRouter API response"""
+    return {
+        'success': True,
+        'response': result['choices'][0]['message']['content'],
+        'model': result.get('model', 'llama-3.1-8b'),
+        'tokens_used': result.get('usage', {}).get('total_tokens', 0)
+    }
+
+def build_google_gemini_request(env_vars, prompt, system_prompt, max_tokens, temperature):
+    """Build the Google Gemini API request"""
     full_prompt = prompt
     if system_prompt:
         full_prompt = f"{system_prompt}\n\n{prompt}"
@@ -185,31 +708,175 @@ def call_google_gemini(env_vars, prompt, system_prompt, max_tokens, temperature)
         }
     }
     
-    response = requests.post(
-        f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={env_vars['GOOGLE_API_KEY']}",
-        json=data,
-        timeout=30
-    )
-    
+    return {
+        'url': f"{provider_pool.PROVIDER_BASE_URLS['google_gemini']}/v1beta/models/{request_model(env_vars, 'google_gemini')}:generateContent?key={env_vars['GOOGLE_API_KEY']}",
+        'headers': {},
+        'json': data
+    }
+
+def parse_google_gemini_response(result):
+    """Parse a Google Gemini API response"""
+    return {
+        'success': True,
+        'response': result['candidates'][0]['content']['parts'][0]['text'],
+        'model': result.get('modelVersion', 'gemini-1.5-flash'),
+        'tokens_used': result.get('usageMetadata', {}).get('totalTokenCount', 0)
+    }
+
+def stream_openai_request(upstream):
+    """Turn an OpenAI-style chat request into a streaming one"""
+    data = dict(upstream['json'], stream=True, stream_options={'include_usage': True})
+    return dict(upstream, json=data)
+
+def stream_google_gemini_request(upstream):
+    """Turn a Gemini generateContent request into a streamGenerateContent one"""
+    url = upstream['url'].replace(':generateContent?', ':streamGenerateContent?alt=sse&')
+    return dict(upstream, url=url)
+
+def parse_openai_chunk(chunk):
+    """Extract (text, tokens_used, model) from an OpenAI-style stream chunk"""
+    choices = chunk.get('choices') or []
+    text = (choices[0].get('delta') or {}).get('content') or '' if choices else ''
+    tokens_used = (chunk.get('usage') or {}).get('total_tokens')
+    return text, tokens_used, chunk.get('model')
+
+def parse_google_gemini_chunk(chunk):
+    """Extract (text, tokens_used, model) from a Gemini stream chunk"""
+    text = ''
+    candidates = chunk.get('candidates') or []
+    if candidates:
+        parts = (candidates[0].get('content') or {}).get('parts') or []
+        text = ''.join(part.get('text', '') for part in parts)
+    tokens_used = (chunk.get('usageMetadata') or {}).get('totalTokenCount')
+    return text, tokens_used, chunk.get('modelVersion', 'gemini-1.5-flash')
+
+# Request builders and response parsers for each provider
+provider_apis = {
+    'github_models': {
+        'build': build_github_models_request,
+        'parse': parse_github_models_response,
+        'stream': stream_openai_request,
+        'parse_chunk': parse_openai_chunk
+    },
+    'openrouter': {
+        'build': build_openrouter_request,
+        'parse': parse_openrouter_response,
+        'stream': stream_openai_request,
+        'parse_chunk': parse_openai_chunk
+    },
+    'google_gemini': {
+        'build': build_google_gemini_request,
+        'parse': parse_google_gemini_response,
+        'stream': stream_google_gemini_request,
+        'parse_chunk': parse_google_gemini_chunk
+    }
+}
+
+def provider_result(provider, response):
+    """Turn an upstream HTTP response into a provider result"""
     if response.status_code == 200:
-        result = response.json()
+        parse = provider_apis[provider]['parse']
+        parse_started = time.perf_counter()
+        result = parse(response.json())
+        stage('json_parse', time.perf_counter() - parse_started)
+        return result
+    else:
         return {
-            'success': True,
-            'response': result['candidates'][0]['content']['parts'][0]['text'],
-            'model': 'gemini-1.5-flash',
-            'tokens_used': result.get('usageMetadata', {}).get('totalTokenCount', 0)
+            'success': False,
+            'error': response.text,
+            'status_code': response.status_code,
+            'retry_after': circuit_breaker.retry_after_from_headers(response.headers)
         }
-    else:
-        return {'success': False, 'error': response.text, 'status_code': response.status_code}
 
-@app.route('/ai-request', methods=['POST'])
-def ai_request():
-    """Main AI request endpoint"""
-    start_time = time.time()
-    request_id = generate_request_id()
+def call_provider(provider, env_vars, prompt, system_prompt, max_tokens, temperature, timeout=None):
+    """Call a provider through its pooled session; timeout is a (connect, read) pair"""
+    build = provider_apis[provider]['build']
+    upstream = build(env_vars, prompt, system_prompt, max_tokens, temperature)
+    response = provider_pool.post(
+        provider,
+        upstream['url'],
+        headers=upstream['headers'],
+        json=upstream['json'],
+        timeout=timeout or deadlines.default_timeouts()
+    )
+    return provider_result(provider, response)
+
+async def call_provider_async(provider, env_vars, prompt, system_prompt, max_tokens, temperature, timeout=None):
+    """Call a provider through its pooled async client"""
+    build = provider_apis[provider]['build']
+    upstream = build(env_vars, prompt, system_prompt, max_tokens, temperature)
+    response = await provider_pool.async_post(
+        provider,
+        upstream['url'],
+        headers=upstream['headers'],
+        json=upstream['json'],
+        timeout=timeout or deadlines.default_timeouts()
+    )
+    return provider_result(provider, response)
+
+def call_github_models(env_vars, prompt, system_prompt, max_tokens, temperature):
+    """Call GitHub Models API"""
+    return call_provider('github_models', env_vars, prompt, system_prompt, max_tokens, temperature)
+
+def call_openrouter(env_vars, prompt, system_prompt, max_tokens, temperature):
+    """Call OpenRouter API"""
+    return call_provider('openrouter', env_vars, prompt, system_prompt, max_tokens, temperature)
+
+def call_google_gemini(env_vars, prompt, system_prompt, max_tokens, temperature):
+    """Call Google Gemini API"""
+    return call_provider('google_gemini', env_vars, prompt, system_prompt, max_tokens, temperature)
+
+def ai_request_flow(data, request_id, start_time, policy=None, tenant=None, timeout=None):
+    """Routing logic for one AI request, shared by the Flask and async servers.
+    
+    This is a generator that yields three kinds of steps:
+    - {'type': 'coalesce', 'key'}: expects back the (body, status_code) of an
+      identical in-flight request to share, or None to go upstream itself.
+    - {'type': 'wait', 'tokens', 'priority', 'deadline', 'tenant', 'weight'}:
+      wait in the admission queue; expects back 'granted' or 'expired'.
+    - {'type': 'call', 'provider', 'args', 'backup', 'hedge_delay', 'timeout'}:
+      expects back the list of (provider, result, latency) outcomes of the
+      calls that were made, in completion order. A result is the provider
+      result, the exception raised, or None for a hedged call that was
+      cancelled. timeout is the (connect, read) pair for each call.
+    It returns a (response_body, status_code) tuple. policy is the routing
+    policy to use when the request doesn't name one in "routing"; tenant is
+    the X-Tenant-ID header, if any (else the "tenant" field is used), and
+    timeout the X-Request-Timeout-Ms header (else "timeout_ms").
+    """
+    try:
+        check_request_body(data)
+        tenant = tenants.tenant_id(tenant, data)
+    except ValueError as e:
+        return {'success': False, 'error': str(e), 'request_id': request_id}, 400
     
+    charged = {}  # tokens charged against the tenant budget, once admitted
+    try:
+        body, status_code = yield from route_request(data, request_id, start_time, policy, tenant, timeout, charged)
+    except GeneratorExit:
+        # The client went away and the driver closed the flow
+        if 'tokens' in charged:
+            tenants.record(tenant, 'failed')
+        raise
+    if 'tokens' in charged:
+        outcome = 'succeeded' if status_code == 200 else 'failed'
+        tenants.record(tenant, outcome, charged['tokens'], body.get('tokens_used') if status_code == 200 else 0)
+    elif body.get('provider') == 'cache':
+        tenants.count_cached(tenant)
+    return body, status_code
+
+def check_request_body(data):
+    """Raise ValueError unless the body is a JSON object whose text fields are strings"""
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    for field in ('prompt', 'system_prompt', 'model_type'):
+        if data.get(field) is not None and not isinstance(data[field], str):
+            raise ValueError(f'{field} must be a string')
+
+def route_request(data, request_id, start_time, policy, tenant, timeout, charged):
+    """Body of ai_request_flow for a request of a known tenant"""
     try:
-        data = request.get_json()
+        stage_started = time.perf_counter()
         
         # Extract parameters
         prompt = data.get('prompt', '')
@@ -217,108 +884,1267 @@ def ai_request():
         max_tokens = min(data.get('max_tokens', 1000), 4000)
         temperature = max(0, min(data.get('temperature', 0.7), 1))
         system_prompt = data.get('system_prompt', '')
+        hedge = bool(data.get('hedge', hedge_settings['enabled']))
+        cache_mode = data.get('cache', 'default')
+        policy = data.get('routing', policy)
         
         if not prompt:
-            return jsonify({
+            return {
                 'success': False,
                 'error': 'Prompt is required',
                 'request_id': request_id
-            }), 400
+            }, 400
+        
+        if policy is not None and policy not in routing_policy.POLICIES:
+            return {
+                'success': False,
+                'error': f"routing must be one of: {', '.join(routing_policy.POLICIES)}",
+                'request_id': request_id
+            }, 400
+        
+        if cache_mode not in response_cache.CACHE_MODES:
+            return {
+                'success': False,
+                'error': f"cache must be one of: {', '.join(response_cache.CACHE_MODES)}",
+                'request_id': request_id
+            }, 400
+        
+        try:
+            request_deadline = deadlines.request_deadline(timeout, data, start_time)
+            priority, deadline = admission_params(data, start_time, request_deadline, timeout)
+            threshold = fuzzy_threshold(data)
+        except ValueError as e:
+            return {'success': False, 'error': str(e), 'request_id': request_id}, 400
+        stage('validation', time.perf_counter() - stage_started)
+        
+        # Serve repeated requests from the response cache
+        request_key = response_cache.cache_key(prompt, system_prompt, model_type, max_tokens, temperature)
+        use_cache = response_cache.cache_settings['enabled'] and cache_mode != 'bypass'
+        if use_cache:
+            cached = response_cache.get(request_key)
+            if cached:
+                return {
+                    'success': True,
+                    'response': cached['response'],
+                    'provider': 'cache',
+                    'model': cached['model'],
+                    'tokens_used': cached['tokens_used'],
+                    'processing_time': round(time.time() - start_time, 6),
+                    'request_id': request_id
+                }, 200
+        
+        # Then from the answer to a near-duplicate prompt
+        fuzzy_scope = response_cache.cache_key('', system_prompt, model_type, max_tokens, temperature)
+        use_fuzzy = threshold is not None and cache_mode != 'bypass'
+        unverified = None
+        if use_fuzzy:
+            stage_started = time.perf_counter()
+            similar, similarity = fuzzy_cache.lookup(prompt, fuzzy_scope, threshold)
+            stage('fuzzy_cache', time.perf_counter() - stage_started)
+            if similar:
+                unverified = {
+                    'success': True,
+                    'response': similar['response'],
+                    'provider': 'cache',
+                    'cache_match': 'fuzzy',
+                    'similarity': round(similarity, 3),
+                    'model': similar['model'],
+                    'tokens_used': similar['tokens_used'],
+                    'processing_time': round(time.time() - start_time, 6),
+                    'request_id': request_id
+                }
+                # A sample still goes upstream to measure the false-positive rate
+                if cache_mode == 'only' or not fuzzy_cache.should_verify():
+                    return unverified, 200
+        
+        if cache_mode == 'only':
+            return {
+                'success': False,
+                'error': 'Response not in cache',
+                'request_id': request_id
+            }, 404
+        
+        tokens, order, unfit = request_size(prompt, system_prompt, max_tokens, model_type)
+        if len(unfit) == len(provider_status):
+            return dict(too_large(tokens), request_id=request_id), 413
+        
+        # Charge the tenant's budget before any provider quota is used (or an
+        # in-flight answer is shared, so every tenant pays for its own requests)
+        retry_after = tenants.admit(tenant, tokens)
+        if retry_after is not None:
+            return dict(budget_exceeded(tenant, retry_after), request_id=request_id), 429
+        charged['tokens'] = tokens
+        
+        # Attach to an identical request that is already in flight
+        if coalesce_settings['enabled']:
+            shared = yield {'type': 'coalesce', 'key': request_key}
+            if shared is not None:
+                body, status_code = shared
+                body = dict(body, request_id=request_id, coalesced=True)
+                if 'processing_time' in body:
+                    body['processing_time'] = round(time.time() - start_time, 2)
+                return body, status_code
         
         # Load environment variables
+        stage_started = time.perf_counter()
         env_vars = load_env()
+        stage('load_env', time.perf_counter() - stage_started)
         if not env_vars:
-            return jsonify({
+            return {
                 'success': False,
                 'error': 'Failed to load environment variables',
                 'request_id': request_id
-            }), 500
+            }, 500
         
         # Try providers in order
+        previous = None
+        timed_out = False
+        skipped = set()  # slow providers already counted for this request
         for attempt in range(3):  # Maximum 3 attempts
-            provider = get_available_provider()
+            # Skip attempts, and providers, that can't answer before the deadline
+            slow = slow_providers(order, unfit, request_deadline, skipped)
+            if deadlines.remaining(request_deadline) <= 0 or len(unfit) + len(slow) == len(provider_status):
+                timed_out = True
+                break
             
-            if not provider:
-                return jsonify({
-                    'success': False,
-                    'error': 'All providers are rate limited',
-                    'message': 'Please try again later',
-                    'request_id': request_id
-                }), 503
+            # Requests already waiting in the admission queue go first
+            provider = None
+            if attempt > 0 or not admission_queue.waiting():
+                provider = get_available_provider(exclude=unfit + slow, policy=policy, tokens=tokens, order=order)
             
-            print(f"🔄 Attempt {attempt + 1}: Using {provider}")
-            provider_status[provider]['requests'] += 1
+            eligible = eligible_providers(order, unfit + slow)
+            while not provider:
+                reason = queue_rejection(deadline, tokens, eligible)
+                if reason is None:
+                    outcome = yield {
+                        'type': 'wait', 'tokens': tokens, 'priority': priority, 'deadline': deadline,
+                        'tenant': tenant, 'weight': tenants.weight(tenant), 'providers': eligible
+                    }
+                    if outcome == 'granted':
+                        provider = get_available_provider(exclude=unfit + slow, policy=policy, tokens=tokens, order=order)
+                        continue
+                    reason = 'deadline'
+                else:
+                    admission_queue.reject(reason)
+                return dict(admission_rejected(reason, tokens, eligible), request_id=request_id), 503
             
-            try:
-                # Call the selected provider
-                if provider == 'github_models':
-                    result = call_github_models(env_vars, prompt, system_prompt, max_tokens, temperature)
-                elif provider == 'openrouter':
-                    result = call_openrouter(env_vars, prompt, system_prompt, max_tokens, temperature)
-                elif provider == 'google_gemini':
-                    result = call_google_gemini(env_vars, prompt, system_prompt, max_tokens, temperature)
+            timeouts = deadlines.attempt_timeouts(
+                request_deadline, 3 - attempt, routing_policy.typical_latency(provider), first=attempt == 0
+            )
+            if timeouts is None:
+                timed_out = True
+                break
+            
+            count_retry(attempt, provider, previous)
+            previous = provider
+            
+            call = {
+                'type': 'call',
+                'provider': provider,
+                'backup': None,
+                'hedge_delay': None,
+                'timeout': timeouts
+            }
+            # Each provider in the plan uses one key from its pool
+            keys = {provider: choose_key(provider, env_vars, tokens)}
+            if hedge:
+                backup = get_available_provider(exclude=(provider,) + unfit + slow, policy=policy, tokens=tokens, order=order)
+                backup_key = choose_key(backup, env_vars, tokens) if backup else (None, None)
+                # The backup's slot is reserved before it may be sent, so a hedge
+                # never makes calls the rate limiter can't see; no room, no hedge
+                if backup_key[0] is not None:
+                    rate_limiter.acquire(key_bucket(backup, backup_key[0]), tokens)
+                    keys[backup] = backup_key
+                    call['backup'] = backup
+                    call['hedge_delay'] = hedge_delay(provider)
+            call['args'] = (env_with_keys(env_vars, keys, model_type), prompt, system_prompt, max_tokens, temperature)
+            
+            start_provider_call(provider, tokens, keys[provider][0])
+            
+            # Call the selected provider (and the backup, if hedged)
+            outcomes = yield call
+            
+            if len(outcomes) > 1:
+                hedge_stats['hedged_requests'] += 1
+                # Hedged calls that lost the race were cancelled (result None)
+                hedge_stats['wasted_calls'] += sum(1 for outcome in outcomes if outcome[1] is None)
+                start_provider_call(call['backup'], tokens, keys[call['backup']][0], reserved=True)
+                request_log.record(
+                    'hedge', f"🏁 Hedged {provider} with {call['backup']} after {call['hedge_delay']:.2f}s",
+                    request_id=request_id, provider=provider, backup=call['backup'], delay=round(call['hedge_delay'], 3)
+                )
+            elif call['backup']:
+                # The primary answered before the hedge fired
+                rate_limiter.release(key_bucket(call['backup'], keys[call['backup']][0]), tokens)
+                admission_queue.notify()
+            
+            for called, result, latency in outcomes:
+                if result is None:
+                    continue
+                
+                record_call_metrics(called, result, latency)
+                routing_policy.record_outcome(called, latency, is_success((called, result, latency)))
+                log_attempt(request_id, attempt, called, keys[called][0], result, latency, tokens)
+                
+                if isinstance(result, Exception):
+                    # A call cut short by the request deadline says little about the provider
+                    if not (provider_pool.is_timeout(result) and deadlines.shortened(timeouts)):
+                        mark_provider_failed(called, False, keys[called][0])
+                    continue
                 
                 if result['success']:
+                    record_latency(called, latency)
+                    rate_limiter.settle(key_bucket(called, keys[called][0]), tokens, result['tokens_used'])
+                    if len(outcomes) > 1:
+                        hedge_stats['hedge_wins' if called != provider else 'primary_wins'] += 1
+                    if use_cache:
+                        response_cache.put(request_key, {
+                            'response': result['response'],
+                            'model': result['model'],
+                            'tokens_used': result['tokens_used'],
+                            'provider': called
+                        })
+                    if use_fuzzy:
+                        fuzzy_cache.put(prompt, fuzzy_scope, {
+                            'response': result['response'],
+                            'model': result['model'],
+                            'tokens_used': result['tokens_used']
+                        })
+                        if unverified:
+                            fuzzy_cache.record_verification(unverified['response'], result['response'])
                     processing_time = time.time() - start_time
-                    return jsonify({
+                    return {
                         'success': True,
                         'response': result['response'],
-                        'provider': provider,
+                        'provider': called,
                         'model': result['model'],
                         'tokens_used': result['tokens_used'],
                         'processing_time': round(processing_time, 2),
                         'request_id': request_id
-                    })
+                    }, 200
                 else:
                     # Check if it's a rate limit error
-                    is_rate_limit = (
-                        result['status_code'] == 429 or
-                        'rate limit' in result['error'].lower() or
-                        'quota' in result['error'].lower()
-                    )
-                    
-                    mark_provider_failed(provider, is_rate_limit)
-                    print(f"❌ {provider} failed: {result['error']}")
+                    is_rate_limit = is_rate_limit_error(result['status_code'], result['error'])
                     
-            except Exception as e:
-                mark_provider_failed(provider, False)
-                print(f"❌ {provider} exception: {str(e)}")
-                continue
+                    mark_provider_failed(called, is_rate_limit, keys[called][0], result.get('retry_after'))
         
-        # All providers failed
-        return jsonify({
+        # All providers failed, or the deadline left no time for another attempt
+        if unverified:
+            return unverified, 200
+        if timed_out:
+            deadlines.expired()
+            return dict(deadlines.deadline_exceeded(), request_id=request_id), 504
+        return {
             'success': False,
             'error': 'All providers failed',
             'message': 'Please try again later',
             'request_id': request_id
-        }), 503
+        }, 503
         
     except Exception as e:
-        return jsonify({
+        return {
             'success': False,
             'error': str(e),
             'request_id': request_id
-        }), 500
+        }, 500
+
+def admission_params(data, start_time, request_deadline, timeout=None):
+    """Priority and admission-queue deadline of a request; raises ValueError when invalid.
+    
+    A request that set its own timeout may wait in the queue for all of it;
+    one that didn't waits at most the queue's max_wait.
+    """
+    priority = data.get('priority', 0)
+    if isinstance(priority, bool) or not isinstance(priority, (int, float)):
+        raise ValueError('priority must be a number')
+    if timeout is None and deadlines.timeout_field(data) is None:
+        return priority, min(start_time + admission_queue.queue_settings['max_wait'], request_deadline)
+    return priority, request_deadline
+
+def fuzzy_threshold(data):
+    """Similarity a near-duplicate prompt needs to be served from the fuzzy cache, or None when off"""
+    threshold = data.get('fuzzy_threshold')
+    if threshold is None:
+        return fuzzy_cache.fuzzy_settings['threshold'] if fuzzy_cache.fuzzy_settings['enabled'] else None
+    if isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or not 0 < threshold <= 1:
+        raise ValueError('fuzzy_threshold must be a number between 0 and 1')
+    return threshold
+
+def slow_providers(order, unfit, request_deadline, skipped=None):
+    """Providers of a route whose typical latency is longer than the time left (skipped: see deadlines.too_slow)"""
+    latencies = {provider: routing_policy.typical_latency(provider) for provider in order if provider not in unfit}
+    return deadlines.too_slow(latencies, request_deadline, counted=skipped)
+
+def admission_rejected(reason, tokens, eligible=None):
+    """Error body for a request none of its eligible providers could take in time"""
+    return {
+        'success': False,
+        'error': 'No provider can take this request' if reason == 'no_provider' else 'All providers are rate limited',
+        'message': 'Please try again later',
+        'reason': reason,
+        'retry_after': retry_after_seconds(tokens, eligible)
+    }
+
+def call_outcome(result):
+    """Outcome label of a finished provider call for metrics"""
+    if isinstance(result, Exception):
+        return 'exception'
+    if result['success']:
+        return 'success'
+    return 'rate_limited' if is_rate_limit_error(result['status_code'], result['error']) else 'error'
+
+def record_call_metrics(provider, result, latency):
+    """Record one finished provider call in the latency histograms"""
+    metrics.observe(
+        'ai_router_provider_call_duration_seconds', latency,
+        (('provider', provider), ('outcome', call_outcome(result)))
+    )
+    metrics.stage('provider_call', latency)
+
+def error_class(result):
+    """Short class of a failed call for the request log (None on success)"""
+    if isinstance(result, Exception):
+        return type(result).__name__
+    if result['success']:
+        return None
+    if is_rate_limit_error(result['status_code'], result['error']):
+        return 'rate_limit'
+    return f"http_{result['status_code']}" if result['status_code'] else 'error'
+
+def log_attempt(request_id, attempt, provider, kid, result, latency, tokens):
+    """Record one finished provider call in the request log"""
+    failure = error_class(result)
+    request_timing.add(f'attempt{attempt + 1}-{provider}', latency, failure or 'ok')
+    message = None
+    if failure:
+        error = result if isinstance(result, Exception) else result['error']
+        message = f"❌ {provider} attempt {attempt + 1} failed ({failure}): {str(error)[:200]}"
+    request_log.record(
+        'attempt', message,
+        request_id=request_id,
+        provider=provider,
+        key=kid,
+        attempt=attempt + 1,
+        latency=round(latency, 6),
+        tokens=tokens if failure else result.get('tokens_used'),
+        error_class=failure,
+        status_code=None if isinstance(result, Exception) else result.get('status_code', 200)
+    )
+
+def log_request(body, status_code, latency):
+    """Record the outcome of a whole request in the request log"""
+    request_log.record(
+        'request', None,
+        request_id=body.get('request_id'),
+        provider=body.get('provider'),
+        status_code=status_code,
+        latency=round(latency, 6),
+        tokens=body.get('tokens_used'),
+        error_class=None if body.get('success') else body.get('reason') or f"http_{status_code}"
+    )
+
+def count_retry(attempt, provider, previous):
+    """Count retries, and failovers when a retry moves to another provider"""
+    if attempt == 0:
+        return
+    metrics.inc('ai_router_retries_total')
+    if provider != previous:
+        metrics.inc('ai_router_failovers_total', (('from', previous), ('to', provider)))
+
+def stage(name, seconds):
+    """Record the time spent in one request stage, in the metrics and in the request's timings"""
+    metrics.stage(name, seconds)
+    request_timing.add(name, seconds)
+
+def request_started(endpoint):
+    metrics.inc('ai_router_in_flight_requests', (('endpoint', endpoint),))
+
+def request_finished(endpoint, status_code, start_time):
+    """Record a finished request in the request metrics"""
+    labels = (('endpoint', endpoint),)
+    metrics.inc('ai_router_in_flight_requests', labels, -1)
+    metrics.inc('ai_router_requests_total', (('endpoint', endpoint), ('status', str(status_code))))
+    metrics.observe('ai_router_request_duration_seconds', time.time() - start_time, labels)
+
+def request_cancelled(endpoint, request_id, start_time):
+    """Count a request abandoned because its client disconnected"""
+    deadlines.cancelled()
+    metrics.inc('ai_router_cancelled_requests_total', (('endpoint', endpoint),))
+    request_log.record(
+        'cancelled', f"🔌 Client disconnected, cancelled {endpoint} request {request_id}",
+        request_id=request_id, endpoint=endpoint, latency=round(time.time() - start_time, 6)
+    )
+
+def timed_call(provider, call_args, timeout=None):
+    """Call a provider, returning (provider, result or exception, latency)"""
+    started = time.time()
+    routing_policy.track_outstanding(provider, 1)
+    metrics.inc('ai_router_provider_calls_in_flight', (('provider', provider),))
+    try:
+        result = call_provider(provider, *call_args, timeout=timeout)
+    except Exception as e:
+        result = e
+    finally:
+        routing_policy.track_outstanding(provider, -1)
+        metrics.inc('ai_router_provider_calls_in_flight', (('provider', provider),), -1)
+    return provider, result, time.time() - started
+
+async def timed_call_async(provider, call_args, timeout=None):
+    """Async variant of timed_call"""
+    started = time.time()
+    routing_policy.track_outstanding(provider, 1)
+    metrics.inc('ai_router_provider_calls_in_flight', (('provider', provider),))
+    try:
+        result = await call_provider_async(provider, *call_args, timeout=timeout)
+    except Exception as e:
+        result = e
+    finally:
+        routing_policy.track_outstanding(provider, -1)
+        metrics.inc('ai_router_provider_calls_in_flight', (('provider', provider),), -1)
+    return provider, result, time.time() - started
+
+def is_success(outcome):
+    """True when a call outcome carries a successful result"""
+    result = outcome[1]
+    return isinstance(result, dict) and result.get('success')
+
+def execute_call(call):
+    """Run one upstream call plan with blocking calls (hedging via threads)"""
+    timeout = call.get('timeout')
+    if not call['backup']:
+        return [timed_call(call['provider'], call['args'], timeout)]
+    
+    # Copies of the request's context let the calls add to its timings
+    primary = hedge_executor.submit(contextvars.copy_context().run, timed_call, call['provider'], call['args'], timeout)
+    done, _ = wait([primary], timeout=call['hedge_delay'])
+    if done:
+        return [primary.result()]
+    
+    backup = hedge_executor.submit(contextvars.copy_context().run, timed_call, call['backup'], call['args'], timeout)
+    futures = {primary: call['provider'], backup: call['backup']}
+    pending = set(futures)
+    outcomes = []
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            outcomes.append(future.result())
+        if any(is_success(outcome) for outcome in outcomes):
+            # A blocking call can't be interrupted; the loser finishes in the
+            # background and its result is discarded
+            for future in pending:
+                future.cancel()
+                outcomes.append((futures[future], None, None))
+            break
+    return outcomes
+
+async def execute_call_async(call):
+    """Run one upstream call plan with non-blocking calls (hedging via tasks)"""
+    timeout = call.get('timeout')
+    if not call['backup']:
+        return [await timed_call_async(call['provider'], call['args'], timeout)]
+    
+    primary = asyncio.ensure_future(timed_call_async(call['provider'], call['args'], timeout))
+    tasks = {primary: call['provider']}
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=call['hedge_delay'])
+        if done:
+            return [primary.result()]
+        
+        backup = asyncio.ensure_future(timed_call_async(call['backup'], call['args'], timeout))
+        tasks[backup] = call['backup']
+        pending = set(tasks)
+        outcomes = []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                outcomes.append(task.result())
+            if any(is_success(outcome) for outcome in outcomes):
+                for task in pending:
+                    task.cancel()
+                    outcomes.append((tasks[task], None, None))
+                break
+        return outcomes
+    finally:
+        # When the request itself is cancelled (client gone), so are its calls
+        for task in tasks:
+            task.cancel()
+
+def join_inflight(key, make_done):
+    """Lead or follow the in-flight request for key.
+    
+    Returns (entry, is_leader); followers wait on entry['done'].
+    """
+    with inflight_lock:
+        entry = inflight_requests.get(key)
+        if entry is None:
+            entry = {'done': make_done(), 'result': None}
+            inflight_requests[key] = entry
+            coalesce_stats['leaders'] += 1
+            return entry, True
+        coalesce_stats['followers'] += 1
+        return entry, False
+
+def leave_inflight(key, entry, result):
+    """Publish the leader's result and stop accepting followers"""
+    with inflight_lock:
+        if inflight_requests.get(key) is entry:
+            del inflight_requests[key]
+    entry['result'] = result
+
+def run_flow(flow):
+    """Drive an ai_request_flow with blocking provider calls"""
+    leading = None
+    result = None
+    started = time.perf_counter()
+    waited = 0.0  # time spent waiting on providers (or on a coalesced leader)
+    try:
+        step = next(flow)
+        while True:
+            wait_started = time.perf_counter()
+            if step['type'] == 'coalesce':
+                entry, is_leader = join_inflight(step['key'], threading.Event)
+                if is_leader:
+                    leading = (step['key'], entry)
+                else:
+                    entry['done'].wait()
+                    request_timing.add('coalesce', time.perf_counter() - wait_started)
+                shared = None if is_leader else entry['result']
+                waited += time.perf_counter() - wait_started
+                step = flow.send(shared)
+            elif step['type'] == 'wait':
+                outcome = admission_queue.wait(step['tokens'], step['priority'], step['deadline'], step['tenant'], step['weight'], step['providers'])
+                request_timing.add('queue', time.perf_counter() - wait_started, outcome)
+                waited += time.perf_counter() - wait_started
+                step = flow.send(outcome)
+            else:
+                outcomes = execute_call(step)
+                waited += time.perf_counter() - wait_started
+                step = flow.send(outcomes)
+    except StopIteration as done:
+        result = done.value
+        log_request(result[0], result[1], time.perf_counter() - started)
+        return result
+    finally:
+        metrics.observe('ai_router_overhead_seconds', time.perf_counter() - started - waited)
+        if leading:
+            leave_inflight(leading[0], leading[1], result)
+            leading[1]['done'].set()
+
+async def run_flow_async(flow):
+    """Drive an ai_request_flow with non-blocking provider calls"""
+    leading = None
+    result = None
+    started = time.perf_counter()
+    waited = 0.0
+    try:
+        step = next(flow)
+        while True:
+            wait_started = time.perf_counter()
+            if step['type'] == 'coalesce':
+                entry, is_leader = join_inflight(step['key'], asyncio.Event)
+                if is_leader:
+                    leading = (step['key'], entry)
+                else:
+                    await entry['done'].wait()
+                    request_timing.add('coalesce', time.perf_counter() - wait_started)
+                shared = None if is_leader else entry['result']
+                waited += time.perf_counter() - wait_started
+                step = flow.send(shared)
+            elif step['type'] == 'wait':
+                outcome = await admission_queue.wait_async(
+                    step['tokens'], step['priority'], step['deadline'], step['tenant'], step['weight'], step['providers']
+                )
+                request_timing.add('queue', time.perf_counter() - wait_started, outcome)
+                waited += time.perf_counter() - wait_started
+                step = flow.send(outcome)
+            else:
+                outcomes = await execute_call_async(step)
+                waited += time.perf_counter() - wait_started
+                step = flow.send(outcomes)
+    except StopIteration as done:
+        result = done.value
+        log_request(result[0], result[1], time.perf_counter() - started)
+        return result
+    finally:
+        metrics.observe('ai_router_overhead_seconds', time.perf_counter() - started - waited)
+        if leading:
+            leave_inflight(leading[0], leading[1], result)
+            leading[1]['done'].set()
+
+def idempotency_scope(data, tenant, timeout, start_time):
+    """(tenant, deadline) an Idempotency-Key is scoped to; an invalid deadline is left for the flow to reject"""
+    try:
+        deadline = deadlines.request_deadline(timeout, data, start_time)
+    except ValueError:
+        deadline = None
+    return tenants.requested(tenant, data), deadline
+
+@app.route('/ai-request', methods=['POST'])
+def ai_request():
+    """Main AI request endpoint"""
+    start_time = time.time()
+    request_id = generate_request_id()
+    request_started('/ai-request')
+    timings, timing_token = request_timing.start()
+    try:
+        parse_started = time.perf_counter()
+        data = request.get_json(silent=True)
+        stage('request_parse', time.perf_counter() - parse_started)
+        
+        tenant = request.headers.get(tenants.TENANT_HEADER)
+        timeout = request.headers.get(deadlines.DEADLINE_HEADER)
+        run = lambda: run_flow(ai_request_flow(data, request_id, start_time, tenant=tenant, timeout=timeout))
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if idempotency_key is None:
+            body, status_code = run()
+            replayed = False
+        else:
+            # A retry with the same key attaches to the first call or replays its result
+            body, status_code, replayed = idempotency.call(
+                idempotency_key, data, request_id, run, *idempotency_scope(data, tenant, timeout, start_time)
+            )
+        if wants_debug(data):
+            body = dict(body, debug=request_timing.debug_block(timings))
+        
+        serialize_started = time.perf_counter()
+        response = jsonify(body)
+        stage('serialization', time.perf_counter() - serialize_started)
+        if replayed:
+            response.headers['Idempotent-Replayed'] = 'true'
+        if request_timing.timing_settings['server_timing']:
+            response.headers['Server-Timing'] = request_timing.header(timings)
+    finally:
+        request_timing.finish(timing_token)
+    request_finished('/ai-request', status_code, start_time)
+    return response, status_code
+
+def wants_debug(data):
+    """True if a request asked for the "debug" timing block"""
+    return isinstance(data, dict) and data.get('debug') is True
+
+# ---------------------------------------------------------------------------
+# Streaming (Server-Sent Events)
+# ---------------------------------------------------------------------------
+
+def sse_event(event, payload):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def stream_request_params(data, request_id, tenant=None, timeout=None):
+    """Validate a streaming request; returns (params, None) or (None, (body, status_code))"""
+    try:
+        check_request_body(data)
+        tenant = tenants.tenant_id(tenant, data)
+        params = {
+            'prompt': data.get('prompt', ''),
+            'model_type': data.get('model_type', 'chat'),
+            'max_tokens': min(data.get('max_tokens', 1000), 4000),
+            'temperature': max(0, min(data.get('temperature', 0.7), 1)),
+            'system_prompt': data.get('system_prompt', ''),
+            'cache': data.get('cache', 'default'),
+            'routing': data.get('routing'),
+            'tenant': tenant
+        }
+        params['request_deadline'] = deadlines.request_deadline(timeout, data, time.time())
+        params['priority'], params['deadline'] = admission_params(data, time.time(), params['request_deadline'], timeout)
+        params['skipped'] = set()  # slow providers already counted for this request
+    except Exception as e:
+        return None, ({'success': False, 'error': str(e), 'request_id': request_id}, 400)
+    
+    if not params['prompt']:
+        return None, ({'success': False, 'error': 'Prompt is required', 'request_id': request_id}, 400)
+    if params['cache'] not in response_cache.CACHE_MODES:
+        return None, ({
+            'success': False,
+            'error': f"cache must be one of: {', '.join(response_cache.CACHE_MODES)}",
+            'request_id': request_id
+        }, 400)
+    if params['routing'] is not None and params['routing'] not in routing_policy.POLICIES:
+        return None, ({
+            'success': False,
+            'error': f"routing must be one of: {', '.join(routing_policy.POLICIES)}",
+            'request_id': request_id
+        }, 400)
+    
+    # As on /ai-request, the cache is checked before the tenant is charged:
+    # a stream that never goes upstream doesn't touch the budget
+    cache_key = stream_cache_key(params)
+    params['cached'] = response_cache.get(cache_key) if cache_key else None
+    params['charged'] = False
+    if params['cached'] or params['cache'] == 'only':
+        return params, None
+    
+    params['tokens'], params['order'], params['unfit'] = request_size(
+        params['prompt'], params['system_prompt'], params['max_tokens'], params['model_type']
+    )
+    if len(params['unfit']) == len(provider_status):
+        return None, (dict(too_large(params['tokens']), request_id=request_id), 413)
+    retry_after = tenants.admit(tenant, params['tokens'])
+    if retry_after is not None:
+        return None, (dict(budget_exceeded(tenant, retry_after), request_id=request_id), 429)
+    params['charged'] = True
+    return params, None
+
+def stream_cache_key(params):
+    """Response cache key for a streaming request (None when not cached)"""
+    if not response_cache.cache_settings['enabled'] or params['cache'] == 'bypass':
+        return None
+    return response_cache.cache_key(
+        params['prompt'], params['system_prompt'], params['model_type'],
+        params['max_tokens'], params['temperature']
+    )
+
+def stream_upstream(provider, env_vars, params):
+    """Build the streaming upstream request for a provider"""
+    api = provider_apis[provider]
+    upstream = api['build'](
+        env_vars, params['prompt'], params['system_prompt'], params['max_tokens'], params['temperature']
+    )
+    return api['stream'](upstream)
+
+def read_stream_line(state, line):
+    """Parse one upstream SSE line into state; returns the new text, if any"""
+    line = line.strip()
+    if not line.startswith('data:'):
+        return ''
+    payload = line[5:].strip()
+    if not payload or payload == '[DONE]':
+        return ''
+    
+    text, tokens_used, model = provider_apis[state['provider']]['parse_chunk'](json.loads(payload))
+    if tokens_used is not None:
+        state['tokens_used'] = tokens_used
+    if model:
+        state['model'] = model
+    if text:
+        if state['first_token_at'] is None:
+            state['first_token_at'] = time.time()
+        state['text'].append(text)
+    return text
+
+def stream_done(state, request_id, start_time, cache_key):
+    """Finish a successful stream: record it and build the final event"""
+    record_latency(state['provider'], time.time() - state['started_at'])
+    record_call_metrics(state['provider'], {'success': True}, time.time() - state['started_at'])
+    routing_policy.record_outcome(state['provider'], time.time() - state['started_at'], True)
+    rate_limiter.settle(key_bucket(state['provider'], state['key']), state['estimated_tokens'], state['tokens_used'])
+    log_attempt(request_id, state['attempt'], state['provider'], state['key'], {
+        'success': True, 'tokens_used': state['tokens_used']
+    }, time.time() - state['started_at'], state['estimated_tokens'])
+    if cache_key:
+        response_cache.put(cache_key, {
+            'response': ''.join(state['text']),
+            'model': state['model'],
+            'tokens_used': state['tokens_used'],
+            'provider': state['provider']
+        })
+    return sse_event('done', {
+        'success': True,
+        'provider': state['provider'],
+        'model': state['model'],
+        'tokens_used': state['tokens_used'],
+        'time_to_first_token': round(state['first_token_at'] - start_time, 3),
+        'processing_time': round(time.time() - start_time, 2),
+        'request_id': request_id
+    })
+
+def stream_failed(state, status_code, error, blame=True, retry_after=None):
+    """Take a provider key out of rotation after a stream failed before its first token.
+    
+    blame is False for a call cut short by the request deadline; retry_after
+    is the delay the provider asked for in its response headers, if any.
+    """
+    provider = state['provider']
+    routing_policy.record_outcome(provider, None, False)
+    if status_code is None:
+        record_call_metrics(provider, Exception(error), time.time() - state['started_at'])
+    else:
+        record_call_metrics(provider, {'success': False, 'status_code': status_code, 'error': error}, time.time() - state['started_at'])
+    result = Exception(error) if status_code is None else {'success': False, 'status_code': status_code, 'error': error}
+    log_attempt(state['request_id'], state['attempt'], provider, state['key'], result, time.time() - state['started_at'], state['estimated_tokens'])
+    if not blame:
+        return
+    if status_code is None:
+        mark_provider_failed(provider, False, state['key'])
+    else:
+        mark_provider_failed(provider, is_rate_limit_error(status_code, error), state['key'], retry_after)
+
+def stream_start(params, request_id, start_time):
+    """Events to send before going upstream, and whether the stream is already complete"""
+    cached = params['cached']
+    if cached:
+        return [
+            sse_event('token', {'text': cached['response'], 'provider': 'cache'}),
+            sse_event('done', {
+                'success': True,
+                'provider': 'cache',
+                'model': cached['model'],
+                'tokens_used': cached['tokens_used'],
+                'time_to_first_token': round(time.time() - start_time, 6),
+                'processing_time': round(time.time() - start_time, 6),
+                'request_id': request_id
+            })
+        ], True
+    if params['cache'] == 'only':
+        return [sse_event('error', {'success': False, 'error': 'Response not in cache', 'request_id': request_id})], True
+    return [], False
+
+def stream_attempt_exclusions(params):
+    """Providers the next stream attempt must skip, or None when the deadline leaves no time for it"""
+    slow = slow_providers(params['order'], params['unfit'], params['request_deadline'], params['skipped'])
+    if deadlines.remaining(params['request_deadline']) <= 0:
+        return None
+    if len(params['unfit']) + len(slow) == len(provider_status):
+        return None
+    return params['unfit'] + slow
+
+def stream_exhausted(timed_out, request_id):
+    """Error event of a stream no provider answered, by failing or by running out of time"""
+    if timed_out:
+        deadlines.expired()
+        return sse_event('error', dict(deadlines.deadline_exceeded(), request_id=request_id))
+    return sse_event('error', {'success': False, 'error': 'All providers failed', 'request_id': request_id})
+
+def new_stream_state(provider, tokens, env_vars, request_id, attempt, model_type=None):
+    """Per-attempt streaming state"""
+    kid, key = choose_key(provider, env_vars, tokens)
+    start_provider_call(provider, tokens, kid)
+    return {
+        'request_id': request_id,
+        'attempt': attempt,
+        'provider': provider,
+        'key': kid,
+        'env': env_with_keys(env_vars, {provider: (kid, key)}, model_type),
+        'estimated_tokens': tokens,
+        'model': None,
+        'tokens_used': 0,
+        'text': [],
+        'started_at': time.time(),
+        'first_token_at': None
+    }
+
+def stream_ai_request(params, request_id, start_time):
+    """Relay a streamed completion as SSE, failing over until the first token"""
+    # How the request ended, for the tenant counters (also when the client goes away)
+    outcome = {'outcome': 'failed', 'tokens_used': 0}
+    try:
+        events, complete = stream_start(params, request_id, start_time)
+        yield from events
+        if complete:
+            if events[-1].startswith('event: done'):
+                outcome['outcome'] = 'cached'
+            return
+        
+        env_vars = load_env()
+        if not env_vars:
+            yield sse_event('error', {'success': False, 'error': 'Failed to load environment variables', 'request_id': request_id})
+            return
+        
+        tokens = params['tokens']
+        previous = None
+        timed_out = False
+        for attempt in range(3):  # Maximum 3 attempts
+            exclude = stream_attempt_exclusions(params)
+            if exclude is None:
+                timed_out = True
+                break
+            provider = None
+            if attempt > 0 or not admission_queue.waiting():
+                provider = get_available_provider(exclude=exclude, policy=params['routing'], tokens=tokens, order=params['order'])
+            eligible = eligible_providers(params['order'], exclude)
+            while not provider:
+                reason = queue_rejection(params['deadline'], tokens, eligible)
+                if reason is None:
+                    if admission_queue.wait(
+                        tokens, params['priority'], params['deadline'], params['tenant'], tenants.weight(params['tenant']), eligible
+                    ) == 'granted':
+                        provider = get_available_provider(exclude=exclude, policy=params['routing'], tokens=tokens, order=params['order'])
+                        continue
+                    reason = 'deadline'
+                else:
+                    admission_queue.reject(reason)
+                yield sse_event('error', dict(admission_rejected(reason, tokens, eligible), request_id=request_id))
+                return
+            
+            timeouts = deadlines.attempt_timeouts(
+                params['request_deadline'], 3 - attempt, routing_policy.typical_latency(provider), first=attempt == 0
+            )
+            if timeouts is None:
+                timed_out = True
+                break
+            count_retry(attempt, provider, previous)
+            previous = provider
+            state = new_stream_state(provider, tokens, env_vars, request_id, attempt, params['model_type'])
+            upstream = stream_upstream(provider, state['env'], params)
+            try:
+                with provider_pool.stream_post(
+                    provider, upstream['url'], headers=upstream['headers'], json=upstream['json'], timeout=timeouts
+                ) as (status_code, error_text, headers, lines):
+                    if status_code != 200:
+                        stream_failed(state, status_code, error_text, retry_after=circuit_breaker.retry_after_from_headers(headers))
+                        continue
+                    for line in lines:
+                        text = read_stream_line(state, line)
+                        if text:
+                            yield sse_event('token', {'text': text, 'provider': provider})
+            except Exception as e:
+                if state['first_token_at'] is None:
+                    stream_failed(state, None, str(e), not (provider_pool.is_timeout(e) and deadlines.shortened(timeouts)))
+                    continue
+                yield sse_event('error', {'success': False, 'error': str(e), 'provider': provider, 'request_id': request_id})
+                return
+            
+            if state['first_token_at'] is None:
+                stream_failed(state, None, 'stream ended without any tokens')
+                continue
+            outcome.update(outcome='succeeded', tokens_used=state['tokens_used'])
+            yield stream_done(state, request_id, start_time, stream_cache_key(params))
+            return
+        
+        yield stream_exhausted(timed_out, request_id)
+    finally:
+        if params['charged']:
+            tenants.record(params['tenant'], outcome['outcome'], params['tokens'], outcome['tokens_used'])
+        elif outcome['outcome'] == 'cached':
+            tenants.count_cached(params['tenant'])
+
+async def stream_ai_request_async(params, request_id, start_time):
+    """Async variant of stream_ai_request"""
+    # How the request ended, for the tenant counters (also when the client goes away)
+    outcome = {'outcome': 'failed', 'tokens_used': 0}
+    try:
+        events, complete = stream_start(params, request_id, start_time)
+        for event in events:
+            yield event
+        if complete:
+            if events[-1].startswith('event: done'):
+                outcome['outcome'] = 'cached'
+            return
+        
+        env_vars = load_env()
+        if not env_vars:
+            yield sse_event('error', {'success': False, 'error': 'Failed to load environment variables', 'request_id': request_id})
+            return
+        
+        tokens = params['tokens']
+        previous = None
+        timed_out = False
+        for attempt in range(3):  # Maximum 3 attempts
+            exclude = stream_attempt_exclusions(params)
+            if exclude is None:
+                timed_out = True
+                break
+            provider = None
+            if attempt > 0 or not admission_queue.waiting():
+                provider = get_available_provider(exclude=exclude, policy=params['routing'], tokens=tokens, order=params['order'])
+            eligible = eligible_providers(params['order'], exclude)
+            while not provider:
+                reason = queue_rejection(params['deadline'], tokens, eligible)
+                if reason is None:
+                    if await admission_queue.wait_async(
+                        tokens, params['priority'], params['deadline'], params['tenant'], tenants.weight(params['tenant']), eligible
+                    ) == 'granted':
+                        provider = get_available_provider(exclude=exclude, policy=params['routing'], tokens=tokens, order=params['order'])
+                        continue
+                    reason = 'deadline'
+                else:
+                    admission_queue.reject(reason)
+                yield sse_event('error', dict(admission_rejected(reason, tokens, eligible), request_id=request_id))
+                return
+            
+            timeouts = deadlines.attempt_timeouts(
+                params['request_deadline'], 3 - attempt, routing_policy.typical_latency(provider), first=attempt == 0
+            )
+            if timeouts is None:
+                timed_out = True
+                break
+            count_retry(attempt, provider, previous)
+            previous = provider
+            state = new_stream_state(provider, tokens, env_vars, request_id, attempt, params['model_type'])
+            upstream = stream_upstream(provider, state['env'], params)
+            try:
+                async with provider_pool.async_stream_post(
+                    provider, upstream['url'], headers=upstream['headers'], json=upstream['json'], timeout=timeouts
+                ) as (status_code, error_text, headers, lines):
+                    if status_code != 200:
+                        stream_failed(state, status_code, error_text, retry_after=circuit_breaker.retry_after_from_headers(headers))
+                        continue
+                    async for line in lines:
+                        text = read_stream_line(state, line)
+                        if text:
+                            yield sse_event('token', {'text': text, 'provider': provider})
+            except Exception as e:
+                if state['first_token_at'] is None:
+                    stream_failed(state, None, str(e), not (provider_pool.is_timeout(e) and deadlines.shortened(timeouts)))
+                    continue
+                yield sse_event('error', {'success': False, 'error': str(e), 'provider': provider, 'request_id': request_id})
+                return
+            
+            if state['first_token_at'] is None:
+                stream_failed(state, None, 'stream ended without any tokens')
+                continue
+            outcome.update(outcome='succeeded', tokens_used=state['tokens_used'])
+            yield stream_done(state, request_id, start_time, stream_cache_key(params))
+            return
+        
+        yield stream_exhausted(timed_out, request_id)
+    finally:
+        if params['charged']:
+            tenants.record(params['tenant'], outcome['outcome'], params['tokens'], outcome['tokens_used'])
+        elif outcome['outcome'] == 'cached':
+            tenants.count_cached(params['tenant'])
+
+def metered_stream(events, start_time, request_id=None):
+    """Count a streamed request in the request metrics once it ends.
+    
+    A client that disconnects closes the stream, which closes the upstream one.
+    """
+    request_started('/ai-request/stream')
+    try:
+        yield from events
+    except GeneratorExit:
+        request_cancelled('/ai-request/stream', request_id, start_time)
+        raise
+    finally:
+        request_finished('/ai-request/stream', 200, start_time)
+
+async def metered_stream_async(events, start_time, request_id=None):
+    """Async variant of metered_stream"""
+    request_started('/ai-request/stream')
+    try:
+        async for event in events:
+            yield event
+    except (GeneratorExit, asyncio.CancelledError):
+        request_cancelled('/ai-request/stream', request_id, start_time)
+        raise
+    finally:
+        await events.aclose()
+        request_finished('/ai-request/stream', 200, start_time)
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+@app.route('/ai-request/stream', methods=['POST'])
+def ai_request_stream():
+    """Streaming AI request endpoint (Server-Sent Events)"""
+    start_time = time.time()
+    request_id = generate_request_id()
+    
+    data = request.get_json(silent=True) or {}
+    params, error = stream_request_params(
+        data, request_id, request.headers.get(tenants.TENANT_HEADER), request.headers.get(deadlines.DEADLINE_HEADER)
+    )
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    events = metered_stream(stream_ai_request(params, request_id, start_time), start_time, request_id)
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+# ---------------------------------------------------------------------------
+# Batches (JSONL in, JSONL out)
+# ---------------------------------------------------------------------------
+
+def process_batch_record(record):
+    """Run one batch line through the router"""
+    return run_flow(ai_request_flow(record, generate_request_id(), time.time(), policy='least_outstanding'))
+
+async def process_batch_record_async(record):
+    """Async variant of process_batch_record"""
+    return await run_flow_async(ai_request_flow(record, generate_request_id(), time.time(), policy='least_outstanding'))
+
+def batch_output_path(batch_id):
+    """Server-side output file for a resumable batch (None if the id is invalid)"""
+    if not batch_id or not all(c.isalnum() or c in '-_' for c in batch_id):
+        return None
+    os.makedirs(batch_runner.batch_settings['batch_dir'], exist_ok=True)
+    return os.path.join(batch_runner.batch_settings['batch_dir'], f'{batch_id}.jsonl')
+
+def batch_concurrency(value):
+    """Clamp a requested batch concurrency"""
+    try:
+        concurrency = int(value) if value else batch_runner.batch_settings['concurrency']
+    except ValueError:
+        concurrency = batch_runner.batch_settings['concurrency']
+    return max(1, min(concurrency, batch_runner.batch_settings['max_concurrency']))
+
+def run_batch_file(lines, output_path, concurrency, retry_failed=False, process=process_batch_record):
+    """Run a batch into a checkpointed output file, yielding each new result"""
+    state = batch_runner.start_checkpoint(output_path, retry_failed)
+    try:
+        for line_number, result in batch_runner.run_batch(lines, process, concurrency, state['skip']):
+            batch_runner.checkpoint_result(state, line_number, result)
+            if result is not None:
+                yield result
+    finally:
+        summary = batch_runner.finish_checkpoint(state)
+        print(f"📦 Batch {output_path}: {summary['written']} written, {summary['failed']} failed")
+
+@app.route('/ai-batch', methods=['POST'])
+def ai_batch():
+    """Bulk endpoint: JSONL requests in, JSONL results out in completion order"""
+    concurrency = batch_concurrency(request.args.get('concurrency'))
+    batch_id = request.args.get('batch_id')
+    retry_failed = request.args.get('retry_failed') == '1'
+    
+    output_path = batch_output_path(batch_id) if batch_id else None
+    if batch_id and not output_path:
+        return jsonify({'success': False, 'error': 'batch_id may only contain letters, digits, - and _'}), 400
+    
+    # Read the body line by line instead of buffering it
+    lines = iter(request.stream.readline, b'')
+    if output_path:
+        results = run_batch_file(lines, output_path, concurrency, retry_failed)
+    else:
+        results = (
+            result for _, result in batch_runner.run_batch(lines, process_batch_record, concurrency)
+            if result is not None
+        )
+    
+    def generate():
+        for result in results:
+            yield json.dumps(result, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def run_batch_cli(args):
+    """Run a JSONL batch file from the command line"""
+    concurrency = max(1, args.concurrency or batch_runner.batch_settings['concurrency'])
+    output_path = args.output or f"{os.path.splitext(args.batch)[0]}.results.jsonl"
+    
+    print(f"📦 Batch {args.batch} -> {output_path} (concurrency {concurrency})")
+    input_file = sys.stdin if args.batch == '-' else open(args.batch)
+    started = time.time()
+    count = 0
+    try:
+        for result in run_batch_file(input_file, output_path, concurrency, args.retry_failed):
+            count += 1
+            if count % 100 == 0:
+                print(f"   {count} results, {count / (time.time() - started):.1f}/s")
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+    print(f"✅ Batch complete: {count} new results in {time.time() - started:.1f}s")
+
+def status_snapshot():
+    """Build the /status response body"""
+    check_recovery()
+    return {
+        'providers': provider_status,
+        'connection_pools': provider_pool.pool_stats(),
+        'hedging': dict(hedge_stats, enabled=hedge_settings['enabled'], percentile=hedge_settings['percentile']),
+        'latency': latency_summary(),
+        'cache': response_cache.cache_stats(),
+        'fuzzy_cache': fuzzy_cache.fuzzy_stats(),
+        'routing': routing_policy.routing_stats(provider_headroom()),
+        'rate_limits': rate_limiter.bucket_levels(),
+        'models': model_capabilities.capabilities,
+        'model_routes': model_routes.routes,
+        'request_log': request_log.stats(),
+        'snapshot': state_snapshot.stats(),
+        'idempotency': idempotency.stats(),
+        'tenants': tenants.stats(),
+        'deadlines': deadlines.stats(),
+        'health_probes': health_probe.stats(),
+        'coalescing': dict(coalesce_stats, enabled=coalesce_settings['enabled'], in_flight=len(inflight_requests)),
+        'admission_queue': admission_queue.stats(),
+        'key_rotation': key_settings['rotation'],
+        'timestamp': datetime.now().isoformat()
+    }
 
 @app.route('/status', methods=['GET'])
 def status():
     """Get provider status"""
+    return jsonify(status_snapshot())
+
+def metrics_text():
+    """Prometheus metrics, plus provider state read at scrape time"""
     check_recovery()
-    return jsonify({
-        'providers': provider_status,
-        'timestamp': datetime.now().isoformat()
-    })
+    headroom = provider_headroom()
+    with status_lock:
+        extra = {
+            'ai_router_provider_available': ('1 if the provider can take requests', {
+                (('provider', provider),): int(status['available']) for provider, status in provider_status.items()
+            }),
+            'ai_router_key_available': ('1 if the API key can take requests', {
+                (('provider', provider), ('key', kid)): int(entry['available'])
+                for provider, status in provider_status.items() for kid, entry in status['keys'].items()
+            }),
+            'ai_router_provider_requests': ('Calls sent to the provider since start', {
+                (('provider', provider),): status['requests'] for provider, status in provider_status.items()
+            }),
+            'ai_router_provider_failures': ('Failed calls to the provider since start', {
+                (('provider', provider),): status['failures'] for provider, status in provider_status.items()
+            }),
+            'ai_router_rate_limit_headroom': ('Remaining rate-limit headroom (0-1)', {
+                (('provider', provider),): round(value, 3) for provider, value in headroom.items()
+            }),
+            'ai_router_queue_depth': ('Requests waiting in the admission queue', {
+                (): admission_queue.queue_stats['depth']
+            }),
+            'ai_router_tenant_requests': ('Requests per tenant since start, by outcome', {
+                (('tenant', tenant), ('outcome', outcome)): counters[outcome]
+                for tenant, counters in tenants.usage.items()
+                for outcome in ('succeeded', 'cached', 'rejected', 'failed')
+            }),
+            'ai_router_tenant_tokens_used': ('Tokens used per tenant since start', {
+                (('tenant', tenant),): counters['tokens_used'] for tenant, counters in tenants.usage.items()
+            }),
+            'ai_router_fuzzy_cache': ('Near-duplicate prompt index counters', {
+                (('counter', name),): value for name, value in fuzzy_cache.fuzzy_counters.items()
+            })
+        }
+    return metrics.render(extra)
 
-@app.route('/', methods=['GET'])
-def home():
-    """Simple home page"""
-    return """
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics"""
+    return Response(metrics_text(), content_type=METRICS_CONTENT_TYPE)
+
+def profile_request(query, authorization):
+    """Take an on-demand profile for /admin/profile: (body, status_code, content_type, headers).
+    
+    query holds seconds (default 10), interval_ms and idle=1 (keep waiting
+    threads); authorization is the Authorization or X-Admin-Token header.
+    """
+    if not profiler.profile_settings['admin_token']:
+        return {'success': False, 'error': 'Profiling is disabled; set AI_ROUTER_ADMIN_TOKEN to enable it'}, 404, 'application/json', {}
+    token = authorization[7:] if authorization and authorization.startswith('Bearer ') else authorization
+    if not profiler.authorized(token):
+        return {'success': False, 'error': 'Admin token required'}, 401, 'application/json', {}
+    try:
+        seconds = float(query.get('seconds', 10))
+        interval = float(query['interval_ms']) / 1000 if query.get('interval_ms') else None
+    except ValueError:
+        return {'success': False, 'error': 'seconds and interval_ms must be numbers'}, 400, 'application/json', {}
+    try:
+        stacks, summary = profiler.collect(seconds, interval, query.get('idle') == '1')
+    except RuntimeError as e:
+        return {'success': False, 'error': str(e)}, 409, 'application/json', {}
+    headers = {f'X-Profile-{name.replace("_", "-").title()}': str(value) for name, value in summary.items()}
+    return profiler.collapsed(stacks), 200, 'text/plain; charset=utf-8', headers
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """Sample the router for ?seconds=N and return collapsed stacks (flamegraph.pl, speedscope)"""
+    body, status_code, content_type, headers = profile_request(
+        request.args, request.headers.get('Authorization') or request.headers.get('X-Admin-Token')
+    )
+    if content_type == 'application/json':
+        return jsonify(body), status_code
+    return Response(body, status=status_code, content_type=content_type, headers=headers)
+
+HOME_PAGE = """
     <h1>🤖 AI Router - Simple Version</h1>
     <p>Your AI rotation system is running!</p>
     <h2>Endpoints:</h2>
     <ul>
         <li><strong>POST /ai-request</strong> - Main AI endpoint</li>
+        <li><strong>POST /ai-request/stream</strong> - Streaming AI endpoint (Server-Sent Events)</li>
+        <li><strong>POST /ai-batch</strong> - Bulk endpoint (JSONL in, JSONL out)</li>
         <li><strong>GET /status</strong> - Provider status</li>
+        <li><strong>GET /metrics</strong> - Prometheus metrics</li>
+        <li><strong>GET /admin/profile?seconds=N</strong> - Sampling profile as collapsed stacks (needs AI_ROUTER_ADMIN_TOKEN)</li>
     </ul>
     <h2>Example Request:</h2>
     <pre>
@@ -328,7 +2154,294 @@ curl -X POST http://localhost:5000/ai-request \\
     </pre>
     """
 
+@app.route('/', methods=['GET'])
+def home():
+    """Simple home page"""
+    return HOME_PAGE
+
+# ---------------------------------------------------------------------------
+# Async (ASGI) serving mode: same endpoints, non-blocking provider calls
+# ---------------------------------------------------------------------------
+
+async def _asgi_read_json(receive):
+    """Read and decode a JSON request body"""
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    parse_started = time.perf_counter()
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+    finally:
+        stage('request_parse', time.perf_counter() - parse_started)
+
+def _asgi_header(scope, name):
+    """Value of a request header (name in lowercase bytes), or None"""
+    for header, value in scope.get('headers', []):
+        if header == name:
+            return value.decode('latin-1')
+    return None
+
+async def _asgi_respond(send, status_code, body, content_type='application/json', headers=(), timings=None):
+    """Send a complete ASGI HTTP response (with a Server-Timing header when given timings)"""
+    if content_type == 'application/json':
+        serialize_started = time.perf_counter()
+        payload = json.dumps(body, default=str).encode()
+        stage('serialization', time.perf_counter() - serialize_started)
+    else:
+        payload = body.encode()
+    if timings is not None and request_timing.timing_settings['server_timing']:
+        headers = list(headers) + [(b'server-timing', request_timing.header(timings).encode())]
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': [
+            (b'content-type', content_type.encode()),
+            (b'content-length', str(len(payload)).encode())
+        ] + list(headers)
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+async def _asgi_stream(send, events):
+    """Send an async iterator of Server-Sent Events as a streamed response"""
+    headers = [(b'content-type', b'text/event-stream')]
+    headers += [(name.lower().encode(), value.encode()) for name, value in SSE_HEADERS.items()]
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+    try:
+        async for event in events:
+            await send({'type': 'http.response.body', 'body': event.encode(), 'more_body': True})
+    finally:
+        await events.aclose()
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def _asgi_disconnected(receive):
+    """Return once the client disconnects (the request body has already been read)"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+async def _asgi_cancel_on_disconnect(receive, coroutine):
+    """Run coroutine, cancelling it (and the upstream calls it makes) if the client disconnects first.
+    
+    Returns (result, disconnected).
+    """
+    work = asyncio.ensure_future(coroutine)
+    watcher = asyncio.ensure_future(_asgi_disconnected(receive))
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        work.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if work.done():
+        return work.result(), False
+    work.cancel()
+    try:
+        await work
+    except asyncio.CancelledError:
+        pass
+    return None, True
+
+_asgi_background = set()  # detached tasks, referenced until they finish
+
+def _asgi_detached(coroutine):
+    """Run coroutine in a task that outlives its request; returns a shield to await it with"""
+    task = asyncio.ensure_future(coroutine)
+    _asgi_background.add(task)
+    task.add_done_callback(_asgi_background.discard)
+    return asyncio.shield(task)
+
+async def _asgi_lines(receive):
+    """Iterate over request body lines as they arrive"""
+    buffer = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        buffer += message.get('body', b'')
+        more_body = message.get('more_body', False)
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+async def _asgi_batch(scope, receive, send):
+    """Async /ai-batch: JSONL requests in, JSONL results out in completion order"""
+    query = {key: values[0] for key, values in parse_qs(scope.get('query_string', b'').decode()).items()}
+    concurrency = batch_concurrency(query.get('concurrency'))
+    batch_id = query.get('batch_id')
+    output_path = batch_output_path(batch_id) if batch_id else None
+    if batch_id and not output_path:
+        await _asgi_respond(send, 400, {'success': False, 'error': 'batch_id may only contain letters, digits, - and _'})
+        return
+    
+    state = batch_runner.start_checkpoint(output_path, query.get('retry_failed') == '1') if output_path else None
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/x-ndjson')]})
+    try:
+        results = batch_runner.run_batch_async(
+            _asgi_lines(receive), process_batch_record_async, concurrency, state['skip'] if state else None
+        )
+        async for line_number, result in results:
+            if state:
+                batch_runner.checkpoint_result(state, line_number, result)
+            if result is not None:
+                payload = (json.dumps(result, ensure_ascii=False) + '\n').encode()
+                await send({'type': 'http.response.body', 'body': payload, 'more_body': True})
+    finally:
+        if state:
+            batch_runner.finish_checkpoint(state)
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def asgi_app(scope, receive, send):
+    """ASGI application exposing /ai-request, /status and /"""
+    if scope['type'] == 'lifespan':
+        probe_task = None
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                probe_task = health_probe.start_async(probe_targets, record_probe)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if probe_task:
+                    probe_task.cancel()
+                await provider_pool.aclose_all()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    
+    if scope['type'] != 'http':
+        return
+    
+    method = scope['method']
+    path = scope['path']
+    
+    if path == '/ai-request' and method == 'POST':
+        start_time = time.time()
+        request_id = generate_request_id()
+        request_started('/ai-request')
+        # Each ASGI request runs in its own task, so its context holds only its own timings
+        timings, _ = request_timing.start()
+        data = await _asgi_read_json(receive)
+        tenant = _asgi_header(scope, tenants.TENANT_HEADER.lower().encode())
+        timeout = _asgi_header(scope, deadlines.DEADLINE_HEADER.lower().encode())
+        run = lambda: run_flow_async(ai_request_flow(data, request_id, start_time, tenant=tenant, timeout=timeout))
+        idempotency_key = _asgi_header(scope, b'idempotency-key')
+        if idempotency_key is None:
+            outcome, disconnected = await _asgi_cancel_on_disconnect(receive, run())
+        else:
+            # A client retrying with the key waits for this run's result, so a disconnect doesn't cancel it
+            outcome, disconnected = await _asgi_cancel_on_disconnect(
+                receive, _asgi_detached(idempotency.call_async(
+                    idempotency_key, data, request_id, run, *idempotency_scope(data, tenant, timeout, start_time)
+                ))
+            )
+        if disconnected:
+            # Nobody is left to answer; 499 is the usual "client closed request" status
+            request_cancelled('/ai-request', request_id, start_time)
+            request_finished('/ai-request', 499, start_time)
+            return
+        body, status_code, replayed = outcome if idempotency_key is not None else outcome + (False,)
+        if wants_debug(data):
+            body = dict(body, debug=request_timing.debug_block(timings))
+        headers = [(b'idempotent-replayed', b'true')] if replayed else []
+        await _asgi_respond(send, status_code, body, headers=headers, timings=timings)
+        request_finished('/ai-request', status_code, start_time)
+    elif path == '/ai-request/stream' and method == 'POST':
+        start_time = time.time()
+        request_id = generate_request_id()
+        data = await _asgi_read_json(receive) or {}
+        params, error = stream_request_params(
+            data, request_id,
+            _asgi_header(scope, tenants.TENANT_HEADER.lower().encode()),
+            _asgi_header(scope, deadlines.DEADLINE_HEADER.lower().encode())
+        )
+        if error:
+            await _asgi_respond(send, error[1], error[0])
+        else:
+            events = metered_stream_async(stream_ai_request_async(params, request_id, start_time), start_time, request_id)
+            await _asgi_cancel_on_disconnect(receive, _asgi_stream(send, events))
+    elif path == '/ai-batch' and method == 'POST':
+        await _asgi_batch(scope, receive, send)
+    elif path == '/status' and method == 'GET':
+        await _asgi_respond(send, 200, status_snapshot())
+    elif path == '/metrics' and method == 'GET':
+        await _asgi_respond(send, 200, metrics_text(), METRICS_CONTENT_TYPE)
+    elif path == '/admin/profile' and method in ('GET', 'POST'):
+        query = {key: values[0] for key, values in parse_qs(scope.get('query_string', b'').decode()).items()}
+        authorization = _asgi_header(scope, b'authorization') or _asgi_header(scope, b'x-admin-token')
+        # Sampling blocks for the whole profile, so it runs off the event loop
+        body, status_code, content_type, headers = await asyncio.get_running_loop().run_in_executor(
+            None, profile_request, query, authorization
+        )
+        headers = [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+        await _asgi_respond(send, status_code, body, content_type, headers)
+    elif path == '/' and method == 'GET':
+        await _asgi_respond(send, 200, HOME_PAGE, 'text/html; charset=utf-8')
+    else:
+        await _asgi_respond(send, 404, {'success': False, 'error': 'Not found'})
+
+def run_async_server(port):
+    """Serve the ASGI app with uvicorn"""
+    import uvicorn
+    uvicorn.run(asgi_app, host='0.0.0.0', port=port, log_level='warning', lifespan='on')
+
+def run_production_server(port, workers, async_mode):
+    """Serve with pre-forked gunicorn workers that share provider state.
+    
+    Send SIGHUP to the master process for a graceful reload of the workers.
+    """
+    from gunicorn.app.base import BaseApplication
+    
+    if not shared_state.enabled():
+        shared_state.state_settings['db_path'] = os.path.join(tempfile.gettempdir(), f'ai-router-state-{port}.db')
+    rate_limiter.configure(rate_limiter.load_limits(workers))
+    tenants.tenant_settings['workers'] = workers
+    load_env()  # once, before the workers fork; requests reuse it
+    restore_state()
+    
+    class ProductionServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'0.0.0.0:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('timeout', 120)
+            self.cfg.set('graceful_timeout', 30)
+            if async_mode:
+                self.cfg.set('worker_class', 'uvicorn.workers.UvicornWorker')
+            else:
+                self.cfg.set('worker_class', 'gthread')
+                self.cfg.set('threads', int(os.environ.get('AI_ROUTER_THREADS', 8)))
+            # Each worker snapshots its own state and probes with its own connections
+            self.cfg.set('post_fork', lambda server, worker: start_worker_tasks(async_mode))
+        
+        def load(self):
+            return asgi_app if async_mode else app
+    
+    ProductionServer().run()
+
 if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Simple AI Router')
+    parser.add_argument('--async', dest='async_mode', action='store_true', help='serve with the async (ASGI) engine')
+    parser.add_argument('--batch', metavar='INPUT', help="process a JSONL request file ('-' for stdin) and exit")
+    parser.add_argument('--output', help='JSONL results file for --batch (resumed if it exists)')
+    parser.add_argument('--concurrency', type=int, help='requests in flight for --batch')
+    parser.add_argument('--retry-failed', action='store_true', help='with --batch, retry lines that failed last time')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('AI_ROUTER_WORKERS', 1)),
+                        help='pre-forked worker processes (production server, needs gunicorn)')
+    args = parser.parse_args()
+    
+    if args.batch:
+        run_batch_cli(args)
+        sys.exit(0)
+    
+    async_mode = args.async_mode or os.environ.get('AI_ROUTER_ASYNC') == '1'
+    
     print("🚀 Starting Simple AI Router...")
     
     # Get port from environment (Railway sets this)
@@ -336,9 +2449,35 @@ if __name__ == '__main__':
     
     print(f"📍 Server will be available at: http://0.0.0.0:{port}")
     print(f"📖 API endpoint: /ai-request")
+    print(f"🌊 Stream endpoint: /ai-request/stream")
+    print(f"📦 Batch endpoint: /ai-batch")
     print(f"📊 Status endpoint: /status")
+    print(f"📈 Metrics endpoint: /metrics")
+    if async_mode:
+        print("⚡ Async serving mode (ASGI + non-blocking provider calls)")
+    
+    workers = args.workers
+    if workers > 1:
+        try:
+            import gunicorn
+        except ImportError:
+            print("⚠️ gunicorn is not installed, serving with a single process")
+            workers = 1
+        else:
+            print(f"👷 {workers} worker processes sharing provider state")
+    
     print("\n✅ Ready to serve AI requests!")
     print("🔄 Automatic rotation and rate limit handling enabled")
     print("\nPress Ctrl+C to stop")
     
-    app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
+    if workers > 1:
+        run_production_server(port, workers, async_mode)
+        sys.exit(0)
+    
+    load_env()  # once at startup; requests reuse it
+    restore_state()
+    start_worker_tasks(async_mode)
+    if async_mode:
+        run_async_server(port)
+    else:
+        app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,106 @@
+"""
+State Snapshot
+Periodic snapshots of router state (provider and key availability,
+recovery deadlines, counters, rate-limit buckets, latency statistics) to
+local disk, restored at startup so a restarted router doesn't send
+requests to providers that are still rate limited. Snapshots are written
+to a temporary file, fsynced and renamed into place, so a crash leaves
+either the old or the new snapshot, never half of one.
+"""
+
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+
+SNAPSHOT_VERSION = 1
+
+snapshot_settings = {
+    # Path of the snapshot file; snapshots are off unless one is set
+    'path': os.environ.get('AI_ROUTER_SNAPSHOT_PATH', ''),
+    'interval': float(os.environ.get('AI_ROUTER_SNAPSHOT_SECONDS', 10)),
+    # Snapshots older than this are ignored at startup
+    'max_age': float(os.environ.get('AI_ROUTER_SNAPSHOT_MAX_AGE_SECONDS', 6 * 3600)),
+    # Latency and error-rate statistics go stale sooner than deadlines and buckets
+    'stats_max_age': float(os.environ.get('AI_ROUTER_SNAPSHOT_STATS_MAX_AGE_SECONDS', 900))
+}
+
+snapshot_stats = {'saves': 0, 'save_errors': 0, 'last_saved_at': None, 'restored_from': None, 'restored_age': None}
+
+_thread = {'thread': None, 'pid': None}
+_lock = threading.Lock()
+
+def enabled():
+    return bool(snapshot_settings['path'])
+
+def save(state):
+    """Write a snapshot atomically"""
+    path = snapshot_settings['path']
+    directory = os.path.dirname(os.path.abspath(path))
+    data = json.dumps({'version': SNAPSHOT_VERSION, 'saved_at': time.time(), 'pid': os.getpid(), 'state': state}, default=str)
+    with _lock:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.router-state-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as tmp_file:
+                tmp_file.write(data)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    snapshot_stats['saves'] += 1
+    snapshot_stats['last_saved_at'] = time.time()
+
+def load():
+    """(state, age in seconds) of the last snapshot, or (None, None) if missing, unreadable or stale"""
+    path = snapshot_settings['path']
+    if not path or not os.path.exists(path):
+        return None, None
+    try:
+        with open(path) as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable state snapshot {path}: {e}")
+        return None, None
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        print(f"⚠️ Ignoring state snapshot {path} written by another router version")
+        return None, None
+    age = time.time() - snapshot.get('saved_at', 0)
+    if age < 0 or age > snapshot_settings['max_age']:
+        print(f"⚠️ Ignoring stale state snapshot {path} ({age:.0f}s old)")
+        return None, None
+    snapshot_stats['restored_from'] = path
+    snapshot_stats['restored_age'] = round(age, 1)
+    return snapshot['state'], age
+
+def _save_loop(collect):
+    while True:
+        time.sleep(snapshot_settings['interval'])
+        _save_quietly(collect)
+
+def _save_quietly(collect):
+    try:
+        save(collect())
+    except Exception as e:
+        snapshot_stats['save_errors'] += 1
+        print(f"⚠️ State snapshot failed: {e}")
+
+def start(collect):
+    """Snapshot collect() every interval and at exit (call again in each forked worker)"""
+    if not enabled() or _thread['pid'] == os.getpid():
+        return
+    _thread['pid'] = os.getpid()
+    _thread['thread'] = threading.Thread(target=_save_loop, args=(collect,), name='state-snapshot', daemon=True)
+    _thread['thread'].start()
+    atexit.register(_save_quietly, collect)
+
+def stats():
+    """Snapshot counters for /status"""
+    return dict(snapshot_stats, path=snapshot_settings['path'], interval=snapshot_settings['interval'])
@@ -0,0 +1,114 @@
+"""
+Tenants
+Tenant (n8n workflow) identity, per-tenant request and token budgets and
+usage counters. Budgets are rate-limiter buckets named 'tenant:<id>'; the
+admission queue uses the tenant weights for weighted fair queuing, so
+when providers are saturated the shared quota is split by weight instead
+of going to whoever sends the most requests.
+"""
+
+import json
+import os
+import re
+import threading
+
+import rate_limiter
+
+TENANT_HEADER = 'X-Tenant-ID'
+DEFAULT_TENANT = 'default'
+OTHER_TENANT = '_other'  # every tenant beyond max_tenants
+
+tenant_settings = {
+    # Relative shares under contention, e.g. '{"billing-sync": 3}'
+    'weights': {},
+    # Per-tenant budgets, e.g. '{"nightly-batch": {"rpm": 10, "tpm": 20000}, "*": {"rpd": 500}}';
+    # "*" applies to every tenant without its own entry
+    'budgets': {},
+    'max_tenants': int(os.environ.get('AI_ROUTER_MAX_TENANTS', 1000)),
+    'workers': 1  # budgets are split between worker processes
+}
+
+for _setting, _variable in (('weights', 'AI_ROUTER_TENANT_WEIGHTS'), ('budgets', 'AI_ROUTER_TENANT_BUDGETS')):
+    try:
+        tenant_settings[_setting] = json.loads(os.environ.get(_variable, '') or '{}')
+    except ValueError:
+        print(f"⚠️ {_variable} is not valid JSON, ignoring it")
+
+_VALID_ID = re.compile(r'^[A-Za-z0-9._:@/-]{1,64}$')
+_lock = threading.Lock()
+usage = {}  # tenant -> counters
+
+def _new_usage():
+    return {'requests': 0, 'succeeded': 0, 'cached': 0, 'rejected': 0, 'failed': 0, 'tokens_used': 0, 'tokens_charged': 0}
+
+def requested(header_value, data):
+    """Tenant a request names (X-Tenant-ID header, else the "tenant" field), not yet validated"""
+    return header_value or (data.get('tenant') if isinstance(data, dict) else None) or DEFAULT_TENANT
+
+def tenant_id(header_value, data):
+    """Tenant of a request from the X-Tenant-ID header or the "tenant" field; raises ValueError"""
+    tenant = requested(header_value, data)
+    if not isinstance(tenant, str) or not _VALID_ID.match(tenant):
+        raise ValueError('tenant must be 1-64 letters, digits or ._:@/-')
+    with _lock:
+        if tenant not in usage:
+            if len(usage) >= tenant_settings['max_tenants']:
+                tenant = OTHER_TENANT
+            usage.setdefault(tenant, _new_usage())
+    return tenant
+
+def weight(tenant):
+    """Share of the tenant under contention"""
+    return float(tenant_settings['weights'].get(tenant, 1.0)) or 1.0
+
+def _budget(tenant):
+    """Bucket name of the tenant's budget, or None without one"""
+    values = tenant_settings['budgets'].get(tenant) or tenant_settings['budgets'].get('*')
+    if not values:
+        return None
+    name = f'tenant:{tenant}'
+    workers = tenant_settings['workers']
+    rate_limiter.ensure(name, {kind: max(limit / workers, 1) for kind, limit in values.items() if limit})
+    return name
+
+def admit(tenant, tokens):
+    """Charge a request against the tenant's budget; returns None, or seconds to wait when it is spent"""
+    name = _budget(tenant)
+    if name is not None:
+        if not rate_limiter.has_capacity(name, tokens):
+            with _lock:
+                usage[tenant]['requests'] += 1
+                usage[tenant]['rejected'] += 1
+            return round(max(rate_limiter.wait_time(name, tokens), 0.1), 1)
+        rate_limiter.acquire(name, tokens)
+    with _lock:
+        usage[tenant]['requests'] += 1
+        usage[tenant]['tokens_charged'] += tokens
+    return None
+
+def record(tenant, outcome, tokens_charged=0, tokens_used=0):
+    """Count how an admitted request ended: 'succeeded', 'cached' or 'failed'"""
+    if outcome == 'succeeded' and tokens_used:
+        name = _budget(tenant)
+        if name is not None:
+            rate_limiter.settle(name, tokens_charged, tokens_used)
+    with _lock:
+        counters = usage[tenant]
+        counters[outcome] += 1
+        counters['tokens_used'] += tokens_used or 0
+
+def count_cached(tenant):
+    """Count a request answered from a cache (it doesn't touch the budget)"""
+    with _lock:
+        usage[tenant]['requests'] += 1
+        usage[tenant]['cached'] += 1
+
+def stats():
+    """Usage per tenant for /status"""
+    levels = rate_limiter.bucket_levels()
+    with _lock:
+        tenants = {tenant: dict(counters) for tenant, counters in usage.items()}
+    for tenant, counters in tenants.items():
+        counters['weight'] = weight(tenant)
+        counters['budget'] = levels.get(f'tenant:{tenant}')
+    return tenants
@@ -2,14 +2,18 @@
 """
 Standalone AI Provider Test Script
 Tests the three AI providers directly to verify your API keys work.
+Run with --concurrent to health-probe every key at once instead.
 """
 
+import argparse
 import os
 import json
-import requests
 import time
 from datetime import datetime
 
+import health_probe
+import provider_pool
+
 # Load environment variables from .env file
 def load_env():
     env_vars = {}
@@ -48,7 +52,8 @@ def test_github_models(token, prompt="Hello! Please introduce yourself briefly."
     }
     
     try:
-        response = requests.post(
+        response = provider_pool.post(
+            'github_models',
             "https://models.inference.ai.azure.com/chat/completions",
             headers=headers,
             json=data,
@@ -95,7 +100,8 @@ def test_openrouter(api_key, prompt="Hello! Please introduce yourself briefly.")
     }
     
     try:
-        response = requests.post(
+        response = provider_pool.post(
+            'openrouter',
             "https://openrouter.ai/api/v1/chat/completions",
             headers=headers,
             json=data,
@@ -140,7 +146,8 @@ def test_google_gemini(api_key, prompt="Hello! Please introduce yourself briefly
     }
     
     try:
-        response = requests.post(
+        response = provider_pool.post(
+            'google_gemini',
             f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={api_key}",
             json=data,
             timeout=30
@@ -163,7 +170,45 @@ def test_google_gemini(api_key, prompt="Hello! Please introduce yourself briefly
         print(f"❌ Google Gemini error: {str(e)}")
         return False
 
+# .env variable of each provider's keys (comma-separated for several keys)
+KEY_VARS = {
+    'github_models': 'GITHUB_TOKEN',
+    'openrouter': 'OPENROUTER_API_KEY',
+    'google_gemini': 'GOOGLE_API_KEY'
+}
+
+def probe_keys(env_vars):
+    """Health-probe every key of every provider concurrently"""
+    targets = []
+    for provider, var in KEY_VARS.items():
+        keys = [key.strip() for key in env_vars.get(var, '').split(',') if key.strip()]
+        for number, key in enumerate(keys, 1):
+            targets.append((provider, f'key{number}', key))
+    if not targets:
+        print("❌ No API keys set in .env file")
+        return 0
+    
+    print(f"\n🩺 Probing {len(targets)} keys concurrently...")
+    started = time.perf_counter()
+    results = health_probe.probe_all(targets)
+    elapsed = time.perf_counter() - started
+    
+    for result in results:
+        if result['ok']:
+            print(f"  ✅ {result['provider']} {result['key']}: {result['latency'] * 1000:.0f}ms")
+        else:
+            print(f"  ❌ {result['provider']} {result['key']}: {result['status_code'] or 'no response'} {result['error'] or ''}".rstrip())
+    working = {result['provider'] for result in results if result['ok']}
+    print(f"\n⏱️ All probes finished in {elapsed:.2f}s")
+    print(f"🎯 {len(working)}/{len(KEY_VARS)} providers have a working key!")
+    return len(working)
+
 def main():
+    parser = argparse.ArgumentParser(description='Test the AI providers with the keys in .env')
+    parser.add_argument('--concurrent', action='store_true',
+                        help='health-probe every key at once (no completions, no quota) instead of testing providers one by one')
+    args = parser.parse_args()
+    
     print("🚀 AI Provider Test Script")
     print("=" * 50)
     print(f"Started at: {datetime.now()}")
@@ -173,6 +218,10 @@ def main():
     if not env_vars:
         return
     
+    if args.concurrent:
+        probe_keys(env_vars)
+        return
+    
     # Test each provider
     github_success = test_github_models(env_vars.get('GITHUB_TOKEN', ''))
     time.sleep(2)  # Rate limiting courtesy
@@ -190,6 +239,10 @@ def main():
     print(f"  Google Gemini: {'✅ Working' if gemini_success else '❌ Failed'}")
     
     working_count = sum([github_success, openrouter_success, gemini_success])
+
+    print("\n🔌 Connection pools:")
+    for provider, stats in provider_pool.pool_stats().items():
+        print(f"  {provider}: {stats['requests']} requests, {stats['connections_opened']} connections, {stats['http_versions']}")
     print(f"\n🎯 {working_count}/3 providers are working!")
     
     if working_count > 0:
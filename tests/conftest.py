@@ -0,0 +1,23 @@
+"""
+Shared test setup: the router's modules live at the repository root.
+"""
+
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def router():
+    """The simple-ai-router.py module (its file name isn't importable)"""
+    import request_log
+    request_log.log_settings['enabled'] = False
+    spec = importlib.util.spec_from_file_location('simple_ai_router', os.path.join(ROOT, 'simple-ai-router.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,140 @@
+"""
+Admission queue: rejection reasons, weighted fair queuing, priorities and
+per-request provider capacity.
+"""
+
+import time
+
+import pytest
+
+import admission_queue
+
+
+@pytest.fixture(autouse=True)
+def empty_queue(monkeypatch):
+    """A fresh queue for every test, without the background ticker"""
+    monkeypatch.setattr(admission_queue, '_heap', [])
+    monkeypatch.setattr(admission_queue, '_fair', {'virtual_time': 0.0, 'finish': {}})
+    monkeypatch.setattr(admission_queue, '_capacity', None)
+    monkeypatch.setattr(admission_queue, '_start_ticker', lambda: None)
+    monkeypatch.setattr(admission_queue, 'queue_stats', dict.fromkeys(admission_queue.queue_stats, 0))
+    monkeypatch.setitem(admission_queue.queue_settings, 'enabled', True)
+
+
+def enqueue(granted, name, tokens=100, priority=0, tenant=None, weight=1.0, providers=None):
+    deadline = time.time() + 30
+    return admission_queue._enqueue(tokens, priority, deadline, lambda: granted.append(name), tenant, weight, providers)
+
+
+def drain(count):
+    for _ in range(count):
+        admission_queue.dispatch()
+
+
+def test_rejection_reasons(monkeypatch):
+    now = time.time()
+    assert admission_queue.rejection(now + 10, 1.0) is None
+    assert admission_queue.rejection(now + 10, None) == 'no_provider'
+    assert admission_queue.rejection(now + 1, 5.0) == 'deadline'
+    monkeypatch.setitem(admission_queue.queue_settings, 'max_depth', 0)
+    assert admission_queue.rejection(now + 10, 1.0) == 'queue_full'
+    monkeypatch.setitem(admission_queue.queue_settings, 'enabled', False)
+    assert admission_queue.rejection(now + 10, 1.0) == 'queue_disabled'
+
+
+def test_nothing_is_granted_without_capacity():
+    granted = []
+    admission_queue.configure(lambda tokens, providers: False)
+    enqueue(granted, 'a')
+    drain(3)
+    assert granted == []
+    assert admission_queue.queue_stats['depth'] == 1
+
+
+def test_tenants_are_served_fairly():
+    granted = []
+    admission_queue.configure(lambda tokens, providers: True)
+    for name in ('a1', 'a2', 'a3'):
+        enqueue(granted, name, tenant='a')
+    enqueue(granted, 'b1', tenant='b')
+    drain(4)
+    # b1 finishes (virtually) with a1, ahead of a's backlog
+    assert granted == ['a1', 'b1', 'a2', 'a3']
+
+
+def test_weights_share_capacity():
+    granted = []
+    admission_queue.configure(lambda tokens, providers: True)
+    for n in range(4):
+        enqueue(granted, f'heavy{n}', tenant='heavy', weight=2.0)
+    for n in range(2):
+        enqueue(granted, f'light{n}', tenant='light')
+    drain(6)
+    assert granted == ['heavy0', 'heavy1', 'light0', 'heavy2', 'heavy3', 'light1']
+
+
+def test_priority_goes_first():
+    granted = []
+    admission_queue.configure(lambda tokens, providers: True)
+    enqueue(granted, 'low', tenant='a')
+    enqueue(granted, 'high', priority=5, tenant='b')
+    drain(2)
+    assert granted == ['high', 'low']
+
+
+def test_capacity_is_checked_for_the_request_providers():
+    granted = []
+    checked = []
+
+    def capacity(tokens, providers):
+        checked.append(providers)
+        return 'fast' in providers
+
+    admission_queue.configure(capacity)
+    enqueue(granted, 'needs_slow', providers=['slow'])
+    enqueue(granted, 'needs_fast', providers=['fast'])
+    drain(3)
+    # The head can't be served, so capacity goes to the request that can use it
+    assert granted == ['needs_fast']
+    assert ['slow'] in checked
+    assert admission_queue.queue_stats['depth'] == 1
+
+
+def test_blocked_route_is_checked_once_per_dispatch():
+    granted = []
+    checked = []
+
+    def capacity(tokens, providers):
+        checked.append((tokens, providers))
+        return False
+
+    admission_queue.configure(capacity)
+    enqueue(granted, 'small', tokens=100, providers=['p'])
+    enqueue(granted, 'large', tokens=500, providers=['p'])
+    enqueue(granted, 'smaller', tokens=50, providers=['p'])
+    admission_queue.dispatch()
+    # A larger request can't fit where a smaller one didn't
+    assert checked == [(100, ['p']), (50, ['p'])]
+    assert granted == []
+
+
+def test_granted_waiter_is_settled_once():
+    granted = []
+    admission_queue.configure(lambda tokens, providers: True)
+    waiter = enqueue(granted, 'a')
+    admission_queue.dispatch()
+    assert admission_queue._finish(waiter, timed_out=False) == 'granted'
+    assert admission_queue.queue_stats['depth'] == 0
+    assert admission_queue.queue_stats['dispatched'] == 1
+
+
+def test_expired_waiter_is_skipped():
+    granted = []
+    admission_queue.configure(lambda tokens, providers: False)
+    waiter = enqueue(granted, 'late')
+    enqueue(granted, 'next')
+    assert admission_queue._finish(waiter, timed_out=True) == 'expired'
+    admission_queue.configure(lambda tokens, providers: True)
+    drain(2)
+    assert granted == ['next']
+    assert admission_queue.queue_stats['expired'] == 1
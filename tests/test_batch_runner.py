@@ -0,0 +1,57 @@
+"""
+Batch runner: JSONL parsing, bounded concurrency and resumable checkpoints.
+"""
+
+import json
+
+import batch_runner
+
+
+def process(record):
+    if record.get('fail'):
+        return {'success': False, 'error': 'failed'}, 503
+    return {'success': True, 'response': record['prompt'].upper()}, 200
+
+
+def run(lines, **kwargs):
+    return dict(batch_runner.run_batch(lines, process, 2, **kwargs))
+
+
+def test_lines_are_numbered_from_one():
+    results = run(['{"prompt": "a", "id": "x"}', '', 'not json', '[1]', '{"prompt": "b"}'])
+    assert results[1] == {'success': True, 'response': 'A', 'line': 1, 'status_code': 200, 'id': 'x'}
+    assert results[2] is None
+    assert results[3]['line'] == 3 and results[3]['error'].startswith('Invalid JSON')
+    assert results[4] == {'line': 4, 'success': False, 'error': 'Each line must be a JSON object'}
+    assert results[5]['line'] == 5
+
+
+def test_failed_request_keeps_its_status():
+    assert run(['{"prompt": "a", "fail": true}'])[1]['status_code'] == 503
+
+
+def batch_file(output_path, lines, retry_failed=False):
+    state = batch_runner.start_checkpoint(str(output_path), retry_failed)
+    for line_number, result in batch_runner.run_batch(lines, process, 2, state['skip']):
+        batch_runner.checkpoint_result(state, line_number, result)
+    return batch_runner.finish_checkpoint(state)
+
+
+def test_resumed_batch_skips_finished_lines(tmp_path):
+    output = tmp_path / 'out.jsonl'
+    lines = ['{"prompt": "a"}', '{"prompt": "b", "fail": true}', '{"prompt": "c"}']
+    assert batch_file(output, lines[:2])['written'] == 2
+    summary = batch_file(output, lines)
+    assert (summary['written'], summary['resumed']) == (1, 2)
+    written = [json.loads(line)['line'] for line in output.read_text().splitlines()]
+    assert sorted(written) == [1, 2, 3]
+    checkpoint = json.loads((tmp_path / 'out.jsonl.checkpoint').read_text())
+    assert checkpoint['next_line'] == 4 and checkpoint['finished']
+
+
+def test_retry_failed_runs_failed_lines_again(tmp_path):
+    output = tmp_path / 'out.jsonl'
+    lines = ['{"prompt": "a"}', '{"prompt": "b", "fail": true}']
+    batch_file(output, lines)
+    summary = batch_file(output, lines, retry_failed=True)
+    assert (summary['written'], summary['resumed']) == (1, 1)
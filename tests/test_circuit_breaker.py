@@ -0,0 +1,64 @@
+"""
+Circuit breaker: provider delay headers, backoff and the closed / open /
+half-open cycle.
+"""
+
+import time
+from datetime import datetime, timedelta
+from email.utils import formatdate
+
+import pytest
+
+import circuit_breaker
+
+
+@pytest.mark.parametrize('headers, delay', [
+    ({'retry-after': '5'}, 5),
+    ({'x-ratelimit-reset': '6m0s'}, 360),
+    ({'x-ratelimit-reset-requests': '250ms'}, 0.25),
+    ({'retry-after': '5', 'x-ratelimit-reset-tokens': '20s'}, 20),
+    ({'retry-after': '-3'}, 0),
+    ({'retry-after': str(10 ** 6)}, 24 * 3600)
+])
+def test_delay_headers(headers, delay):
+    assert circuit_breaker.retry_after_from_headers(headers) == pytest.approx(delay)
+
+
+def test_reset_as_epoch_time():
+    now = time.time()
+    assert circuit_breaker.retry_after_from_headers({'x-ratelimit-reset': str(int(now) + 30)}) == pytest.approx(30, abs=1)
+    assert circuit_breaker.retry_after_from_headers({'x-ratelimit-reset': str(int((now + 30) * 1000))}) == pytest.approx(30, abs=1)
+
+
+def test_retry_after_as_http_date():
+    delay = circuit_breaker.retry_after_from_headers({'retry-after': formatdate(time.time() + 60, usegmt=True)})
+    assert delay == pytest.approx(60, abs=2)
+
+
+@pytest.mark.parametrize('headers', [None, {}, {'retry-after': 'soon'}, {'x-ratelimit-reset': '5 minutes'}])
+def test_no_usable_delay(headers):
+    assert circuit_breaker.retry_after_from_headers(headers) is None
+
+
+def test_backoff_grows_and_is_capped(monkeypatch):
+    monkeypatch.setitem(circuit_breaker.breaker_settings, 'base_delay', 2.0)
+    assert 1.0 <= circuit_breaker.backoff_delay(1, 60) <= 2.0
+    assert 4.0 <= circuit_breaker.backoff_delay(3, 60) <= 8.0
+    assert 30.0 <= circuit_breaker.backoff_delay(20, 60) <= 60.0
+
+
+def test_circuit_cycle():
+    entry = circuit_breaker.new_entry()
+    circuit_breaker.trip(entry, 10)
+    assert (entry['state'], entry['available'], entry['consecutive_failures']) == (circuit_breaker.OPEN, False, 1)
+    now = datetime.now()
+    assert not circuit_breaker.ready_to_probe(entry, now)
+    later = now + timedelta(seconds=11)
+    assert circuit_breaker.ready_to_probe(entry, later)
+    circuit_breaker.start_probe(entry, later)
+    assert entry['state'] == circuit_breaker.HALF_OPEN
+    assert not entry['available']
+    # A probe that never comes back is retried after probe_timeout
+    assert circuit_breaker.ready_to_probe(entry, later + timedelta(seconds=circuit_breaker.breaker_settings['probe_timeout']))
+    circuit_breaker.close(entry)
+    assert entry == dict(circuit_breaker.new_entry(), failures=1)
@@ -0,0 +1,80 @@
+"""
+Deadlines: parsing, per-attempt timeouts and skipping slow providers.
+"""
+
+import pytest
+
+import deadlines
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(deadlines, 'deadline_settings', {
+        'default_timeout': 90.0,
+        'max_timeout': 600.0,
+        'attempt_timeout': 30.0,
+        'connect_timeout': 5.0
+    })
+    monkeypatch.setattr(deadlines, 'deadline_stats', dict.fromkeys(deadlines.deadline_stats, 0))
+
+
+def test_request_deadline_sources():
+    assert deadlines.request_deadline(None, {}, 100.0) == 190.0
+    assert deadlines.request_deadline(None, {'timeout_ms': 2000}, 100.0) == 102.0
+    # The header wins over the body field
+    assert deadlines.request_deadline('500', {'timeout_ms': 2000}, 100.0) == 100.5
+    assert deadlines.request_deadline(None, {'timeout_ms': 10 ** 9}, 100.0) == 700.0
+    # "deadline_ms" is the older name of "timeout_ms"
+    assert deadlines.request_deadline(None, {'deadline_ms': 3000}, 100.0) == 103.0
+    assert deadlines.request_deadline(None, {'timeout_ms': 2000, 'deadline_ms': 3000}, 100.0) == 102.0
+
+
+@pytest.mark.parametrize('header, data', [
+    ('soon', {}),
+    (None, {'timeout_ms': 0}),
+    (None, {'timeout_ms': -5}),
+    (None, {'timeout_ms': True}),
+    (None, {'timeout_ms': '100'})
+])
+def test_invalid_deadlines(header, data):
+    with pytest.raises(ValueError):
+        deadlines.request_deadline(header, data, 100.0)
+
+
+def test_attempt_timeouts_split_the_time_left():
+    assert deadlines.attempt_timeouts(130.0, 3, now=100.0) == (5.0, 10.0)
+    assert deadlines.attempt_timeouts(200.0, 1, now=100.0) == (5.0, 30.0)
+    assert deadlines.attempt_timeouts(102.0, 1, now=100.0) == (2.0, 2.0)
+
+
+def test_slow_provider_gets_twice_its_typical_latency():
+    assert deadlines.attempt_timeouts(130.0, 3, expected_latency=8.0, now=100.0) == (5.0, 16.0)
+
+
+def test_first_attempt_is_made_while_time_is_left():
+    assert deadlines.attempt_timeouts(100.5, 3, expected_latency=0.045, now=100.0, first=True) == (0.5 / 3, 0.5 / 3)
+    assert deadlines.attempt_timeouts(100.5, 3, expected_latency=2.0, now=100.0, first=True) == (0.5, 0.5)
+    assert deadlines.attempt_timeouts(100.0, 3, now=100.0, first=True) is None
+
+
+def test_retry_needs_the_provider_latency():
+    assert deadlines.attempt_timeouts(100.5, 2, expected_latency=0.045, now=100.0) == (0.25, 0.25)
+    assert deadlines.attempt_timeouts(100.5, 2, expected_latency=2.0, now=100.0) is None
+    # An unmeasured provider gets whatever is left
+    assert deadlines.attempt_timeouts(100.5, 1, now=100.0) == (0.5, 0.5)
+
+
+def test_shortened():
+    assert deadlines.shortened((5.0, 10.0))
+    assert not deadlines.shortened((5.0, 30.0))
+    assert not deadlines.shortened(None)
+
+
+def test_too_slow_counts_each_provider_once_per_request():
+    latencies = {'fast': 1.0, 'slow': 20.0, 'unknown': None}
+    counted = set()
+    for _ in range(3):
+        assert deadlines.too_slow(latencies, 110.0, now=100.0, counted=counted) == ('slow',)
+    assert deadlines.deadline_stats['skipped_providers'] == 1
+    deadlines.too_slow(latencies, 110.0, now=100.0, counted=set())
+    assert deadlines.deadline_stats['skipped_providers'] == 2
@@ -0,0 +1,75 @@
+"""
+Fuzzy cache: prompt normalization, near-duplicate lookups and the index.
+"""
+
+from collections import OrderedDict
+
+import pytest
+
+import fuzzy_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_index(monkeypatch):
+    monkeypatch.setattr(fuzzy_cache, '_entries', OrderedDict())
+    monkeypatch.setattr(fuzzy_cache, '_buckets', {})
+    monkeypatch.setattr(fuzzy_cache, '_ids', {})
+    monkeypatch.setattr(fuzzy_cache, 'fuzzy_counters', dict.fromkeys(fuzzy_cache.fuzzy_counters, 0))
+
+
+def similar(a, b):
+    return fuzzy_cache.similarity(fuzzy_cache.signature(a), fuzzy_cache.signature(b))
+
+
+def test_ids_and_timestamps_are_masked():
+    assert fuzzy_cache.normalize('Order 3f2a9c1e-0b4d-4e5f-8a6b-7c8d9e0f1a2b at 2024-05-01T10:00:00Z') == [
+        'order', '<id>', 'at', '<time>'
+    ]
+    assert fuzzy_cache.normalize('since 1714557600 by 09:30 for deadbeef00112233') == [
+        'since', '<time>', 'by', '<time>', 'for', '<id>'
+    ]
+
+
+def test_small_numbers_are_kept():
+    assert fuzzy_cache.normalize('What is 2+2') == ['what', 'is', '2', '2']
+    assert similar('What is 2+2', 'What is 3+5') < 1.0
+    assert similar('Summarize the last 3 emails', 'Summarize the last 30 emails') < 1.0
+
+
+def test_templated_copies_match():
+    template = 'Summarize ticket {} for the on-call engineer and list the next steps to take today'
+    assert similar(
+        template.format('3f2a9c1e-0b4d-4e5f-8a6b-7c8d9e0f1a2b'), template.format('0a1b2c3d-4e5f-4a6b-8c7d-9e0f1a2b3c4d')
+    ) == 1.0
+
+
+def test_lookup_finds_a_near_duplicate():
+    prompt = 'Write a short friendly reply thanking the customer for their order and confirming delivery next week'
+    fuzzy_cache.put(prompt, 'scope', {'response': 'thanks'})
+    value, similarity = fuzzy_cache.lookup(prompt + '!', 'scope', 0.9)
+    assert value == {'response': 'thanks'}
+    assert similarity >= 0.9
+    assert fuzzy_cache.lookup(prompt, 'other scope', 0.9) == (None, 0.0)
+    assert fuzzy_cache.lookup('What is 2+2', 'scope', 0.9) == (None, 0.0)
+
+
+def test_arithmetic_prompts_do_not_share_answers():
+    fuzzy_cache.put('What is 2+2', 'scope', {'response': '4'})
+    assert fuzzy_cache.lookup('What is 3+5', 'scope', 0.9) == (None, 0.0)
+
+
+def test_same_prompt_is_indexed_once():
+    fuzzy_cache.put('What is 2+2', 'scope', {'response': 'four'})
+    fuzzy_cache.put('what is  2+2', 'scope', {'response': '4'})
+    assert len(fuzzy_cache._entries) == 1
+    assert fuzzy_cache.lookup('What is 2+2', 'scope', 0.9)[0] == {'response': '4'}
+
+
+def test_oldest_entries_are_evicted(monkeypatch):
+    monkeypatch.setitem(fuzzy_cache.fuzzy_settings, 'max_entries', 2)
+    for n in range(3):
+        fuzzy_cache.put(f'prompt number {n} about a different topic', 'scope', n)
+    assert len(fuzzy_cache._entries) == 2
+    assert fuzzy_cache.fuzzy_counters['evictions'] == 1
+    assert fuzzy_cache.lookup('prompt number 0 about a different topic', 'scope', 0.99) == (None, 0.0)
+    assert len(fuzzy_cache._ids) == 2
@@ -0,0 +1,110 @@
+"""
+Idempotency keys: who runs, who attaches, and which results are kept.
+"""
+
+import threading
+import time
+
+import pytest
+
+import idempotency
+
+
+@pytest.fixture(autouse=True)
+def empty_store(monkeypatch):
+    monkeypatch.setattr(idempotency, '_entries', idempotency.OrderedDict())
+    monkeypatch.setattr(idempotency, 'idempotency_stats', dict.fromkeys(idempotency.idempotency_stats, 0))
+    monkeypatch.setitem(idempotency.shared_state.state_settings, 'db_path', '')
+
+
+def begin(key, fingerprint='body'):
+    return idempotency._begin(key, fingerprint, threading.Event)
+
+
+def test_successful_result_is_replayed():
+    role, entry = begin('k')
+    assert role == 'lead'
+    idempotency._finish('k', entry, ({'success': True}, 200), owner=True)
+    role, replayed = begin('k')
+    assert role == 'replay'
+    assert replayed['result'] == ({'success': True}, 200)
+
+
+@pytest.mark.parametrize('status_code', [404, 413, 429, 500, 503])
+def test_errors_are_not_kept(status_code):
+    role, entry = begin('k')
+    idempotency._finish('k', entry, ({'success': False}, status_code), owner=True)
+    assert begin('k')[0] == 'lead'
+
+
+def test_attached_request_gets_an_error_result_too():
+    _, entry = begin('k')
+    role, attached = begin('k')
+    assert role == 'attach'
+    idempotency._finish('k', entry, ({'success': False, 'reason': 'tenant_budget'}, 429), owner=True)
+    assert attached['result'] == ({'success': False, 'reason': 'tenant_budget'}, 429)
+
+
+def test_missing_result_is_a_failure():
+    _, entry = begin('k')
+    idempotency._finish('k', entry, None, owner=True)
+    assert entry['result'][1] == 500
+    assert begin('k')[0] == 'lead'
+
+
+def test_key_reused_with_another_body_conflicts():
+    begin('k', 'one')
+    assert begin('k', 'two') == ('conflict', None)
+
+
+def test_call_runs_once_and_replays():
+    runs = []
+
+    def run():
+        runs.append(1)
+        return {'success': True, 'request_id': 'first'}, 200
+
+    assert idempotency.call('k', {'prompt': 'x'}, 'r1', run) == ({'success': True, 'request_id': 'first'}, 200, False)
+    body, status_code, replayed = idempotency.call('k', {'prompt': 'x'}, 'r2', run)
+    assert (status_code, replayed, body['idempotent_replay']) == (200, True, True)
+    assert len(runs) == 1
+
+
+def test_invalid_key_is_rejected():
+    body, status_code, replayed = idempotency.call('', {}, 'r1', lambda: ({}, 200))
+    assert status_code == 400
+
+
+def test_keys_are_scoped_to_the_tenant():
+    runs = []
+
+    def run():
+        runs.append(1)
+        return {'success': True}, 200
+
+    idempotency.call('k', {'prompt': 'x'}, 'r1', run, tenant='a')
+    assert idempotency.call('k', {'prompt': 'x'}, 'r2', run, tenant='b')[2] is False
+    assert idempotency.call('k', {'prompt': 'x'}, 'r3', run, tenant='a')[2] is True
+    assert len(runs) == 2
+
+
+def test_attached_request_stops_waiting_at_its_deadline():
+    begin(idempotency.scoped_key(None, 'k'), idempotency.fingerprint({'prompt': 'x'}))
+    started = time.time()
+    body, status_code, replayed = idempotency.call('k', {'prompt': 'x'}, 'r2', lambda: ({}, 200), deadline=started + 0.2)
+    assert status_code == 504
+    assert body['reason'] == 'deadline'
+    assert time.time() - started < 1
+
+
+def test_request_stops_polling_another_worker_at_its_deadline(monkeypatch):
+    monkeypatch.setitem(idempotency.shared_state.state_settings, 'db_path', 'shared.db')
+    monkeypatch.setattr(idempotency, '_claim', lambda key, request_fingerprint: ('wait', None))
+    runs = []
+    started = time.time()
+    body, status_code, replayed = idempotency.call(
+        'k', {'prompt': 'x'}, 'r1', lambda: runs.append(1), deadline=started + 0.3
+    )
+    assert status_code == 504
+    assert runs == []
+    assert time.time() - started < 1
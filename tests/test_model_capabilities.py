@@ -0,0 +1,77 @@
+"""
+Model capabilities: the local token estimate and which providers a request fits.
+"""
+
+import pytest
+
+import model_capabilities
+
+
+@pytest.fixture(autouse=True)
+def capabilities(monkeypatch):
+    monkeypatch.setattr(model_capabilities, 'capabilities', {
+        'small': {'context_window': 1000, 'max_input_tokens': 600, 'max_output_tokens': 500},
+        'large': {'context_window': 100000, 'max_input_tokens': None, 'max_output_tokens': 8000, 'relative_speed': 1.5},
+        'open': {}
+    })
+
+
+@pytest.mark.parametrize('text, tokens', [
+    ('', 0),
+    (None, 0),
+    ('Hello world', 2),
+    ('Hello, world!', 4),
+    ('internationalization', 4),  # split every ~6 letters
+    ('1234567', 3),                # numbers every 3 digits
+    ('日本語', 3),                  # about one token per character
+    ('def f(x): return x', 8)
+])
+def test_count_tokens(text, tokens):
+    assert model_capabilities.count_tokens(text) == tokens
+
+
+def test_estimate_is_close_for_english():
+    text = 'The quick brown fox jumps over the lazy dog. ' * 20
+    # tiktoken counts 10 tokens per sentence
+    assert model_capabilities.count_tokens(text) == pytest.approx(200, rel=0.1)
+
+
+def test_input_tokens_add_message_overhead():
+    overhead = model_capabilities.MESSAGE_OVERHEAD
+    assert model_capabilities.input_tokens('Hello world') == 2 + overhead
+    assert model_capabilities.input_tokens('Hello world', 'Be brief') == 4 + 2 * overhead
+
+
+def test_fits_checks_every_limit():
+    assert model_capabilities.fits('small', 400, 400)
+    assert not model_capabilities.fits('small', 700, 100)  # input limit
+    assert not model_capabilities.fits('small', 100, 600)  # output limit
+    assert not model_capabilities.fits('small', 550, 500)  # context window
+    assert model_capabilities.fits('open', 10 ** 9, 10 ** 9)
+    assert model_capabilities.fits('unknown', 10 ** 9, 10 ** 9)
+
+
+def test_route_limits_override_the_provider_model():
+    assert not model_capabilities.fits('large', 100, 16000)
+    assert model_capabilities.fits('large', 100, 16000, {'max_output_tokens': 16384})
+    assert not model_capabilities.fits('large', 5000, 100, {'context_window': 4096})
+
+
+def test_unfit_providers():
+    assert model_capabilities.unfit_providers(('small', 'large', 'open'), 700, 100) == ('small',)
+    assert model_capabilities.unfit_providers(('small', 'large'), 200000, 100) == ('small', 'large')
+    assert model_capabilities.unfit_providers(('small',), 700, 100, {'small': {'max_input_tokens': 800}}) == ()
+
+
+def test_relative_speed():
+    assert model_capabilities.relative_speed('large') == 1.5
+    assert model_capabilities.relative_speed('small') == 1.0
+
+
+def test_request_no_provider_fits_gets_413(router, monkeypatch):
+    monkeypatch.setattr(model_capabilities, 'capabilities', {
+        provider: {'context_window': 1000} for provider in router.provider_status
+    })
+    response = router.app.test_client().post('/ai-request', json={'prompt': 'word ' * 2000, 'cache': 'bypass'})
+    assert response.status_code == 413
+    assert response.get_json()['estimated_tokens'] == 2000 + model_capabilities.MESSAGE_OVERHEAD + 1000
@@ -0,0 +1,51 @@
+"""
+Model routes: ordered provider/model candidates per model_type.
+"""
+
+import pytest
+
+import model_routes
+
+
+@pytest.fixture
+def routes(monkeypatch):
+    def load(override=''):
+        monkeypatch.setenv('AI_ROUTER_MODEL_ROUTES', override)
+        monkeypatch.setattr(model_routes, 'routes', model_routes.load_routes())
+    return load
+
+
+def test_default_routes(routes):
+    routes()
+    assert model_routes.providers('chat') == ('google_gemini', 'openrouter', 'github_models')
+    assert model_routes.models('code')['github_models'] == 'gpt-4o'
+    assert model_routes.models('chat')['github_models'] == 'gpt-4o-mini'
+
+
+def test_unknown_model_type_uses_the_default_route(routes):
+    routes()
+    assert model_routes.route('poetry') == model_routes.route('default')
+
+
+def test_override_replaces_whole_model_types(routes):
+    routes('{"chat": [{"provider": "openrouter", "model": "m", "max_output_tokens": 512}]}')
+    assert model_routes.providers('chat') == ('openrouter',)
+    assert model_routes.limits('chat', 'openrouter') == {'max_output_tokens': 512}
+    assert model_routes.limits('chat', 'github_models') == {}
+    assert model_routes.providers('code')[0] == 'github_models'
+
+
+@pytest.mark.parametrize('override', ['not json', '{"chat": [{"model": "m"}]}', '{"chat": 5}'])
+def test_invalid_override_keeps_the_defaults(routes, override):
+    routes(override)
+    assert model_routes.providers('chat') == ('google_gemini', 'openrouter', 'github_models')
+
+
+def test_provider_is_tried_once_per_route(routes):
+    routes('{"chat": [{"provider": "openrouter", "model": "a"}, {"provider": "openrouter", "model": "b"}]}')
+    assert model_routes.route('chat') == [{'provider': 'openrouter', 'model': 'a'}]
+
+
+def test_providers_filters_known(routes):
+    routes()
+    assert model_routes.providers('chat', known={'github_models'}) == ('github_models',)
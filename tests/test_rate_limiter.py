@@ -0,0 +1,77 @@
+"""
+Rate limiter: token buckets per provider and per key.
+"""
+
+import pytest
+
+import rate_limiter
+
+
+@pytest.fixture(autouse=True)
+def limits():
+    rate_limiter.configure({'p': {'rpm': 2, 'tpm': 1000}, 'q': {'rpd': 10}})
+    yield
+    rate_limiter.configure({})
+
+
+def test_requests_use_up_the_bucket():
+    assert rate_limiter.has_capacity('p', 100)
+    rate_limiter.acquire('p', 100)
+    rate_limiter.acquire('p', 100)
+    assert not rate_limiter.has_capacity('p', 100)
+    # One request refills in 60s / 2
+    assert rate_limiter.wait_time('p', 100) == pytest.approx(30, abs=0.5)
+
+
+def test_tokens_use_up_the_bucket():
+    rate_limiter.acquire('p', 900)
+    assert not rate_limiter.has_capacity('p', 200)
+    assert rate_limiter.has_capacity('p', 50)
+
+
+def test_request_larger_than_the_bucket_fits_when_full():
+    assert rate_limiter.has_capacity('p', 5000)
+
+
+def test_release_gives_back_a_reservation():
+    rate_limiter.acquire('p', 100)
+    rate_limiter.acquire('p', 100)
+    rate_limiter.release('p', 100)
+    assert rate_limiter.has_capacity('p', 100)
+    rate_limiter.release('p', 100)
+    rate_limiter.release('p', 100)
+    assert rate_limiter.bucket_levels()['p']['rpm']['available'] == pytest.approx(2, abs=0.01)
+
+
+def test_settle_corrects_the_token_estimate():
+    rate_limiter.acquire('p', 900)
+    rate_limiter.settle('p', 900, 100)
+    assert rate_limiter.has_capacity('p', 800)
+
+
+def test_keys_get_their_own_buckets():
+    rate_limiter.acquire('p#key1', 0)
+    rate_limiter.acquire('p#key1', 0)
+    assert not rate_limiter.has_capacity('p#key1')
+    assert rate_limiter.has_capacity('p#key2')
+    assert rate_limiter.has_capacity('p')
+
+
+def test_unknown_names_are_unlimited():
+    for _ in range(5):
+        rate_limiter.acquire('unknown', 100)
+    assert rate_limiter.has_capacity('unknown', 100)
+    assert rate_limiter.wait_time('unknown', 100) == 0
+    assert rate_limiter.headroom('unknown') == 1.0
+
+
+def test_headroom_is_the_tightest_bucket():
+    rate_limiter.acquire('p', 0)
+    assert rate_limiter.headroom('p') == pytest.approx(0.5, abs=0.01)
+
+
+def test_workers_split_the_limits(monkeypatch):
+    monkeypatch.setenv('AI_ROUTER_RATE_LIMITS', '{"p": {"rpm": 8}}')
+    assert rate_limiter.load_limits(workers=4)['p']['rpm'] == 2
+    monkeypatch.setenv('AI_ROUTER_RATE_LIMITS', 'off')
+    assert rate_limiter.load_limits() == {}
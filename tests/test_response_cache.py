@@ -0,0 +1,73 @@
+"""
+Response cache: keys, LRU and TTL eviction, and the SQLite tier.
+"""
+
+from collections import OrderedDict
+
+import pytest
+
+import response_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(response_cache, '_entries', OrderedDict())
+    monkeypatch.setattr(response_cache, '_disk', None)
+    monkeypatch.setattr(response_cache, 'cache_counters', dict.fromkeys(response_cache.cache_counters, 0))
+    monkeypatch.setitem(response_cache.cache_settings, 'disk_path', '')
+    yield
+    if response_cache._disk is not None:
+        response_cache._disk.close()
+
+
+def test_key_ignores_surrounding_whitespace():
+    key = response_cache.cache_key('Hello', '', 'chat', 1000, 0.7)
+    assert response_cache.cache_key('  Hello\n', None, 'chat', 1000.0, 0.7000001) == key
+    assert response_cache.cache_key('Hello', 'Be brief', 'chat', 1000, 0.7) != key
+    assert response_cache.cache_key('Hello', '', 'code', 1000, 0.7) != key
+    assert response_cache.cache_key('Hello', '', 'chat', 500, 0.7) != key
+
+
+def test_put_and_get():
+    response_cache.put('k', {'response': 'hi'})
+    assert response_cache.get('k') == {'response': 'hi'}
+    assert response_cache.get('missing') is None
+    stats = response_cache.cache_stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
+
+
+def test_entries_expire(monkeypatch):
+    monkeypatch.setitem(response_cache.cache_settings, 'ttl_seconds', -1)
+    response_cache.put('k', {'response': 'hi'})
+    assert response_cache.get('k') is None
+    assert response_cache.cache_counters['expirations'] == 1
+    assert response_cache.cache_counters['bytes'] == 0
+
+
+def test_least_recently_used_is_evicted(monkeypatch):
+    monkeypatch.setitem(response_cache.cache_settings, 'max_entries', 2)
+    response_cache.put('a', 1)
+    response_cache.put('b', 2)
+    response_cache.get('a')
+    response_cache.put('c', 3)
+    assert response_cache.get('b') is None
+    assert response_cache.get('a') == 1
+    assert response_cache.cache_counters['evictions'] == 1
+
+
+def test_size_limit(monkeypatch):
+    monkeypatch.setitem(response_cache.cache_settings, 'max_bytes', 20)
+    response_cache.put('a', 'x' * 10)
+    response_cache.put('b', 'y' * 10)
+    assert response_cache.get('a') is None
+    assert response_cache.cache_counters['bytes'] <= 20
+
+
+def test_disk_tier_survives_the_memory_tier(monkeypatch, tmp_path):
+    monkeypatch.setitem(response_cache.cache_settings, 'disk_path', str(tmp_path / 'cache.db'))
+    response_cache.put('k', {'response': 'hi'})
+    response_cache._entries.clear()
+    assert response_cache.get('k') == {'response': 'hi'}
+    assert response_cache.cache_counters['disk_hits'] == 1
+    response_cache.clear()
+    assert response_cache.get('k') is None
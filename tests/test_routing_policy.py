@@ -0,0 +1,77 @@
+"""
+Routing policies: rolling provider statistics and how each policy picks.
+"""
+
+import pytest
+
+import model_capabilities
+import routing_policy
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    monkeypatch.setattr(routing_policy, 'provider_stats', {})
+    monkeypatch.setitem(routing_policy.policy_settings, 'ewma_alpha', 0.5)
+    monkeypatch.setitem(routing_policy.policy_settings, 'weights', {})
+    monkeypatch.setitem(routing_policy.policy_settings, 'default', 'priority')
+
+
+def test_ewma_latency_and_error_rate():
+    routing_policy.record_outcome('p', 2.0, True)
+    routing_policy.record_outcome('p', 4.0, True)
+    routing_policy.record_outcome('p', None, False)
+    assert routing_policy.typical_latency('p') == 3.0
+    assert routing_policy.provider_stats['p']['error_rate'] == 0.5
+    assert routing_policy.typical_latency('unknown') is None
+
+
+def test_priority_keeps_the_order():
+    routing_policy.record_outcome('b', 0.1, True)
+    assert routing_policy.choose(['a', 'b']) == 'a'
+    assert routing_policy.choose([]) is None
+
+
+def test_least_outstanding():
+    routing_policy.track_outstanding('a', 2)
+    routing_policy.track_outstanding('b', 1)
+    assert routing_policy.choose(['a', 'b'], 'least_outstanding') == 'b'
+    routing_policy.track_outstanding('a', -2)
+    assert routing_policy.choose(['a', 'b'], 'least_outstanding') == 'a'
+
+
+def test_lowest_latency_counts_errors():
+    routing_policy.record_outcome('fast', 1.0, True)
+    routing_policy.record_outcome('slow', 1.5, True)
+    assert routing_policy.choose(['slow', 'fast'], 'lowest_latency') == 'fast'
+    routing_policy.record_outcome('fast', None, False)
+    # Half of fast's calls fail, so it costs about two attempts
+    assert routing_policy.choose(['slow', 'fast'], 'lowest_latency') == 'slow'
+
+
+def test_lowest_latency_tries_unmeasured_providers_fastest_first(monkeypatch):
+    monkeypatch.setattr(model_capabilities, 'capabilities', {'a': {'relative_speed': 1.0}, 'b': {'relative_speed': 1.5}})
+    routing_policy.record_outcome('c', 0.1, True)
+    assert routing_policy.choose(['a', 'b', 'c'], 'lowest_latency') == 'b'
+
+
+def test_weighted_round_robin_follows_weights(monkeypatch):
+    monkeypatch.setitem(routing_policy.policy_settings, 'weights', {'a': 3})
+    picks = [routing_policy.choose(['a', 'b'], 'weighted_round_robin') for _ in range(8)]
+    assert picks.count('a') == 6
+    # Smooth: the lighter provider isn't starved until the end
+    assert 'b' in picks[:4]
+
+
+def test_weighted_round_robin_shifts_away_from_lost_headroom():
+    picks = [routing_policy.choose(['a', 'b'], 'weighted_round_robin', {'a': 0.25}) for _ in range(5)]
+    assert picks.count('b') == 4
+
+
+def test_snapshot_round_trip():
+    routing_policy.record_outcome('p', 2.0, True)
+    routing_policy.track_outstanding('p', 3)
+    saved = routing_policy.export_stats()
+    routing_policy.provider_stats.clear()
+    routing_policy.restore_stats(saved)
+    assert routing_policy.typical_latency('p') == 2.0
+    assert routing_policy.provider_stats['p']['outstanding'] == 0
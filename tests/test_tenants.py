@@ -0,0 +1,78 @@
+"""
+Tenants: identity, budgets and usage counters.
+"""
+
+import pytest
+
+import rate_limiter
+import tenants
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(tenants, 'usage', {})
+    monkeypatch.setitem(tenants.tenant_settings, 'budgets', {'small': {'rpm': 2, 'tpm': 1000}, '*': {'rpm': 100}})
+    monkeypatch.setitem(tenants.tenant_settings, 'weights', {'heavy': 3})
+    monkeypatch.setitem(tenants.tenant_settings, 'max_tenants', 3)
+    rate_limiter.configure({})
+    yield
+    rate_limiter.configure({})
+
+
+def test_tenant_from_header_or_field():
+    assert tenants.tenant_id('wf-1', {'tenant': 'wf-2'}) == 'wf-1'
+    assert tenants.tenant_id(None, {'tenant': 'wf-2'}) == 'wf-2'
+    assert tenants.tenant_id(None, {}) == tenants.DEFAULT_TENANT
+
+
+@pytest.mark.parametrize('tenant', ['has space', 'x' * 65, 5])
+def test_invalid_tenant(tenant):
+    with pytest.raises(ValueError):
+        tenants.tenant_id(None, {'tenant': tenant})
+
+
+def test_tenants_beyond_the_limit_share_one_entry():
+    for name in ('a', 'b', 'c'):
+        tenants.tenant_id(name, {})
+    assert tenants.tenant_id('d', {}) == tenants.OTHER_TENANT
+    assert tenants.tenant_id('a', {}) == 'a'
+
+
+def test_weights():
+    assert tenants.weight('heavy') == 3.0
+    assert tenants.weight('other') == 1.0
+
+
+def test_budget_is_charged_and_spent():
+    tenants.tenant_id('small', {})
+    assert tenants.admit('small', 100) is None
+    assert tenants.admit('small', 100) is None
+    retry_after = tenants.admit('small', 100)
+    assert retry_after == pytest.approx(30, abs=0.5)
+    assert tenants.usage['small'] == dict(tenants._new_usage(), requests=3, rejected=1, tokens_charged=200)
+
+
+def test_catch_all_budget():
+    tenants.tenant_id('other', {})
+    assert tenants.admit('other', 100) is None
+    assert 'tenant:other' in rate_limiter.bucket_levels()
+
+
+def test_outcomes_are_counted():
+    tenants.tenant_id('small', {})
+    tenants.admit('small', 900)
+    tenants.record('small', 'succeeded', 900, 100)
+    # Settling gives back the tokens the estimate overcharged
+    assert rate_limiter.has_capacity('tenant:small', 800)
+    tenants.count_cached('small')
+    assert tenants.usage['small']['succeeded'] == 1
+    assert tenants.usage['small']['cached'] == 1
+    assert tenants.usage['small']['tokens_used'] == 100
+    assert tenants.usage['small']['requests'] == 2
+
+
+def test_cache_hits_leave_the_budget_alone():
+    tenants.tenant_id('small', {})
+    for _ in range(5):
+        tenants.count_cached('small')
+    assert tenants.admit('small', 100) is None